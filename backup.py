@@ -0,0 +1,42 @@
+import argparse
+import json
+import sys
+
+from lab_app import run_backup, list_backups, verify_backup, restore_backup, init_db
+
+# نسخة احتياطية من lab.db (وملفات النتائج) أثناء عمل النظام
+# مثال:
+#   python backup.py                          # نسخة جديدة في مجلد backups
+#   python backup.py --list
+#   python backup.py --verify                 # التحقق من كل النسخ (بصمة + integrity_check + ملفات النتائج)
+#   python backup.py --restore lab-20260101-020000 --to restored.db --files-to restored_files
+
+parser = argparse.ArgumentParser(description="Online backup of the lab database")
+parser.add_argument("--no-files", action="store_true", help="قاعدة البيانات فقط بدون ملفات النتائج")
+parser.add_argument("--list", action="store_true")
+parser.add_argument("--verify", action="store_true")
+parser.add_argument("--restore", metavar="NAME")
+parser.add_argument("--to", default="restored.db")
+parser.add_argument("--files-to")
+args = parser.parse_args()
+
+if args.list:
+    for manifest in list_backups():
+        print(f"{manifest['name']}  {manifest['created_at']}  {len(manifest.get('files', {}))} files")
+elif args.verify:
+    failed = 0
+    for manifest in list_backups():
+        result = verify_backup(manifest, check_files=True)
+        failed += not result["ok"]
+        print(f"{result['name']}: {'ok' if result['ok'] else ', '.join(result['problems'])}")
+    sys.exit(1 if failed else 0)
+elif args.restore:
+    manifest = next((m for m in list_backups() if m["name"] == args.restore), None)
+    if manifest is None:
+        sys.exit(f"Backup {args.restore} not found")
+    restore_backup(manifest, args.to, args.files_to)
+    print(f"Restored {args.restore} to {args.to}")
+else:
+    init_db()
+    manifest = run_backup(include_files=not args.no_files)
+    print(json.dumps({k: v for k, v in manifest.items() if k != "files"}, indent=1) if manifest else "Backup already running")
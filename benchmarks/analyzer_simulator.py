@@ -0,0 +1,218 @@
+"""محاكي أجهزة التحليل: يرسل نتائج ASTM E1394 أو HL7 ORU^R01 لمستقبل lab_app ويقيس الأداء
+
+يقيس عدد الرسائل في الثانية وزمن الرسالة: في HL7 من الإرسال حتى ACK (بعد الحفظ في القاعدة)،
+وفي ASTM من ENQ حتى EOT (الحفظ يتم بعدها، ومع --local يُطبع زمن الحفظ من مقاييس الخادم).
+
+مثال:
+    python benchmarks/analyzer_simulator.py --local --protocol hl7 --connections 8 --messages 5000
+    python benchmarks/analyzer_simulator.py --port 5600 --protocol astm --db lab.db
+    python benchmarks/analyzer_simulator.py --port 5600 --replay capture.txt --db lab.db
+ملف --replay: رسائل مسجلة من جهاز حقيقي بينها سطر فارغ، و {pin} يُستبدل بـ PIN طلب موجود.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ENQ, ACK, EOT, STX, ETX, ETB = b"\x05", b"\x06", b"\x04", b"\x02", b"\x03", b"\x17"
+MLLP_START, MLLP_END = b"\x0b", b"\x1c\r"
+ANALYTES = [("GLU", "mg/dL", "70-110"), ("UREA", "mg/dL", "15-45"), ("CREA", "mg/dL", "0.6-1.2"),
+            ("ALT", "U/L", "0-41"), ("AST", "U/L", "0-40"), ("HGB", "g/dL", "12-16"),
+            ("WBC", "10^3/uL", "4-11"), ("PLT", "10^3/uL", "150-400"), ("TSH", "uIU/mL", "0.4-4.0")]
+
+parser = argparse.ArgumentParser(description="ASTM / HL7 analyzer traffic simulator")
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=int(os.getenv("ANALYZER_PORT", "5600")))
+parser.add_argument("--protocol", choices=["astm", "hl7"], default="hl7")
+parser.add_argument("--connections", type=int, default=4, help="عدد الأجهزة المتصلة في نفس الوقت")
+parser.add_argument("--messages", type=int, default=2000)
+parser.add_argument("--results", type=int, default=5, help="عدد التحاليل في كل رسالة")
+parser.add_argument("--db", help="قاعدة بيانات لقراءة PINs طلبات حقيقية (بدونها PINs عشوائية لا تطابق)")
+parser.add_argument("--replay", help="ملف رسائل مسجلة لإعادة إرسالها بدلاً من الرسائل المولدة")
+parser.add_argument("--local", action="store_true", help="تشغيل المستقبل داخل نفس العملية على قاعدة مؤقتة")
+args = parser.parse_args()
+
+
+def astm_frames(records):
+    """كل سجل في إطار (أو أكثر لو تجاوز 240 حرفاً) مع رقم الإطار والـ checksum"""
+    frames = []
+    number = 1
+    for record in records:
+        text = (record + "\r").encode("latin-1")
+        chunks = [text[i:i + 240] for i in range(0, len(text), 240)]
+        for i, chunk in enumerate(chunks):
+            body = str(number % 8).encode() + chunk + (ETX if i == len(chunks) - 1 else ETB)
+            frames.append(STX + body + b"%02X" % (sum(body) & 0xFF) + b"\r\n")
+            number += 1
+    return frames
+
+
+def astm_message(pin, results):
+    now = datetime.now().strftime("%Y%m%d%H%M%S")
+    records = [f"H|\\^&|||SIM-ASTM^1.0|||||||P|1|{now}", "P|1", f"O|1|{pin}||^^^PANEL|R|{now}"]
+    for i, (code, units, reference, value, flag) in enumerate(results, 1):
+        records.append(f"R|{i}|^^^{code}|{value}|{units}|{reference}|{flag}||F||||{now}")
+    records.append("L|1|N")
+    return records
+
+
+def hl7_message(pin, results, control_id):
+    now = datetime.now().strftime("%Y%m%d%H%M%S")
+    segments = [f"MSH|^~\\&|SIM-HL7|LAB|LIS|LAB|{now}||ORU^R01|{control_id}|P|2.5",
+                "PID|1", f"OBR|1||{pin}|PANEL"]
+    for i, (code, units, reference, value, flag) in enumerate(results, 1):
+        segments.append(f"OBX|{i}|NM|{code}^{code}||{value}|{units}|{reference}|{flag}|||F|||{now}")
+    return "\r".join(segments) + "\r"
+
+
+def random_results():
+    chosen = random.sample(ANALYTES, min(args.results, len(ANALYTES)))
+    results = []
+    for code, units, reference in chosen:
+        low, high = (float(x) for x in reference.split("-"))
+        value = round(random.uniform(low * 0.7, high * 1.3), 1)
+        flag = "L" if value < low else "H" if value > high else "N"
+        results.append((code, units, reference, value, flag))
+    return results
+
+
+def load_pins(path, limit=50000):
+    if not path:
+        return [f"9{random.randrange(10 ** 8):08d}" for _ in range(1000)]
+    with sqlite3.connect(path) as conn:
+        pins = [row[0] for row in conn.execute("SELECT pin FROM orders ORDER BY id DESC LIMIT ?", (limit,))]
+    if not pins:
+        sys.exit(f"No orders in {path}")
+    return pins
+
+
+def load_replay(path):
+    with open(path, encoding="utf-8") as f:
+        return [block.strip() for block in f.read().replace("\r\n", "\n").split("\n\n") if block.strip()]
+
+
+async def read_exact_byte(reader):
+    byte = await reader.read(1)
+    if not byte:
+        raise ConnectionError("connection closed")
+    return byte
+
+
+async def astm_client(messages, latencies, stats):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    try:
+        for records in messages:
+            start = time.perf_counter()
+            writer.write(ENQ)
+            await writer.drain()
+            if await read_exact_byte(reader) != ACK:
+                stats["rejected"] += 1
+                continue
+            for frame in astm_frames(records):
+                # الجهاز يعيد الإطار عند NAK (حتى 6 مرات حسب المعيار)
+                for _ in range(6):
+                    writer.write(frame)
+                    await writer.drain()
+                    if await read_exact_byte(reader) == ACK:
+                        break
+                    stats["naks"] += 1
+            writer.write(EOT)
+            await writer.drain()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def hl7_client(messages, latencies, stats):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    try:
+        for message in messages:
+            start = time.perf_counter()
+            writer.write(MLLP_START + message.encode("utf-8") + MLLP_END)
+            await writer.drain()
+            ack = await reader.readuntil(MLLP_END)
+            latencies.append(time.perf_counter() - start)
+            if b"MSA|AA" not in ack:
+                stats["rejected"] += 1
+    finally:
+        writer.close()
+
+
+def build_messages(pins):
+    control_ids = itertools.count(1)
+    templates = load_replay(args.replay) if args.replay else None
+    messages = []
+    for _ in range(args.messages):
+        pin = random.choice(pins)
+        if templates:
+            text = random.choice(templates).replace("{pin}", pin)
+            messages.append(text.replace("\n", "\r") if text.startswith("MSH") else text.splitlines())
+        elif args.protocol == "hl7":
+            messages.append(hl7_message(pin, random_results(), next(control_ids)))
+        else:
+            messages.append(astm_message(pin, random_results()))
+    return messages
+
+
+async def start_local():
+    """lab_app على قاعدة مؤقتة فيها طلبات بعدد الرسائل، والمستقبل على منفذ عشوائي"""
+    workdir = tempfile.mkdtemp(prefix="lab_analyzer_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.chdir(workdir)
+    import lab_app
+
+    lab_app.init_db()
+    with lab_app.engine.begin() as conn:
+        conn.execute(lab_app.insert(lab_app.Patient), [{"name": f"Patient {i}"} for i in range(1000)])
+        conn.execute(lab_app.insert(lab_app.TestOrder), [{
+            "patient_id": i % 1000 + 1, "patient_name": f"Patient {i % 1000}", "test_name": "Panel",
+            "price": 100, "pin": f"{100000 + i}"
+        } for i in range(max(args.messages, 1000))])
+    lab_app.audit.start()
+    await lab_app.analyzer_listener.start(args.host, 0)
+    args.port = lab_app.analyzer_listener.server.sockets[0].getsockname()[1]
+    return lab_app, os.path.join(workdir, "bench.db")
+
+
+async def main():
+    lab_app = None
+    db_path = args.db
+    if args.local:
+        lab_app, db_path = await start_local()
+    messages = build_messages(load_pins(db_path))
+    client = hl7_client if isinstance(messages[0], str) else astm_client
+    latencies = []
+    stats = {"rejected": 0, "naks": 0}
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(messages[i::args.connections], latencies, stats) for i in range(args.connections)))
+    elapsed = time.perf_counter() - start
+
+    protocol = "hl7" if client is hl7_client else "astm"
+    latencies.sort()
+    print(f"{protocol}: {len(latencies)} messages over {args.connections} connections in {elapsed:.2f}s")
+    print(f"throughput: {len(latencies) / elapsed:.0f} messages/s")
+    print(f"latency p50 {statistics.median(latencies) * 1000:.1f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+    print(f"rejected: {stats['rejected']}, NAK retries: {stats['naks']}")
+
+    if lab_app:
+        await lab_app.analyzer_listener.stop()
+        lab_app.audit.stop()
+        for counts, total in lab_app.ANALYZER_LATENCY.series.values():
+            print(f"receive-to-commit mean {total / sum(counts) * 1000:.1f} ms")
+        for counts, total in lab_app.ANALYZER_BATCH.series.values():
+            print(f"commits: {sum(counts)}, mean batch {total / sum(counts):.1f} messages")
+        with sqlite3.connect(db_path) as conn:
+            print(f"stored result values: {conn.execute('SELECT COUNT(*) FROM result_values').fetchone()[0]}")
+
+
+asyncio.run(main())
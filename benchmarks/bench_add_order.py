@@ -0,0 +1,69 @@
+"""قياس زمن إنشاء الطلب (/add_order) تحت ضغط متزامن
+
+مثال: python benchmarks/bench_add_order.py --threads 8 --orders 2000 --patients 300
+يعمل على قاعدة بيانات مؤقتة ولا يلمس lab.db.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+parser = argparse.ArgumentParser(description="add_order latency under concurrency")
+parser.add_argument("--threads", type=int, default=8)
+parser.add_argument("--orders", type=int, default=2000)
+parser.add_argument("--patients", type=int, default=300, help="عدد المرضى المختلفين (الأقل = تعارض أكثر)")
+args = parser.parse_args()
+
+workdir = tempfile.mkdtemp(prefix="lab_bench_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(workdir)
+
+from fastapi.testclient import TestClient  # noqa: E402
+import lab_app  # noqa: E402
+
+latencies = []
+errors = []
+lock = threading.Lock()
+
+
+def worker(count):
+    with TestClient(lab_app.app) as client:
+        client.post("/login", data={"username": "admin", "password": "admin123"}, follow_redirects=False)
+        for _ in range(count):
+            n = random.randrange(args.patients)
+            start = time.perf_counter()
+            r = client.post("/add_order", data={
+                "name": f"مريض {n}", "phone": f"010{n:08d}", "test": "CBC", "price": "100"
+            }, follow_redirects=False)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if r.status_code != 303:
+                    errors.append(r.status_code)
+
+
+per_thread = args.orders // args.threads
+threads = [threading.Thread(target=worker, args=(per_thread,)) for _ in range(args.threads)]
+started = time.perf_counter()
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+total = time.perf_counter() - started
+
+db = lab_app.SessionLocal()
+patients = db.query(lab_app.Patient).count()
+orders = db.query(lab_app.TestOrder).count()
+db.close()
+
+latencies.sort()
+ms = [x * 1000 for x in latencies]
+print(f"orders: {len(ms)} in {total:.2f}s ({len(ms) / total:.0f} orders/s), errors: {len(errors)}")
+print(f"latency ms  p50={statistics.median(ms):.2f}  p95={ms[int(len(ms) * 0.95)]:.2f}  "
+      f"p99={ms[int(len(ms) * 0.99)]:.2f}  max={ms[-1]:.2f}")
+print(f"patients in db: {patients} (expected <= {args.patients}), orders in db: {orders}")
@@ -0,0 +1,88 @@
+"""قياس زمن استيراد lab_app (الإقلاع البارد لكل worker) باستخدام python -X importtime
+
+مثال:
+    python benchmarks/bench_import.py                      # تشغيل ومقارنة مع benchmarks/import_baseline.json
+    python benchmarks/bench_import.py --update-baseline    # حفظ النتائج الحالية كخط أساس
+    python benchmarks/bench_import.py --top 30             # أثقل 30 مكتبة يستوردها lab_app
+يرجع exit code 1 إذا كان الاستيراد أبطأ من خط الأساس بأكثر من --threshold.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+parser = argparse.ArgumentParser(description="Cold import time of lab_app")
+parser.add_argument("--runs", type=int, default=7)
+parser.add_argument("--top", type=int, default=15)
+parser.add_argument("--baseline", default=os.path.join(BENCH_DIR, "import_baseline.json"))
+parser.add_argument("--threshold", type=float, default=0.3, help="نسبة التراجع المسموحة (0.3 = 30%%)")
+parser.add_argument("--update-baseline", action="store_true")
+args = parser.parse_args()
+
+workdir = tempfile.mkdtemp(prefix="lab_import_")
+env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}", PYTHONDONTWRITEBYTECODE="")
+
+
+def run_once():
+    """عملية بايثون جديدة في كل مرة: يرجع {module: (self_us, cumulative_us, depth)}"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import lab_app"],
+                          cwd=REPO_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.exit(proc.stderr[-2000:])
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    # importtime يطبع الوحدة بعد كل ما استوردته: شجرة lab_app هي الأسطر التي قبله حتى أول سطر بعمق 0
+    # (ما يستورده بايثون نفسه عند البدء مثل site و encodings لا يدخل في القياس)
+    end = next(i for i, entry in enumerate(entries) if entry[0] == "lab_app")
+    start = end
+    while start > 0 and entries[start - 1][3] > 0:
+        start -= 1
+    return {name: (self_us, cumulative_us, depth) for name, self_us, cumulative_us, depth in entries[start:end + 1]}
+
+
+run_once()  # تشغيل أول لكتابة ملفات .pyc حتى لا تدخل الترجمة في القياس
+runs = [run_once() for _ in range(args.runs)]
+
+total_ms = statistics.median(r["lab_app"][1] for r in runs) / 1000
+self_ms = statistics.median(r["lab_app"][0] for r in runs) / 1000
+# المكتبات التي يستوردها lab_app مباشرة (العمق 1) مرتبة حسب الزمن التراكمي
+direct = {}
+for name, (_, cumulative, depth) in runs[-1].items():
+    if depth == 1:
+        direct[name] = statistics.median(r[name][1] for r in runs if name in r) / 1000
+heaviest = sorted(direct.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+print(f"lab_app import: {total_ms:.1f} ms (module body {self_ms:.1f} ms), median of {args.runs} runs")
+print(f"{'module':<40}{'cumulative ms':>15}")
+for name, ms in heaviest:
+    print(f"{name:<40}{ms:>15.1f}")
+
+results = {"import_ms": round(total_ms, 1), "module_body_ms": round(self_ms, 1),
+           "modules": {name: round(ms, 1) for name, ms in heaviest}}
+
+baseline = {}
+if os.path.exists(args.baseline):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+if args.update_baseline:
+    with open(args.baseline, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Baseline saved to {args.baseline}")
+elif baseline:
+    change = (total_ms - baseline["import_ms"]) / baseline["import_ms"]
+    print(f"vs baseline {baseline['import_ms']} ms: {change:+.0%}")
+    if change > args.threshold:
+        sys.exit("Import time regression")
@@ -0,0 +1,93 @@
+"""قياس سرعة توليد تقارير PDF (تقرير/ثانية): رسم جديد في عمليات منفصلة، وإعادة الطباعة من النسخة المحفوظة
+
+مثال: python benchmarks/bench_reports.py --reports 200 --workers 4 --analytes 12
+يعمل على مجلد مؤقت ولا يلمس lab.db ولا results_files.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+ANALYTES = [("GLU", "mg/dL", "70-110"), ("UREA", "mg/dL", "15-45"), ("CREA", "mg/dL", "0.6-1.2"),
+            ("ALT", "U/L", "0-41"), ("AST", "U/L", "0-40"), ("HGB", "g/dL", "12-16"), ("WBC", "10^3/uL", "4-11"),
+            ("PLT", "10^3/uL", "150-400"), ("TSH", "uIU/mL", "0.4-4.0"), ("K", "mmol/L", "3.5-5.1"),
+            ("NA", "mmol/L", "135-145"), ("CHOL", "mg/dL", "0-200")]
+
+
+def make_content(n):
+    patient = SimpleNamespace(name=f"محمد أحمد {n}", age=random.randint(1, 90))
+    orders = [SimpleNamespace(id=1, test_name="تحاليل كيمياء الدم", created_at=datetime.now())]
+    values = []
+    for i in range(args.analytes):
+        code, units, reference = ANALYTES[i % len(ANALYTES)]
+        low, high = (float(x) for x in reference.split("-"))
+        value = round(random.uniform(low * 0.7, high * 1.3), 1)
+        flag = "L" if value < low else "H" if value > high else None
+        values.append(SimpleNamespace(order_id=1, analyte=f"{code}{i // len(ANALYTES) or ''}", value=str(value),
+                                      units=units, reference_range=reference, flag=flag))
+    settings = SimpleNamespace(default_language=args.lang, lab_name="مختبر الشفاء للتحاليل الطبية",
+                               logo_path="/static/images/logo.png")
+    return lab_app.report_content(settings, patient, orders, values, f"{100000 + n}")
+
+
+async def run(contents):
+    start = time.perf_counter()
+    await asyncio.gather(*(lab_app.render_report_cached(c) for c in contents))
+    return time.perf_counter() - start
+
+
+async def main():
+    contents = [make_content(n) for n in range(args.reports)]
+
+    # أول تقرير في كل عملية يحمّل reportlab والخط: تشغيل تمهيدي خارج القياس
+    start = time.perf_counter()
+    await asyncio.gather(*(asyncio.wrap_future(lab_app.get_report_pool().submit(report_pdf.warm_up))
+                           for _ in range(args.workers)))
+    print(f"pool start ({args.workers} workers): {time.perf_counter() - start:.2f}s")
+
+    report_pdf.render_report(make_content(-1), os.path.join(workdir, "single.pdf"))
+    start = time.perf_counter()
+    for content in contents[:20]:
+        report_pdf.render_report(content, os.path.join(workdir, "single.pdf"))
+    single = 20 / (time.perf_counter() - start)
+    print(f"in-process, one at a time: {single:.1f} reports/s")
+
+    elapsed = await run(contents)
+    print(f"process pool, new reports: {args.reports / elapsed:.1f} reports/s ({elapsed:.2f}s)")
+
+    elapsed = await run(contents)
+    print(f"reprint (content-hash cache): {args.reports / elapsed:.0f} reports/s ({elapsed * 1000:.1f} ms)")
+
+    size = sum(os.path.getsize(os.path.join(lab_app.REPORT_DIR, name)) for name in os.listdir(lab_app.REPORT_DIR))
+    print(f"average report size: {size / args.reports / 1024:.1f} KB")
+    lab_app.stop_report_pool()
+
+
+# عمليات الرسم (spawn) تستورد هذا الملف من جديد: التجهيز والتشغيل للعملية الرئيسية فقط
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PDF report throughput")
+    parser.add_argument("--reports", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--analytes", type=int, default=12, help="عدد القيم في كل تقرير")
+    parser.add_argument("--lang", choices=["ar", "en"], default="ar")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="lab_reports_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["REPORT_WORKERS"] = str(args.workers)
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, repo_dir)
+    # الشعار والخطوط بمسارات نسبية من مجلد المشروع، والتقارير تُكتب في المجلد المؤقت
+    os.chdir(repo_dir)
+
+    import lab_app  # noqa: E402
+    import report_pdf  # noqa: E402
+
+    lab_app.REPORT_DIR = os.path.join(workdir, "reports")
+    os.makedirs(lab_app.REPORT_DIR)
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+"""قياس أداء الصفحات الأساسية داخل نفس العملية ومقارنتها بخط أساس محفوظ
+
+مثال:
+    python benchmarks/benchmark.py                      # تشغيل ومقارنة مع benchmarks/baseline.json
+    python benchmarks/benchmark.py --update-baseline    # حفظ النتائج الحالية كخط أساس
+يرجع exit code 1 إذا كانت أي صفحة أبطأ من خط الأساس بأكثر من --threshold.
+الأزمنة تختلف من جهاز لآخر: خط الأساس يحفظ بيانات البيئة وزمن حمل معايرة ثابت، والمقارنة على جهاز آخر
+تُصحح بنسبة زمن المعايرة. إذا اختلف إصدار Python أو SQLite أو عدد الأنوية تُطبع المقارنة للعلم فقط.
+يحتاج httpx (لـ TestClient): pip install httpx
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+parser = argparse.ArgumentParser(description="In-process endpoint benchmark")
+parser.add_argument("--patients", type=int, default=1000)
+parser.add_argument("--orders", type=int, default=5000)
+parser.add_argument("--iterations", type=int, default=50)
+parser.add_argument("--warmup", type=int, default=3)
+parser.add_argument("--baseline", default=os.path.join(BENCH_DIR, "baseline.json"))
+parser.add_argument("--threshold", type=float, default=0.3, help="نسبة التراجع المسموحة في p50 (0.3 = 30%%)")
+parser.add_argument("--update-baseline", action="store_true")
+args = parser.parse_args()
+
+
+
+def calibrate(runs=7):
+    """زمن حمل ثابت (Python + SQLite في الذاكرة) بالمللي ثانية لمقارنة سرعة الأجهزة"""
+    timings = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT, value INTEGER)")
+        conn.executemany("INSERT INTO t (name, value) VALUES (?, ?)", ((f"name {i}", i % 97) for i in range(50000)))
+        conn.execute("CREATE INDEX ix_t_value ON t (value)")
+        for v in range(0, 97, 7):
+            conn.execute("SELECT COUNT(*), SUM(length(name)) FROM t WHERE value = ?", (v,)).fetchone()
+        conn.close()
+        sorted(str(i * 7919 % 10007) for i in range(100000))
+        timings.append((time.perf_counter() - t) * 1000)
+    # أقل زمن: الأقل تأثراً بالعمليات الأخرى على الجهاز
+    return round(min(timings), 1)
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "calibration_ms": calibrate(),
+    }
+
+
+workdir = tempfile.mkdtemp(prefix="lab_bench_")
+sys.path.insert(0, BENCH_DIR)
+os.chdir(REPO_DIR)  # القوالب والملفات الثابتة تُقرأ من مجلد المشروع
+
+from generate_data import generate  # noqa: E402
+
+generate(os.path.join(workdir, "bench.db"), args.patients, args.orders)
+
+import lab_app  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+db = lab_app.SessionLocal()
+sample_orders = db.query(lab_app.TestOrder).filter(lab_app.TestOrder.published == True).limit(200).all()
+portal_checks = [(o.pin, o.patient.phone) for o in sample_orders]
+patient_ids = [p.id for p in db.query(lab_app.Patient.id).limit(200)]
+db.close()
+
+month_ago = (date.today() - timedelta(days=30)).strftime("%Y-%m-%d")
+today = date.today().strftime("%Y-%m-%d")
+rng = random.Random(1)
+
+ENDPOINTS = {
+    "dashboard": lambda c: c.get("/"),
+    "orders_page": lambda c: c.get("/orders"),
+    "orders_page_pending": lambda c: c.get("/orders", params={"status": "pending_approval"}),
+    "search_patients": lambda c: c.get("/search_patients", params={"query": rng.choice(["محمد", "010", "سارة", "5"])}),
+    "check_online": lambda c: c.post("/check_online", data=dict(zip(("pin", "extra_info"), rng.choice(portal_checks)))),
+    "finance_report": lambda c: c.get("/finance", params={"start_date": month_ago, "end_date": today}),
+    "patient_details": lambda c: c.get(f"/patient_details/{rng.choice(patient_ids)}"),
+}
+
+results = {}
+with TestClient(lab_app.app) as client:
+    client.post("/login", data={"username": "admin", "password": "admin123"}, follow_redirects=False)
+    for name, call in ENDPOINTS.items():
+        for _ in range(args.warmup):
+            call(client)
+        timings = []
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            t = time.perf_counter()
+            response = call(client)
+            timings.append((time.perf_counter() - t) * 1000)
+            if response.status_code >= 400:
+                sys.exit(f"{name} returned {response.status_code}")
+        elapsed = time.perf_counter() - started
+        timings.sort()
+        results[name] = {
+            "rps": round(args.iterations / elapsed, 1),
+            "p50_ms": round(statistics.median(timings), 2),
+            "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+            "p99_ms": round(timings[int(len(timings) * 0.99) - 1], 2),
+        }
+
+env = environment()
+baseline, baseline_env = {}, {}
+if os.path.exists(args.baseline):
+    with open(args.baseline) as f:
+        saved = json.load(f)
+    baseline, baseline_env = saved.get("results", {}), saved.get("environment", {})
+
+# خط أساس بدون معايرة (قديم) أو من بيئة مختلفة: المقارنة للعلم ولا تُعتبر تراجعاً
+comparable = all(baseline_env.get(k) == env[k] for k in ("python", "sqlite", "cpus")) and "calibration_ms" in baseline_env
+scale = env["calibration_ms"] / baseline_env["calibration_ms"] if comparable else 1.0
+print(f"calibration {env['calibration_ms']} ms (baseline {baseline_env.get('calibration_ms', '-')} ms, scale {scale:.2f})")
+if baseline and not comparable:
+    print("Baseline was recorded in a different environment: differences below are informational only")
+
+regressions = []
+print(f"{'endpoint':<22}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}   vs baseline p50")
+for name, r in results.items():
+    line = f"{name:<22}{r['rps']:>9}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}"
+    if name in baseline:
+        expected = baseline[name]["p50_ms"] * scale
+        change = (r["p50_ms"] - expected) / expected
+        line += f"   {change:+.0%}"
+        if change > args.threshold and comparable:
+            regressions.append(name)
+            line += "  <-- REGRESSION"
+    print(line)
+
+if args.update_baseline:
+    with open(args.baseline, "w") as f:
+        json.dump({"patients": args.patients, "orders": args.orders, "iterations": args.iterations,
+                   "environment": env, "results": results}, f, indent=2)
+    print(f"Baseline saved to {args.baseline}")
+elif regressions:
+    sys.exit(f"Regressions: {', '.join(regressions)}")
@@ -0,0 +1,112 @@
+"""توليد بيانات تجريبية واقعية (أسماء عربية، أرقام هواتف مصرية، تواريخ) في قاعدة SQLite
+
+مثال: python benchmarks/generate_data.py --db bench.db --patients 5000 --orders 30000
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+FIRST_NAMES = [
+    "محمد", "أحمد", "محمود", "مصطفى", "علي", "حسن", "حسين", "عمر", "يوسف", "إبراهيم",
+    "خالد", "طارق", "سامي", "ياسر", "كريم", "عبد الله", "عبد الرحمن", "سيد", "رامي", "هشام",
+    "فاطمة", "مريم", "نور", "سارة", "هدى", "منى", "إيمان", "أسماء", "ياسمين", "آية",
+    "زينب", "رحاب", "دعاء", "شيماء", "هبة", "نادية", "سلمى", "ريم", "ندى", "أمل",
+]
+FAMILY_NAMES = [
+    "السيد", "عبد العزيز", "الشريف", "حسانين", "المصري", "سلام", "عثمان", "البنا", "فؤاد", "النجار",
+    "الجمال", "رضوان", "منصور", "شاهين", "عيسى", "سليمان", "الحسيني", "زكي", "بدوي", "خليل",
+]
+TESTS = [
+    ("CBC", 120), ("Lipid Profile", 250), ("TSH", 180), ("HbA1c", 200), ("Fasting Blood Sugar", 50),
+    ("Liver Function", 300), ("Kidney Function", 280), ("Vitamin D", 450), ("Urine Analysis", 60),
+    ("CRP", 150), ("Ferritin", 220), ("PT/INR", 130),
+]
+PHONE_PREFIXES = ["010", "011", "012", "015"]
+
+
+def _dt(value):
+    return value.isoformat(sep=" ", timespec="microseconds")
+
+
+def generate(db_path, patients=1000, orders=5000, days=365, seed=42):
+    """إنشاء قاعدة بيانات جديدة بالبيانات التجريبية وإرجاع (عدد المرضى، عدد الطلبات)"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(db_path)}"
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import lab_app
+    lab_app.init_db()
+
+    rng = random.Random(seed)
+    now = datetime.now()
+    conn = lab_app.engine.raw_connection()
+    cursor = conn.cursor()
+
+    patient_rows, seen = [], set()
+    while len(patient_rows) < patients:
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(FAMILY_NAMES)}"
+        phone = f"{rng.choice(PHONE_PREFIXES)}{rng.randint(0, 99999999):08d}"
+        key = (lab_app.normalize_name(name), lab_app.normalize_phone(phone))
+        if key in seen:
+            continue
+        seen.add(key)
+        patient_rows.append((
+            len(patient_rows) + 1, name, phone, rng.randint(1, 90), rng.choice(["Male", "Female"]),
+            _dt(now - timedelta(days=rng.randint(0, days))), key[0], key[1]
+        ))
+    cursor.executemany(
+        "INSERT INTO patients (id, name, phone, age, gender, last_visit, name_key, phone_key) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", patient_rows
+    )
+
+    order_rows, pins = [], set()
+    for _ in range(orders):
+        patient = rng.choice(patient_rows)
+        test_name, price = rng.choice(TESTS)
+        created_at = now - timedelta(days=rng.random() * days)
+        pin = lab_app.generate_secure_pin(patient[2])
+        while pin in pins:
+            pin = lab_app.generate_import_pin(patient[2])
+        pins.add(pin)
+        # النتائج الأقدم غالباً منشورة، والحديثة بعضها ينتظر الرفع أو الموافقة
+        stage = rng.random() if created_at > now - timedelta(days=3) else 0.9
+        has_result = stage > 0.3
+        approved = stage > 0.6
+        status = "published" if approved else "resulted" if has_result else "collected" if stage > 0.15 else "ordered"
+        # أوقات المراحل حتى الحالة الحالية، كل مرحلة بعد السابقة بدقائق إلى ساعات
+        stage_times, stage_at = [], created_at
+        for name in lab_app.ORDER_STATUSES[1:5]:
+            if lab_app.ORDER_STATUSES.index(name) <= lab_app.ORDER_STATUSES.index(status):
+                stage_at += timedelta(minutes=rng.randint(5, 240))
+                stage_times.append(_dt(min(stage_at, now)))
+            else:
+                stage_times.append(None)
+        order_rows.append((
+            patient[0], patient[1], test_name, price, "ج.م", pin,
+            f"results_files/{pin}.pdf" if has_result else None, int(approved), int(approved), int(approved),
+            status, *stage_times, _dt(created_at)
+        ))
+    cursor.executemany(
+        "INSERT INTO orders (patient_id, patient_name, test_name, price, currency, pin, result_file, "
+        "published, admin_approved, is_locked, status, collected_at, resulted_at, approved_at, published_at, "
+        "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        order_rows
+    )
+    conn.commit()
+    conn.close()
+    return len(patient_rows), len(order_rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic lab database")
+    parser.add_argument("--db", default="bench.db")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        sys.exit(f"{args.db} already exists")
+    p, o = generate(args.db, args.patients, args.orders, args.days, args.seed)
+    print(f"Generated {p} patients and {o} orders in {args.db}")
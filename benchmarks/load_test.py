@@ -0,0 +1,96 @@
+"""اختبار ضغط على سيرفر شغال لمقارنة الأداء قبل وبعد أي تعديل (requests/s و p99)
+
+يحتاج httpx: pip install httpx
+
+مثال:
+    uvicorn lab_app:app --port 8000 --workers 1
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --concurrency 32 --duration 20 --save after.json
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+parser = argparse.ArgumentParser(description="Concurrent load test for the hot routes")
+parser.add_argument("--url", default="http://127.0.0.1:8000")
+parser.add_argument("--concurrency", type=int, default=32)
+parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+parser.add_argument("--username", default="admin")
+parser.add_argument("--password", default="admin123")
+parser.add_argument("--save", help="حفظ النتائج في ملف JSON")
+parser.add_argument("--compare", help="مقارنة النتائج مع ملف JSON سابق")
+args = parser.parse_args()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def main():
+    async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+        await client.post("/login", data={"username": args.username, "password": args.password})
+        r = await client.get("/search_patients", params={"query": "0"})
+        phones = [p["phone"] for p in r.json()] or ["0100000000"]
+
+        scenarios = {
+            "GET /orders": lambda: client.get("/orders", params={"status": "pending"}),
+            "GET /search_patients": lambda: client.get("/search_patients", params={"query": random.choice("0123456789")}),
+            "POST /check_online": lambda: client.post("/check_online", data={
+                "pin": f"{random.randint(0, 999999):06d}", "extra_info": random.choice(phones)
+            }),
+            "GET /online_results": lambda: client.get("/online_results"),
+        }
+        latencies = {name: [] for name in scenarios}
+        errors = {name: 0 for name in scenarios}
+        deadline = time.perf_counter() + args.duration
+
+        async def worker():
+            names = list(scenarios)
+            while time.perf_counter() < deadline:
+                name = random.choice(names)
+                start = time.perf_counter()
+                try:
+                    response = await scenarios[name]()
+                    if response.status_code >= 400:
+                        errors[name] += 1
+                except httpx.HTTPError:
+                    errors[name] += 1
+                latencies[name].append((time.perf_counter() - start) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    results = {}
+    for name, values in latencies.items():
+        results[name] = {
+            "requests": len(values),
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50), 2),
+            "p99_ms": round(percentile(values, 99), 2),
+            "errors": errors[name],
+        }
+    total = sum(len(v) for v in latencies.values())
+    results["total"] = {"requests": total, "rps": round(total / elapsed, 1),
+                        "p99_ms": round(percentile([x for v in latencies.values() for x in v], 99), 2)}
+    return results
+
+
+results = asyncio.run(main())
+baseline = json.load(open(args.compare)) if args.compare else {}
+for name, r in results.items():
+    line = f"{name:<24} {r['rps']:>8} req/s  p99 {r['p99_ms']:>8} ms"
+    if name in baseline:
+        before = baseline[name]
+        line += f"   (before: {before['rps']} req/s, p99 {before['p99_ms']} ms)"
+    print(line)
+if args.save:
+    with open(args.save, "w") as f:
+        json.dump(results, f, indent=2)
@@ -1,24 +1,124 @@
-import webview # تحتاج لتثبيت: pip install pywebview
-import threading
-import uvicorn
-import sys
+"""تشغيل النظام كتطبيق سطح مكتب (pywebview + uvicorn داخل نفس العملية)
+
+النافذة تظهر فوراً بشاشة انتظار، وفي نفس الوقت يتم في خيط السيرفر استيراد lab_app وتشغيل uvicorn
+(الـ lifespan ينشئ الجداول ويجهز القوالب وقاعدة البيانات ويشغل الـ scheduler).
+عندما يقبل المنفذ الاتصال تنتقل النافذة إلى صفحة الدخول.
+
+قياس زمن الإقلاع بدون نافذة:  python desktop_run.py --measure
+"""
 import os
-from main import app
+import sys
+import socket
+import logging
+import multiprocessing
+import threading
+import time
+
+T0 = time.perf_counter()
+
+HOST = "127.0.0.1"
+PORT = int(os.getenv("LAB_DESKTOP_PORT", "8000"))
+# ميزانية الإقلاع البارد (من تشغيل البرنامج حتى جاهزية السيرفر) - تحذير في السجل إذا تجاوزناها
+STARTUP_BUDGET = float(os.getenv("LAB_STARTUP_BUDGET", "3.0"))
+WINDOW_TITLE = 'نظام المختبر الطبي - د. ياسر'
+
+SPLASH_HTML = """<!doctype html><html dir="rtl"><body style="margin:0;height:100vh;display:flex;
+align-items:center;justify-content:center;font-family:Tahoma,sans-serif;background:#f4f6f9;color:#2c3e50">
+<h2>... جاري تشغيل النظام</h2></body></html>"""
+
+if getattr(sys, "frozen", False):
+    # نسخة PyInstaller: قاعدة البيانات وكل ملفات البيانات (النتائج، النسخ الاحتياطية، الاستيراد، الشعار)
+    # بجانب البرنامج حتى لا تضيع عند إعادة التثبيت، و lab_app يقرأ القوالب والملفات الثابتة من _MEIPASS
+    APP_DIR = os.path.dirname(sys.executable)
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(APP_DIR, 'lab.db')}")
+else:
+    APP_DIR = os.path.dirname(os.path.abspath(__file__))
+os.chdir(APP_DIR)
+
+logging.basicConfig(
+    filename=os.path.join(APP_DIR, "lab_desktop.log"), level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger("desktop_run")
+
+timings = {}
+server_error = []
+
+def mark(step: str):
+    timings[step] = time.perf_counter() - T0
+
+def pick_port(port: int) -> int:
+    """المنفذ المطلوب إن كان متاحاً، وإلا أي منفذ متاح"""
+    with socket.socket() as sock:
+        try:
+            sock.bind((HOST, port))
+        except OSError:
+            sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+def run_server(port: int):
+    try:
+        # الاستيراد هنا (وليس أعلى الملف) حتى لا يؤخر ظهور النافذة
+        import uvicorn
+        import lab_app
+        mark("import")
+        server = uvicorn.Server(uvicorn.Config(lab_app.app, host=HOST, port=port, log_level="warning"))
+        server.run()
+    except Exception as e:
+        logger.exception(f"Server failed to start: {e}")
+        server_error.append(e)
+
+def wait_until_ready(port: int, timeout: float = 60.0) -> bool:
+    """الانتظار حتى يقبل السيرفر الاتصال (uvicorn لا يفتح المنفذ إلا بعد أحداث startup)"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline and not server_error:
+        try:
+            with socket.create_connection((HOST, port), timeout=0.5):
+                mark("ready")
+                return True
+        except OSError:
+            time.sleep(0.02)
+    return False
+
+def report_startup():
+    summary = ", ".join(f"{step}={seconds:.2f}s" for step, seconds in timings.items())
+    if timings.get("ready", float("inf")) > STARTUP_BUDGET:
+        logger.warning(f"Cold start over budget ({STARTUP_BUDGET:.1f}s): {summary}")
+    else:
+        logger.info(f"Cold start: {summary}")
+    return summary
+
+def start_server_thread() -> int:
+    port = pick_port(PORT)
+    threading.Thread(target=run_server, args=(port,), daemon=True).start()
+    return port
+
+def show_app(window, port: int):
+    """يعمل في خيط منفصل بعد ظهور النافذة"""
+    mark("window")
+    if wait_until_ready(port):
+        window.load_url(f"http://{HOST}:{port}/login")
+    else:
+        window.load_html("<h2 style='text-align:center'>تعذر تشغيل السيرفر، راجع lab_desktop.log</h2>")
+    report_startup()
+
+def measure():
+    """زمن الإقلاع بدون نافذة (للمقارنة بين النسخ وبناء PyInstaller)"""
+    port = start_server_thread()
+    ok = wait_until_ready(port)
+    print(("ready: " if ok else "FAILED: ") + report_startup())
+    return 0 if ok and timings["ready"] <= STARTUP_BUDGET else 1
+
+def main():
+    if "--measure" in sys.argv:
+        sys.exit(measure())
 
-# دالة لتشغيل السيرفر في الخلفية
-def start_server():
-    uvicorn.run(app, host="127.0.0.1", port=8000, debug=False)
+    port = start_server_thread()
+    import webview  # تحتاج لتثبيت: pip install pywebview
+    window = webview.create_window(WINDOW_TITLE, html=SPLASH_HTML, width=1200, height=800, resizable=True)
+    webview.start(show_app, (window, port))
 
 if __name__ == "__main__":
-    # 1. تشغيل السيرفر في "خيط" منفصل (Thread)
-    t = threading.Thread(target=start_server)
-    t.daemon = True
-    t.start()
-
-    # 2. إنشاء نافذة ويندوز حقيقية
-    # يمكنك تغيير العنوان وحجم النافذة هنا
-    webview.create_window('نظام المختبر الطبي - د. ياسر', 'http://127.0.0.1:8000/login', 
-                          width=1200, height=800, resizable=True)
-    
-    # 3. ابدأ تشغيل النافذة
-    webview.start()
+    # عمليات رسم التقارير (spawn) تعيد تشغيل الملف التنفيذي في نسخة PyInstaller
+    multiprocessing.freeze_support()
+    main()
@@ -6,7 +6,15 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('templates', 'templates'), ('static', 'static')],
-    hiddenimports=[],
+    # lab_app يستورد داخل خيط السيرفر، و uvicorn يحمل بروتوكولاته ديناميكياً
+    hiddenimports=[
+        'lab_app', 'translations', 'report_pdf',
+        'uvicorn.logging', 'uvicorn.loops.auto', 'uvicorn.loops.asyncio',
+        'uvicorn.protocols.http.auto', 'uvicorn.protocols.http.h11_impl',
+        'uvicorn.protocols.websockets.auto', 'uvicorn.lifespan.on',
+        'aiosqlite', 'sqlalchemy.dialects.sqlite.aiosqlite',
+        'passlib.handlers.argon2', 'argon2', 'brotli', 'numpy',
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -16,12 +24,13 @@ a = Analysis(
 )
 pyz = PYZ(a.pure)
 
+# بناء مجلد (onedir) بدلاً من ملف واحد: نسخة الملف الواحد تفك كل المكتبات في مجلد مؤقت
+# عند كل تشغيل قبل أن يبدأ بايثون (قِس زمن الإقلاع بـ: desktop_run.exe --measure)
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='desktop_run',
     debug=False,
     bootloader_ignore_signals=False,
@@ -37,3 +46,12 @@ exe = EXE(
     entitlements_file=None,
     icon=['lab.ico'],
 )
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=True,
+    upx_exclude=[],
+    name='desktop_run',
+)
@@ -0,0 +1,31 @@
+import argparse
+import sys
+import time
+
+from lab_app import import_csv_file, init_db, IMPORT_BATCH_SIZE
+
+# استيراد المرضى والطلبات من نظام قديم (CSV)
+# مثال: python import_csv.py legacy_export.csv --batch-size 20000
+# لو توقف الاستيراد لأي سبب، أعد تشغيل نفس الأمر على نفس الملف وسيكمل من آخر دفعة
+
+parser = argparse.ArgumentParser(description="Bulk import patients and orders from CSV")
+parser.add_argument("path", help="CSV file: name, phone, age, gender, address, test_name, price, currency, created_at, pin, status")
+parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+args = parser.parse_args()
+
+
+def show_progress(stats):
+    sys.stdout.write(
+        f"\r{stats['rows_done']} rows | {stats['patients_created']} patients | "
+        f"{stats['orders_created']} orders | {stats['rows_per_second']} rows/s"
+    )
+    sys.stdout.flush()
+
+
+init_db()
+started = time.perf_counter()
+result = import_csv_file(args.path, batch_size=args.batch_size, progress=show_progress)
+print(f"\nImport job {result['job_id']} finished in {time.perf_counter() - started:.1f}s")
+if result["rows_skipped"] or result["remapped_pins"]:
+    print(f"{result['rows_skipped']} rows skipped, {len(result['remapped_pins'])} legacy PINs replaced: "
+          f"see {result['report_file']}")
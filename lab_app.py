@@ -1,44 +1,501 @@
 import os
+import re
+import sys
+import json
 import random
 import shutil
+import secrets
+import hashlib
+import asyncio
 import logging
+import zipfile
+import gzip
+import sqlite3
+import zlib
+import threading
+import time
+import glob
+import tempfile
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextvars import ContextVar
 from datetime import datetime, date, timedelta
-from typing import Optional
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Optional, List, Tuple
 
-from fastapi import FastAPI, Request, Form, Depends, File, UploadFile, HTTPException, Header, Response
+from fastapi import FastAPI, APIRouter, Request, Form, Depends, File, UploadFile, HTTPException, Header, Response, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse # مجمعين هنا
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemLoader
 
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, ForeignKey, func, or_, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, ForeignKey, Index, Float, func, or_, and_, case, Text, select, insert, update, delete, event, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import declarative_base, sessionmaker, Session, relationship, selectinload
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
-from starlette.middleware.sessions import SessionMiddleware
-from passlib.context import CryptContext
+from starlette.datastructures import MutableHeaders
+from starlette.requests import cookie_parser
 from pydantic import BaseModel, validator
-from apscheduler.schedulers.background import BackgroundScheduler
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Password hashing
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Password hashing (passlib و argon2 يُحمّلان عند أول تسجيل دخول وليس عند استيراد التطبيق)
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["argon2"], deprecated="auto")
 
-app = FastAPI(title="Laboratory Management System")
-app.add_middleware(SessionMiddleware, secret_key=os.getenv("SECRET_KEY", "Abqrino_Final_Pro_2026_CHANGE_ME"))
+# --- المقاييس (Prometheus) ---
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500)
 
-# Directory setup
+class Histogram:
+    """Histogram بسيط بصيغة Prometheus (بدون مكتبات خارجية وبتكلفة قليلة لكل قياس)"""
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.series.items()]
+        for key, counts, total in sorted(items):
+            labels = ",".join(f'{k}="{v}"' for k, v in key)
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+REQUEST_LATENCY = Histogram("lab_http_request_duration_seconds", "HTTP request latency by route")
+REQUEST_SQL_COUNT = Histogram("lab_request_sql_statements", "SQL statements executed per request", COUNT_BUCKETS)
+REQUEST_SQL_TIME = Histogram("lab_request_sql_duration_seconds", "Total SQL time per request")
+SQL_LATENCY = Histogram("lab_sql_statement_duration_seconds", "Latency of individual SQL statements")
+TEMPLATE_RENDER = Histogram("lab_template_render_seconds", "Jinja template render time")
+ANALYZER_LATENCY = Histogram("lab_analyzer_message_seconds", "Analyzer message receive-to-commit latency")
+ANALYZER_BATCH = Histogram("lab_analyzer_batch_messages", "Analyzer messages committed per batch", COUNT_BUCKETS)
+METRICS = [REQUEST_LATENCY, REQUEST_SQL_COUNT, REQUEST_SQL_TIME, SQL_LATENCY, TEMPLATE_RENDER,
+           ANALYZER_LATENCY, ANALYZER_BATCH]
+
+# عدد الاستعلامات ووقتها للطلب الحالي: [count, seconds]
+request_sql_stats: ContextVar = ContextVar("request_sql_stats", default=None)
+
+class MetricsMiddleware:
+    """قياس زمن كل طلب واستعلامات SQL الخاصة به (ASGI خفيف بدون تجميع الرد)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+        stats = [0, 0.0]
+        token = request_sql_stats.set(stats)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            request_sql_stats.reset(token)
+            route = scope.get("route")
+            labels = {"method": scope["method"], "route": route.path if route else "other"}
+            REQUEST_LATENCY.observe(elapsed, status=status["code"], **labels)
+            REQUEST_SQL_COUNT.observe(stats[0], **labels)
+            REQUEST_SQL_TIME.observe(stats[1], **labels)
+
+# --- ضغط الردود وتصغير HTML ---
+try:
+    import brotli
+except ImportError:  # brotli اختياري، بدونه نستخدم gzip فقط
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "500"))
+COMPRESSIBLE_TYPES = ("text/html", "text/css", "text/plain", "application/json", "application/javascript", "image/svg+xml")
+MINIFY_HTML = os.getenv("MINIFY_HTML", "1") == "1"
+PRESERVED_BLOCKS = re.compile(r"(<(pre|textarea)\b.*?</\2>)", re.S | re.I)
+LEADING_WHITESPACE = re.compile(r"^[ \t]+|[ \t]+$|\n(?=\n)", re.M)
+
+def minify_html(html: str) -> str:
+    """حذف المسافات في بداية ونهاية الأسطر والأسطر الفارغة (مع الحفاظ على pre و textarea)"""
+    parts = PRESERVED_BLOCKS.split(html)
+    out = []
+    # split مع مجموعتين: [نص, بلوك محفوظ, اسم الوسم, نص, ...]
+    for i in range(0, len(parts), 3):
+        out.append(LEADING_WHITESPACE.sub("", parts[i]))
+        if i + 1 < len(parts):
+            out.append(parts[i + 1])
+    return "".join(out)
+
+class CompressionMiddleware:
+    """ضغط الردود النصية (HTML / JSON / CSS / JS) بـ brotli أو gzip حسب ما يدعمه المتصفح"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept = ""
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                accept = value.decode("latin-1")
+        if brotli and "br" in accept:
+            encoding = "br"
+        elif "gzip" in accept:
+            encoding = "gzip"
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "compressor": None}
+
+        def make_compressor():
+            if encoding == "br":
+                compressor = brotli.Compressor(quality=5)
+                return compressor.process, compressor.finish
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            return compressor.compress, compressor.flush
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = {k.lower(): v for k, v in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                if b"content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    state["start"] = False
+                    await send(message)
+                else:
+                    state["start"] = message
+                return
+
+            if message["type"] != "http.response.body" or state["start"] is False:
+                await send(message)
+                return
+
+            start = state["start"]
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if state["compressor"] is None:
+                headers = [(k, v) for k, v in start["headers"] if k.lower() not in (b"content-length", b"content-encoding")]
+                if not more_body:
+                    # الرد كاملاً في رسالة واحدة (HTMLResponse / JSONResponse)
+                    if len(body) < self.minimum_size:
+                        state["start"] = False
+                        await send(start)
+                        await send(message)
+                        return
+                    compress, finish = make_compressor()
+                    body = compress(body) + finish()
+                    headers += [(b"content-encoding", encoding.encode()), (b"vary", b"Accept-Encoding"),
+                                (b"content-length", str(len(body)).encode())]
+                    await send({**start, "headers": headers})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                # رد على أجزاء (ملفات ثابتة): ضغط كل جزء أثناء الإرسال
+                state["compressor"] = make_compressor()
+                headers += [(b"content-encoding", encoding.encode()), (b"vary", b"Accept-Encoding")]
+                await send({**start, "headers": headers})
+
+            compress, finish = state["compressor"]
+            chunk = compress(body)
+            if not more_body:
+                chunk += finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+class MinifyingLoader(FileSystemLoader):
+    """تصغير مصدر القالب مرة واحدة عند تحميله بدلاً من تصغير الناتج في كل طلب
+    (المسافات المتكررة تأتي من إزاحة القالب نفسه داخل الحلقات)"""
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        return minify_html(source), filename, uptodate
+
+class TimedTemplates(Jinja2Templates):
+    """Jinja2Templates مع قياس وقت عرض كل قالب وتصغير الـ HTML"""
+
+    def __init__(self, directory: str, **env_options):
+        if MINIFY_HTML:
+            env_options.setdefault("loader", MinifyingLoader(directory))
+        super().__init__(directory=directory, **env_options)
+
+    def TemplateResponse(self, name: str, context: dict, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().TemplateResponse(name, context, *args, **kwargs)
+        finally:
+            TEMPLATE_RENDER.observe(time.perf_counter() - start, template=name)
+
+# --- جلسات المستخدمين على الخادم ---
+SESSION_COOKIE = os.getenv("SESSION_COOKIE", "lab_session")
+SESSION_MAX_AGE = int(os.getenv("SESSION_MAX_AGE", str(14 * 24 * 3600)))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "2000"))
+# مدة بقاء الجلسة في الذاكرة: حد أقصى لتأخر وصول إلغاء جلسة من عملية (worker) أخرى
+SESSION_CACHE_SECONDS = int(os.getenv("SESSION_CACHE_SECONDS", "60"))
+
+def dump_session(session: dict) -> str:
+    return json.dumps(session, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+class SessionStore(ABC):
+    """واجهة مخزن الجلسات: أي مخزن آخر (Redis مثلاً) يكفي أن يطبق هذه الدوال
+
+    الدوال متزامنة (blocking)، والـ middleware يشغلها في thread pool حتى لا توقف الـ event loop.
+    """
+
+    max_age = SESSION_MAX_AGE
+
+    def cached(self, sid: str):
+        """الجلسة من الذاكرة بدون أي I/O إن وُجدت (مثل load)، وإلا None فيُستدعى load في thread"""
+        return None
+
+    @abstractmethod
+    def load(self, sid: str):
+        """يرجع (data, user_id, expires_at) أو None إذا كانت الجلسة غير موجودة أو منتهية"""
+
+    @abstractmethod
+    def save(self, sid: str, data: str, user_id: Optional[int]):
+        ...
+
+    @abstractmethod
+    def delete(self, sid: str):
+        ...
+
+    @abstractmethod
+    def sessions_for_user(self, user_id: int) -> list:
+        """[(sid, data)] لكل جلسات المستخدم"""
+
+    def delete_user(self, user_id: int, keep: Optional[str] = None) -> int:
+        """إلغاء كل جلسات المستخدم (عدا keep) - مثلاً بعد تغيير كلمة المرور"""
+        count = 0
+        for sid, _ in self.sessions_for_user(user_id):
+            if sid != keep:
+                self.delete(sid)
+                count += 1
+        return count
+
+    def update_user(self, user_id: int, **changes) -> int:
+        """تحديث بيانات المستخدم داخل كل جلساته المفتوحة (الصلاحيات، الاسم، اللغة)"""
+        sessions = self.sessions_for_user(user_id)
+        for sid, data in sessions:
+            session = json.loads(data)
+            session.setdefault("user", {}).update(changes)
+            self.save(sid, dump_session(session), user_id)
+        return len(sessions)
+
+    def purge_expired(self) -> int:
+        return 0
+
+class SQLiteSessionStore(SessionStore):
+    """الجلسات في جدول web_sessions، وأمامه ذاكرة LRU حتى لا تحتاج أغلب الطلبات لقراءة قاعدة البيانات"""
+
+    def __init__(self, max_age: int = SESSION_MAX_AGE, cache_size: int = SESSION_CACHE_SIZE,
+                 cache_seconds: int = SESSION_CACHE_SECONDS):
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self.cache_seconds = cache_seconds
+        self._cache = OrderedDict()  # sid -> (data, user_id, expires_at, cached_until)
+        self._lock = threading.Lock()
+
+    def _cache_put(self, sid, data, user_id, expires_at):
+        with self._lock:
+            self._cache[sid] = (data, user_id, expires_at, min(expires_at, time.time() + self.cache_seconds))
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def cached(self, sid: str):
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry is not None:
+                if entry[3] > time.time():
+                    self._cache.move_to_end(sid)
+                    return entry[:3]
+                del self._cache[sid]
+        return None
+
+    def load(self, sid: str):
+        entry = self.cached(sid)
+        if entry is not None:
+            return entry
+        with engine.connect() as conn:
+            row = conn.execute(
+                text("SELECT data, user_id, expires_at FROM web_sessions WHERE id = :id AND expires_at > :now"),
+                {"id": sid, "now": int(time.time())}
+            ).first()
+        if row is None:
+            return None
+        self._cache_put(sid, *row)
+        return tuple(row)
+
+    def save(self, sid: str, data: str, user_id: Optional[int]):
+        expires_at = int(time.time()) + self.max_age
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT OR REPLACE INTO web_sessions (id, user_id, data, expires_at) VALUES (:id, :user_id, :data, :expires_at)"),
+                {"id": sid, "user_id": user_id, "data": data, "expires_at": expires_at}
+            )
+        self._cache_put(sid, data, user_id, expires_at)
+
+    def delete(self, sid: str):
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM web_sessions WHERE id = :id"), {"id": sid})
+        self._cache_drop(sid)
+
+    def sessions_for_user(self, user_id: int) -> list:
+        with engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(
+                text("SELECT id, data FROM web_sessions WHERE user_id = :user_id AND expires_at > :now"),
+                {"user_id": user_id, "now": int(time.time())}
+            )]
+
+    def delete_user(self, user_id: int, keep: Optional[str] = None) -> int:
+        with engine.begin() as conn:
+            sids = [sid for (sid,) in conn.execute(
+                text("DELETE FROM web_sessions WHERE user_id = :user_id AND id IS NOT :keep RETURNING id"),
+                {"user_id": user_id, "keep": keep}
+            )]
+        for sid in sids:
+            self._cache_drop(sid)
+        return len(sids)
+
+    def purge_expired(self) -> int:
+        with engine.begin() as conn:
+            deleted = conn.execute(text("DELETE FROM web_sessions WHERE expires_at <= :now"),
+                                   {"now": int(time.time())}).rowcount
+        with self._lock:
+            now = time.time()
+            for sid in [sid for sid, entry in self._cache.items() if entry[2] <= now]:
+                del self._cache[sid]
+        return deleted
+
+class ServerSessionMiddleware:
+    """بديل SessionMiddleware: الكوكي يحمل معرّفاً عشوائياً فقط، والبيانات في المخزن وتُكتب فقط عند تغيرها"""
+
+    def __init__(self, app, store: SessionStore, cookie_name: str = SESSION_COOKIE,
+                 https_only: bool = False, same_site: str = "lax"):
+        self.app = app
+        self.store = store
+        self.cookie_name = cookie_name
+        self.cookie_flags = f"; path=/; Max-Age={store.max_age}; httponly; samesite={same_site}"
+        if https_only:
+            self.cookie_flags += "; secure"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        sid = None
+        for key, value in scope["headers"]:
+            if key == b"cookie":
+                sid = cookie_parser(value.decode("latin-1")).get(self.cookie_name)
+        loaded = None
+        if sid:
+            loaded = self.store.cached(sid)
+            if loaded is None:
+                loaded = await run_in_threadpool(self.store.load, sid)
+        original = loaded[0] if loaded else "{}"
+        scope["session"] = json.loads(original)
+        scope["session_id"] = sid if loaded else None
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                cookie = await self.commit(scope["session"], sid, loaded, original)
+                if cookie is not None:
+                    MutableHeaders(scope=message).append("Set-Cookie", cookie)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def commit(self, session: dict, sid: Optional[str], loaded, original: str) -> Optional[str]:
+        """حفظ الجلسة إن تغيرت، ويرجع قيمة Set-Cookie إن لزم"""
+        if not session:
+            if loaded:
+                await run_in_threadpool(self.store.delete, sid)
+            if sid:
+                return f"{self.cookie_name}=null; path=/; expires=Thu, 01 Jan 1970 00:00:00 GMT"
+            return None
+
+        data = dump_session(session)
+        user_id = (session.get("user") or {}).get("id")
+        new_sid = sid
+        if not loaded or loaded[1] != user_id:
+            # جلسة جديدة أو تسجيل دخول: معرّف جديد دائماً (منع تثبيت الجلسة session fixation)
+            if loaded:
+                await run_in_threadpool(self.store.delete, sid)
+            new_sid = secrets.token_urlsafe(32)
+        elif data == original and loaded[2] - time.time() > self.store.max_age / 2:
+            return None
+        # التغيير أو اقتراب انتهاء الصلاحية (تمديد تلقائي للجلسات النشطة)
+        await run_in_threadpool(self.store.save, new_sid, data, user_id)
+        if new_sid != sid or data == original:
+            return f"{self.cookie_name}={new_sid}{self.cookie_flags}"
+        return None
+
+session_store = SQLiteSessionStore()
+
+# كل المسارات تُسجل على router، والتطبيق نفسه يُبنى في create_app() آخر الملف
+router = APIRouter()
+
+# القوالب والملفات الثابتة تُقرأ من مجلد البرنامج (داخل الحزمة _MEIPASS في نسخة PyInstaller)،
+# أما البيانات (النتائج والاستيراد والنسخ الاحتياطية والشعار) فنسبية لمجلد التشغيل حتى لا تضيع مع التحديث
+RESOURCE_DIR = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES_DIR = os.path.join(RESOURCE_DIR, "templates")
+STATIC_DIR = os.path.join(RESOURCE_DIR, "static")
+
+# Directory setup (تُنشأ عند التشغيل في lifespan)
 UPLOAD_DIR = "results_files"
 LOGO_DIR = "static/images"
-for folder in ["static", "templates", UPLOAD_DIR, LOGO_DIR]:
-    if not os.path.exists(folder):
-        os.makedirs(folder)
+IMPORT_DIR = "imports"
+# التقارير المولدة داخل مجلد النتائج: تُنشر وتُحذف وتُنزّل من البوابة مثل أي ملف نتيجة مرفوع
+REPORT_DIR = os.path.join(UPLOAD_DIR, "reports")
+APP_DIRS = [UPLOAD_DIR, LOGO_DIR, IMPORT_DIR, REPORT_DIR]
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-@app.get('/manifest.json')
+@router.get('/manifest.json')
 def manifest():
     # كلمة JSONResponse(content=...) هي اللي بتخلي المتصفح يلقط الملف
     return JSONResponse(content={
@@ -71,15 +528,25 @@ def manifest():
     })
 
 # لازم تضيف دول عشان السيرفر يرضى يبعت الصور للمتصفح
-@app.get('/icon-192.png')
+@router.get('/icon-192.png')
 def icon192():
-    return FileResponse('static/icon-192.png')
+    return FileResponse(os.path.join(STATIC_DIR, 'icon-192.png'))
 
-@app.get('/icon-512.png')
+@router.get('/icon-512.png')
 def icon512():
-    return FileResponse('static/icon-512.png')
+    return FileResponse(os.path.join(STATIC_DIR, 'icon-512.png'))
+
+@router.get('/metrics')
+def metrics(request: Request):
+    # الأسماء والأزمنة تكشف شكل الاستخدام: للمدير أو لـ Prometheus على نفس الجهاز فقط
+    if not request.client or request.client.host not in ("127.0.0.1", "::1"):
+        require_admin(request)
+    lines = []
+    for histogram in METRICS:
+        lines.extend(histogram.render())
+    return Response(content="\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
 
-@app.get('/sw.js')
+@router.get('/sw.js')
 def service_worker():
     content = """
     self.addEventListener('install', (event) => {
@@ -91,890 +558,83 @@ def service_worker():
     """
     return Response(content=content, media_type='application/javascript')
 
-app.mount("/results_files", StaticFiles(directory=UPLOAD_DIR), name="results_files")
-templates = Jinja2Templates(directory="templates")
+templates = TimedTemplates(directory=TEMPLATES_DIR)
 
 # Configuration
 ALLOWED_EXTENSIONS = {'.pdf', '.jpg', '.jpeg', '.png', '.docx', '.doc'}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 FAKE_PUBLISH_LINK = "https://yassersallam.pythonanywhere.com/api/upload"
 RESULT_RETENTION_DAYS = 14
+IMPORT_BATCH_SIZE = 20000       # عدد الصفوف في كل transaction أثناء الاستيراد من CSV
+# الطلبات المستوردة تاريخية بدون ملف نتيجة: منتهية ومقفلة، فلا تظهر في قوائم العمل ولا في زمن الإنجاز
+IMPORT_ORDER_STATUS = "expired"
+BULK_UPLOAD_CONCURRENCY = 4     # عدد الملفات التي تُكتب على القرص في نفس الوقت
+# عدد النتائج في كل طلب إرسال أونلاين (files + results JSON)؛ 0 = طلب لكل ملف بنفس صيغة publish_result_online،
+# والإرسال المجمع فقط إذا كان خادم النشر يدعم هذه الصيغة
+PUBLISH_BATCH_SIZE = int(os.getenv("PUBLISH_BATCH_SIZE", "0"))
+HISTORY_PAGE_SIZE = 25          # عدد الطلبات في كل صفحة من سجل المريض
+# الـ PIN المكون من 6 أرقام داخل اسم الملف، مع رقم السطر لتحاليل الزيارة الواحدة (مثال: 451234-2)
+PIN_PATTERN = re.compile(r"(?<!\d)(\d{6}(?:-\d{1,2})?)(?!\d)")
 
-# --- نظام الترجمة ---
-TRANSLATIONS = {
-    "ar": {
-        "dashboard": "لوحة التحكم",
-        "patients": "المرضى",
-        "orders": "الطلبات",
-        "finance": "المالية",
-        "settings": "الإعدادات",
-        "logout": "تسجيل الخروج",
-        "add_order": "إضافة طلب",
-        "search": "بحث",
-        "name": "الاسم",
-        "phone": "الهاتف",
-        "test": "التحليل",
-        "price": "السعر",
-        "actions": "الإجراءات",
-        "pending": "قيد الانتظار",
-        "published": "منشور",
-        "view": "عرض",
-        "edit": "تعديل",
-        "delete": "حذف",
-        "upload_result": "رفع النتيجة",
-        "approve": "موافقة",
-        "welcome": "مرحباً",
-        "today_orders": "طلبات اليوم",
-        "Register New Patient": "إضافة مريض جديد",
-        "pending_results": "نتائج بانتظار النشر",
-        "patient_count": "عدد المرضى",
-        "order_count": "عدد الطلبات",
-        "login": "تسجيل الدخول",
-        "username": "اسم المستخدم",
-        "password": "كلمة المرور",
-        "submit": "إرسال",
-        "back": "رجوع",
-        "save": "حفظ",
-        "cancel": "إلغاء",
-        "error": "خطأ",
-        "success": "تم بنجاح",
-        "loading": "جاري التحميل...",
-        "no_data": "لا توجد بيانات",
-        "all_rights_reserved": "جميع الحقوق محفوظة",
-        "search_patient": "بحث عن مريض...",
-        "add_new_order": "إضافة طلب جديد",
-        "patient_name": "اسم المريض",
-        "patient_phone": "رقم الهاتف",
-        "test_name": "اسم التحليل",
-        "test_price": "سعر التحليل",
-        "currency": "ج.م",
-        "create_order": "إنشاء الطلب",
-        "order_id": "رقم الطلب",
-        "result": "النتيجة",
-        "status": "الحالة",
-        "date": "التاريخ",
-        "options": "خيارات",
-        "download": "تحميل",
-        "approve_result": "الموافقة على النتيجة",
-        "republish": "إعادة النشر",
-        "lock": "قفل",
-        "unlock": "فتح",
-        "total": "الإجمالي",
-        "report": "تقرير مالي",
-        "from_date": "من تاريخ",
-        "to_date": "إلى تاريخ",
-        "generate_report": "إنشاء التقرير",
-        "profile": "الملف الشخصي",
-        "change_password": "تغيير كلمة المرور",
-        "current_password": "كلمة المرور الحالية",
-        "new_password": "كلمة المرور الجديدة",
-        "confirm_password": "تأكيد كلمة المرور",
-        "update": "تحديث",
-        "online_results": "النتائج أونلاين",
-        "enter_pin": "أدخل رقم PIN",
-        "check_result": "التحقق من النتيجة",
-        "result_not_found": "النتيجة غير موجودة أو لم يتم نشرها بعد",
-        "search_error": "حدث خطأ أثناء البحث",
-        "lab_name": "اسم المختبر",
-        "publish_link": "رابط النشر",
-        "default_language": "اللغة الافتراضية",
-        "show_language": "إظهار خيار اللغة للمستخدمين",
-        "update_settings": "تحديث الإعدادات",
-        "admin": "مدير",
-        "employee": "موظف",
-        "view_finance": "عرض المالية",
-        "update_permissions": "تحديث الصلاحيات",
-        "patient_history": "سجل المريض",
-        "age": "العمر",
-        "gender": "الجنس",
-        "address": "العنوان",
-        "notes": "ملاحظات",
-        "last_visit": "آخر زيارة",
-        "edit_patient": "تعديل بيانات المريض",
-        "delete_patient": "حذف المريض",
-        "confirm_delete": "هل أنت متأكد من الحذف؟",
-        "yes": "نعم",
-        "no": "لا",
-        "order_details": "تفاصيل الطلب",
-        "patient_info": "معلومات المريض",
-        "test_info": "معلومات التحليل",
-        "financial_info": "معلومات مالية",
-        "pin": "رقم PIN",
-        "created_at": "تاريخ الإنشاء",
-        "upload_file": "رفع ملف",
-        "choose_file": "اختر ملف",
-        "file_size_limit": "الحد الأقصى 10 ميجابايت",
-        "allowed_formats": "الصيغ المسموحة: PDF, JPG, PNG, DOC, DOCX",
-        "upload": "رفع",
-        "pending_approval": "بانتظار الموافقة",
-        "approved": "تمت الموافقة",
-        "rejected": "مرفوض",
-        "all": "الكل",
-        "filter": "تصفية",
-        "clear_filter": "مسح التصفية",
-        "export": "تصدير",
-        "Cancel and Go Back": "إلغاء والعودة",
-        "Save Data": "حفظ البيانات",
-        "print": "طباعة",
-        "refresh": "تحديث",
-        "home": "الرئيسية",
-        "about": "حول",
-        "contact": "اتصل بنا",
-        "privacy": "الخصوصية",
-        "terms": "الشروط",
-        "help": "المساعدة",
-        "language": "اللغة",
-        "arabic": "العربية",
-        "english": "الإنجليزية",
-        "change_language": "تغيير اللغة",
-        "theme": "المظهر",
-        "dark": "داكن",
-        "light": "فاتح",
-        "system": "النظام",
-        "notifications": "الإشعارات",
-        "mark_all_read": "تحديد الكل كمقروء",
-        "view_all": "عرض الكل",
-        "messages": "الرسائل",
-        "tasks": "المهام",
-        "calendar": "التقويم",
-        "reports": "التقارير",
-        "analytics": "التحليلات",
-        "users": "المستخدمين",
-        "roles": "الأدوار",
-        "permissions": "الصلاحيات",
-        "logs": "السجلات",
-        "backup": "النسخ الاحتياطي",
-        "maintenance": "الصيانة",
-        "version": "الإصدار",
-        "check_updates": "التحقق من التحديثات",
-        "documentation": "التوثيق",
-        "support": "الدعم",
-        "feedback": "التقييم",
-        "logout_confirm": "هل أنت متأكد من تسجيل الخروج؟",
-        "session_expired": "انتهت الجلسة، يرجى تسجيل الدخول مرة أخرى",
-        "server_error": "خطأ في الخادم",
-        "not_found": "غير موجود",
-        "forbidden": "غير مسموح",
-        "unauthorized": "غير مصرح",
-        "bad_request": "طلب خاطئ",
-        "timeout": "انتهت المهلة",
-        "network_error": "خطأ في الشبكة",
-        "try_again": "حاول مرة أخرى",
-        "contact_admin": "اتصل بالمدير",
-        "go_back": "العودة",
-        "continue": "المتابعة",
-        "close": "إغلاق",
-        "minimize": "تصغير",
-        "maximize": "تكبير",
-        "fullscreen": "ملء الشاشة",
-        "exit_fullscreen": "الخروج من ملء الشاشة",
-        "zoom_in": "تكبير",
-        "zoom_out": "تصغير",
-        "reset_zoom": "إعادة تعيين التكبير",
-        "rotate": "تدوير",
-        "crop": "قص",
-        "undo": "تراجع",
-        "redo": "إعادة",
-        "cut": "قص",
-        "copy": "نسخ",
-        "paste": "لصق",
-        "select_all": "تحديد الكل",
-        "find": "بحث",
-        "replace": "استبدال",
-        "save_changes": "حفظ التغييرات",
-        "discard_changes": "تجاهل التغييرات",
-        "preview": "معاينة",
-        "publish": "نشر",
-        "unpublish": "إلغاء النشر",
-        "archive": "أرشفة",
-        "restore": "استعادة",
-        "trash": "سلة المحذوفات",
-        "empty_trash": "تفريغ سلة المحذوفات",
-        "permanent_delete": "حذف نهائي",
-        "move_to": "نقل إلى",
-        "copy_to": "نسخ إلى",
-        "male": "ذكر",
-        "female": "أنثى",
-        "rename": "إعادة تسمية",
-        "duplicate": "نسخ",
-        "share": "مشاركة",
-        "embed": "تضمين",
-        "export_as": "تصدير كـ",
-        "import": "استيراد",
-        "sync": "مزامنة",
-        "validate": "تحقق",
-        "optimize": "تحسين",
-        "compress": "ضغط",
-        "extract": "استخراج",
-        "encrypt": "تشفير",
-        "decrypt": "فك التشفير",
-        "sign": "توقيع",
-        "verify": "تحقق",
-        "scan": "مسح",
-        "clean": "تنظيف",
-        "update_available": "تحديث متاح",
-        "install_update": "تثبيت التحديث",
-        "restart_required": "يتطلب إعادة التشغيل",
-        "changelog": "سجل التغييرات",
-        "license": "الترخيص",
-        "credits": "الاعتمادات",
-        "acknowledgments": "شكر وتقدير",
-        "copyright": "حقوق النشر",
-        "trademark": "العلامة التجارية",
-        "patent": "براءة الاختراع",
-        "disclaimer": "إخلاء المسؤولية",
-        "warranty": "الضمان",
-        "liability": "المسؤولية",
-        "indemnity": "التعويض",
-        "governance": "الحوكمة",
-        "compliance": "الامتثال",
-        "security": "الأمان",
-        "privacy_policy": "سياسة الخصوصية",
-        "terms_of_service": "شروط الخدمة",
-        "acceptable_use": "الاستخدام المقبول",
-        "code_of_conduct": "قواعد السلوك",
-        "ethics": "الأخلاقيات",
-        "values": "القيم",
-        "mission": "المهمة",
-        "vision": "الرؤية",
-        "strategy": "الاستراتيجية",
-        "objectives": "الأهداف",
-        "milestones": "المعالم",
-        "timeline": "الجدول الزمني",
-        "roadmap": "خارطة الطريق",
-        "blog": "المدونة",
-        "news": "الأخبار",
-        "events": "الفعاليات",
-        "webinars": "الندوات عبر الإنترنت",
-        "tutorials": "الدروس",
-        "guides": "الإرشادات",
-        "faq": "الأسئلة الشائعة",
-        "forum": "المنتدى",
-        "community": "المجتمع",
-        "social_media": "وسائل التواصل الاجتماعي",
-        "newsletter": "النشرة الإخبارية",
-        "subscribe": "اشتراك",
-        "unsubscribe": "إلغاء الاشتراك",
-        "preferences": "التفضيلات",
-        "account": "الحساب",
-        "billing": "الفواتير",
-        "payment": "الدفع",
-        "invoice": "الفاتورة",
-        "receipt": "الإيصال",
-        "refund": "استرداد",
-        "tax": "الضريبة",
-        "discount": "الخصم",
-        "coupon": "الكوبون",
-        "voucher": "القسيمة",
-        "credit": "الائتمان",
-        "debit": "الدين",
-        "balance": "الرصيد",
-        "transaction": "المعاملة",
-        "statement": "كشف الحساب",
-        "overview": "نظرة عامة",
-        "details": "تفاصيل",
-        "summary": "ملخص",
-        "statistics": "إحصائيات",
-        "metrics": "المقاييس",
-        "kpi": "مؤشرات الأداء الرئيسية",
-        "alerts": "التنبيهات",
-        "monitoring": "المراقبة",
-        "audit": "التدقيق",
-        "inspection": "التفتيش",
-        "certification": "الشهادة",
-        "accreditation": "الاعتماد",
-        "standard": "المعيار",
-        "protocol": "البروتوكول",
-        "procedure": "الإجراء",
-        "workflow": "سير العمل",
-        "pipeline": "خط الأنابيب",
-        "queue": "قائمة الانتظار",
-        "stack": "المكدس",
-        "heap": "الكومة",
-        "cache": "ذاكرة التخزين المؤقت",
-        "buffer": "المخزن المؤقت",
-        "registry": "السجل",
-        "repository": "المستودع",
-        "archive": "الأرشيف",
-        "recovery": "الاسترداد",
-        "migration": "الهجرة",
-        "upgrade": "الترقية",
-        "downgrade": "التخفيض",
-        "rollback": "التراجع",
-        "patch": "الترقيع",
-        "hotfix": "الإصلاح العاجل",
-        "release": "الإصدار",
-        "build": "البناء",
-        "deploy": "النشر",
-        "host": "المضيف",
-        "domain": "النطاق",
-        "server": "الخادم",
-        "client": "العميل",
-        "api": "واجهة برمجة التطبيقات",
-        "sdk": "مجموعة تطوير البرمجيات",
-        "library": "المكتبة",
-        "framework": "الإطار",
-        "platform": "المنصة",
-        "infrastructure": "البنية التحتية",
-        "cloud": "السحابة",
-        "edge": "الحافة",
-        "iot": "إنترنت الأشياء",
-        "ai": "الذكاء الاصطناعي",
-        "ml": "التعلم الآلي",
-        "dl": "التعلم العميق",
-        "nlp": "معالجة اللغة الطبيعية",
-        "cv": "رؤية الكمبيوتر",
-        "ar": "الواقع المعزز",
-        "vr": "الواقع الافتراضي",
-        "blockchain": "سلاسل الكتل",
-        "crypto": "التشفير",
-        "nft": "الرموز غير القابلة للاستبدال",
-        "metaverse": "الكون الافتراضي",
-        "web3": "الويب 3",
-        "dao": "المنظمة اللامركزية المستقلة",
-        "defi": "التمويل اللامركزي",
-        "gamefi": "ألعاب التمويل",
-        "socialfi": "التمويل الاجتماعي",
-        "learnfi": "تعليم التمويل",
-        "healthfi": "تمويل الصحة",
-        "govfi": "تمويل الحوكمة",
-        "regfi": "تمويل التنظيم",
-        "legaltech": "التكنولوجيا القانونية",
-        "fintech": "التكنولوجيا المالية",
-        "edtech": "تكنولوجيا التعليم",
-        "healthtech": "تكنولوجيا الصحة",
-        "agritech": "تكنولوجيا الزراعة",
-        "cleantech": "التكنولوجيا النظيفة",
-        "greentech": "التكنولوجيا الخضراء",
-        "spacetech": "تكنولوجيا الفضاء",
-        "oceantech": "تكنولوجيا المحيطات",
-        "biotech": "التكنولوجيا الحيوية",
-        "nanotech": "تكنولوجيا النانو",
-        "quantum": "الكم",
-        "fusion": "الاندماج",
-        "fission": "الانشطار",
-        "renewable": "المتجددة",
-        "sustainable": "المستدام",
-        "circular": "الدائرية",
-        "regenerative": "التجديدية",
-        "restorative": "الترميمية",
-        "conservation": "الحفظ",
-        "preservation": "الحفظ",
-        "restoration": "الترميم",
-        "remediation": "الإصلاح",
-        "rehabilitation": "إعادة التأهيل",
-        "reconstruction": "إعادة الإعمار",
-        "redevelopment": "إعادة التطوير",
-        "revitalization": "إحياء",
-        "renaissance": "نهضة",
-        "revolution": "ثورة",
-        "evolution": "تطور",
-        "innovation": "ابتكار",
-        "invention": "اختراع",
-        "discovery": "اكتشاف",
-        "exploration": "استكشاف",
-        "research": "بحث",
-        "development": "تطوير",
-        "engineering": "هندسة",
-        "science": "علم",
-        "technology": "تكنولوجيا",
-        "mathematics": "رياضيات",
-        "physics": "فيزياء",
-        "chemistry": "كيمياء",
-        "biology": "أحياء",
-        "geology": "جيولوجيا",
-        "astronomy": "فلك",
-        "meteorology": "الأرصاد الجوية",
-        "oceanography": "علوم المحيطات",
-        "seismology": "علم الزلازل",
-        "volcanology": "علم البراكين",
-        "paleontology": "علم الأحافير",
-        "archaeology": "علم الآثار",
-        "anthropology": "أنثروبولوجيا",
-        "sociology": "علم الاجتماع",
-        "psychology": "علم النفس",
-        "philosophy": "فلسفة",
-        "theology": "لاهوت",
-        "history": "تاريخ",
-        "geography": "جغرافيا",
-        "economics": "اقتصاد",
-        "politics": "سياسة",
-        "law": "قانون",
-        "medicine": "طب",
-        "nursing": "تمريض",
-        "pharmacy": "صيدلة",
-        "dentistry": "طب الأسنان",
-        "veterinary": "طب بيطري",
-        "agriculture": "زراعة",
-        "forestry": "حراجة",
-        "fisheries": "مصايد الأسماك",
-        "mining": "تعدين",
-        "manufacturing": "تصنيع",
-        "construction": "بناء",
-        "transportation": "نقل",
-        "communication": "اتصال",
-        "energy": "طاقة",
-        "water": "ماء",
-        "waste": "نفايات",
-        "environment": "بيئة",
-        "climate": "مناخ",
-        "weather": "طقس",
-        "air": "هواء",
-        "soil": "تربة",
-        "biodiversity": "تنوع حيوي",
-        "ecosystem": "نظام بيئي",
-        "habitat": "موطن",
-        "species": "نوع",
-        "genus": "جنس",
-        "family": "عائلة",
-        "order": "رتبة",
-        "class": "طائفة",
-        "phylum": "شعبة",
-        "kingdom": "مملكة",
-        "domain": "نطاق",
-        "life": "حياة",
-        "universe": "كون",
-        "galaxy": "مجرة",
-        "star": "نجم",
-        "planet": "كوكب",
-        "moon": "قمر",
-        "asteroid": "كويكب",
-        "comet": "مذنب",
-        "nebula": "سديم",
-        "black_hole": "ثقب أسود",
-        "wormhole": "ثقب دودي",
-        "multiverse": "أكوان متعددة",
-        "dimension": "بعد",
-        "time": "زمن",
-        "space": "فضاء",
-        "matter": "مادة",
-        "energy": "طاقة",
-        "force": "قوة",
-        "field": "حقل",
-        "particle": "جسيم",
-        "wave": "موجة",
-        "quantum": "كم",
-        "relativity": "نسبية",
-        "gravity": "جاذبية",
-        "electromagnetism": "كهرومغناطيسية",
-        "strong_force": "قوة نووية شديدة",
-        "weak_force": "قوة نووية ضعيفة",
-        "standard_model": "النموذج القياسي",
-        "string_theory": "نظرية الأوتار",
-        "m_theory": "نظرية إم",
-        "loop_quantum_gravity": "جاذبية كمية حلقية",
-        "causal_dynamical_triangulation": "تثليث ديناميكي سببي",
-        "asymptotic_safety": "سلامة مقاربية",
-        "holographic_principle": "مبدأ الهولوغرام",
-        "cosmic_censorship": "الرقابة الكونية",
-        "chronology_protection": "حماية التسلسل الزمني",
-        "anthropic_principle": "المبدأ الأنثروبي",
-        "fine_tuning": "ضبط دقيق",
-        "simulation_hypothesis": "فرضية المحاكاة",
-        "panspermia": "تبزر الشامل",
-        "abiogenesis": "نشأة الحياة من غير حياة",
-        "genetic_drift": "انحراف وراثي",
-        "gene_flow": "تدفق الجينات",
-        "mutation": "طفرة",
-        "speciation": "تكوين الأنواع",
-        "extinction": "انقراض",
-        "ecology": "علم البيئة",
-        "resilience": "مرونة",
-        "adaptation": "تكيف",
-        "mitigation": "تخفيف",
-        "reclamation": "استصلاح",
-        "reforestation": "إعادة تشجير",
-        "afforestation": "تشجير",
-        "desertification": "تصحر",
-        "deforestation": "إزالة الغابات",
-        "soil_erosion": "تآكل التربة",
-        "water_scarcity": "ندرة المياه",
-        "air_pollution": "تلوث الهواء",
-        "water_pollution": "تلوث المياه",
-        "soil_pollution": "تلوث التربة",
-        "noise_pollution": "تلوث ضوضائي",
-        "light_pollution": "تلوث ضوئي",
-        "thermal_pollution": "تلوث حراري",
-        "radioactive_pollution": "تلوث إشعاعي",
-        "plastic_pollution": "تلوث بلاستيكي",
-        "microplastic": "لدائن دقيقة",
-        "nanoplastic": "لدائن نانوية",
-        "greenhouse_gas": "غازات دفيئة",
-        "register_new_patient": "تسجيل مريض جديد",
-        "name_placeholder": "أدخل الاسم كاملاً",
-        "optional": "اختياري",
-        "notes_placeholder": "أي ملاحظات إضافية هنا...",
-        "save_data": "حفظ البيانات",
-        "cancel_and_back": "إلغاء والعودة",
-        "carbon_footprint": "بصمة كربونية",
-        "carbon_offset": "تعويض كربوني",
-        "carbon_credit": "رصيد كربوني",
-        "carbon_tax": "ضريبة كربون",
-        "emissions_trading": "تداول الانبعاثات",
-        "cap_and_trade": "الحد والتجارة",
-        "renewable_energy": "طاقة متجددة",
-        "solar_energy": "طاقة شمسية",
-        "wind_energy": "طاقة رياح",
-        "hydroelectric": "طاقة كهرومائية",
-        "geothermal": "طاقة حرارية أرضية",
-        "tidal_energy": "طاقة المد والجزر",
-        "wave_energy": "طاقة الأمواج",
-        "bioenergy": "طاقة حيوية",
-        "hydrogen": "هيدروجين",
-        "nuclear": "نووي",
-        "thorium": "ثوريوم",
-        "uranium": "يورانيوم",
-        "plutonium": "بلوتونيوم",
-        "deuterium": "ديوتيريوم",
-        "tritium": "تريتيوم",
-        "helium": "هيليوم",
-        "lithium": "ليثيوم",
-        "cobalt": "كوبالت",
-        "nickel": "نيكل",
-        "copper": "نحاس",
-        "zinc": "زنك",
-        "silver": "فضة",
-        "gold": "ذهب",
-        "platinum": "بلاتين",
-        "palladium": "بالاديوم",
-        "rhodium": "روديوم",
-        "iridium": "إيريديوم",
-        "osmium": "أوزميوم",
-        "ruthenium": "روثينيوم",
-        "rhenium": "رينيوم",
-        "tungsten": "تنغستن",
-        "molybdenum": "موليبدينوم",
-        "tantalum": "تانتالوم",
-        "niobium": "نيوبيوم",
-        "hafnium": "هافنيوم",
-        "zirconium": "زركونيوم",
-        "yttrium": "إتريوم",
-        "lanthanum": "لانثانوم",
-        "cerium": "سيريوم",
-        "praseodymium": "براسيوديميوم",
-        "neodymium": "نيوديميوم",
-        "promethium": "بروميثيوم",
-        "samarium": "ساماريوم",
-        "europium": "يوروبيوم",
-        "gadolinium": "جادولينيوم",
-        "terbium": "تيربيوم",
-        "dysprosium": "ديسبروسيوم",
-        "holmium": "هولميوم",
-        "erbium": "إربيوم",
-        "thulium": "ثوليوم",
-        "ytterbium": "إتيربيوم",
-        "lutetium": "لوتيتيوم",
-        "scandium": "سكانديوم",
-        "titanium": "تيتانيوم",
-        "vanadium": "فاناديوم",
-        "chromium": "كروم",
-        "manganese": "منغنيز",
-        "iron": "حديد",
-        "gallium": "غاليوم",
-        "germanium": "جرمانيوم",
-        "arsenic": "زرنيخ",
-        "selenium": "سيلينيوم",
-        "bromine": "بروم",
-        "krypton": "كريبتون",
-        "rubidium": "روبيديوم",
-        "strontium": "سترونشيوم",
-        "technetium": "تكنيشيوم",
-        "cadmium": "كادميوم",
-        "indium": "إنديوم",
-        "tin": "قصدير",
-        "antimony": "إثمد",
-        "tellurium": "تيلوريوم",
-        "iodine": "يود",
-        "xenon": "زينون",
-        "cesium": "سيزيوم",
-        "barium": "باريوم",
-        "protactinium": "بروتكتينيوم",
-        "neptunium": "نبتونيوم",
-        "americium": "أمريكيوم",
-        "curium": "كوريوم",
-        "berkelium": "بركليوم",
-        "californium": "كاليفورنيوم",
-        "einsteinium": "أينشتاينيوم",
-        "fermium": "فيرميوم",
-        "mendelevium": "مندليفيوم",
-        "nobelium": "نوبليوم",
-        "lawrencium": "لورنسيوم",
-        "rutherfordium": "رذرفورديوم",
-        "dubnium": "دوبنيوم",
-        "seaborgium": "سيبورغيوم",
-        "bohrium": "بوريوم",
-        "hassium": "هسيوم",
-        "meitnerium": "مايتنريوم",
-        "darmstadtium": "دارمشتاتيوم",
-        "roentgenium": "رونتجينيوم",
-        "copernicium": "كوبرنيسيوم",
-        "nihonium": "نيهونيوم",
-        "flerovium": "فليروفيوم",
-        "moscovium": "موسكوفيوم",
-        "livermorium": "ليفرموريوم",
-        "tennessine": "تينيسين",
-        "oganesson": "أوغانيسون",
-        # مفاتيح جديدة من القوالب
-        "quick_actions": "إجراءات سريعة",
-        "patient_list": "قائمة المرضى",
-        "portal": "البوابة",
-        "staff_perms": "صلاحيات الموظفين",
-        "view_finance": "عرض المالية",
-        "general_settings": "الإعدادات العامة",
-        "permissions_and_language": "صلاحيات وظهور اللغة",
-        "last_update": "آخر تحديث",
-        "orders_list": "قائمة طلبات التحاليل",
-        "pending_approval": "بانتظار الموافقة",
-        "copy": "نسخ",
-        "ready_to_publish": "جاهزة للنشر",
-        "waiting_approval": "بانتظار الاعتماد",
-        "in_lab": "قيد المختبر",
-        "view_file": "عرض الملف",
-        "copied": "تم النسخ بنجاح",
-        "new_order_registration": "تسجيل طلب تحليل جديد",
-        "patient_name_or_phone": "اسم المريض أو الهاتف",
-        "search_patient_placeholder": "ابحث عن مريض موجود أو أضف جديد",
-        "start_typing_to_search": "ابدأ بالكتابة للبحث عن مريض موجود",
-        "phone_help": "رقم الجوال (10-11 رقم)",
-        "test_example": "مثال: CBC - تحليل صورة دم كاملة",
-        "save_order": "حفظ الطلب",
-        "no_results_add_new": "لا توجد نتائج - سيتم إضافة مريض جديد",
-        "cbc_test": "تحليل صورة دم كاملة",
-        "fasting_sugar": "سكر صائم",
-        "postprandial_sugar": "سكر فاطر",
-        "liver_function": "وظائف كبد",
-        "kidney_function": "وظائف كلى",
-        "lipid_profile": "دهون",
-        "vitamin_d": "فيتامين D",
-        "tsh": "غدة درقية TSH",
-        "lab_management_system": "نظام إدارة المختبر",
-        "test_credentials": "معلومات تجريبية",
-        "patient_record": "سجل المرضى",
-        "full_list": "القائمة الكاملة",
-        "patient": "مريض",
-        "not_available": "غير متوفر",
-        "view_history": "عرض السجل",
-        "total_orders": "إجمالي الطلبات",
-        "ready_results": "النتائج الجاهزة",
-        "visit_and_test_history": "سجل الزيارات والتحاليل",
-        "ready": "جاهزة",
-        "in_process": "قيد المعالجة",
-        "no_visits_registered": "لا توجد زيارات مسجلة",
-        "back_to_patients": "الرجوع لقائمة المرضى",
-        "patient_portal": "بوابة المرضى",
-        "result_inquiry": "استعلام عن نتائج التحاليل الطبية",
-        "enter_your_pin": "أدخل رقم الـ PIN الخاص بك",
-        "pin_help": "الرقم السري الموجود في إيصالك",
-        "pin_placeholder": "XXXXXXXX",
-        "search_for_result": "البحث عن النتيجة",
-        "searching": "جاري البحث...",
-        "your_result_ready": "نتيجتك جاهزة!",
-        "test_date": "تاريخ التحليل",
-        "note_text": "يرجى مراجعة طبيبك المختص لفهم النتائج بشكل صحيح",
-        "ensure": "تأكد من",
-        "ensure_list1": "إدخال رقم الـ PIN بشكل صحيح",
-        "ensure_list2": "أن النتيجة قد تم نشرها من قبل المختبر",
-        "sorry": "عذراً",
-        "current_username": "اسم المستخدم الحالي",
-        "new_password_optional": "كلمة سر جديدة (اتركها فارغة إذا لا تريد التغيير)",
-        "update_success": "تم تحديث البيانات بنجاح",
-        "username_taken": "اسم المستخدم هذا مستخدم من قبل",
-        "revenue_review": "مراجعة الإيرادات والحسابات",
-        "filter_by_date": "تصفية حسب التاريخ",
-        "total_revenue": "إجمالي الإيرادات",
-        "invoice_count": "عدد الفواتير",
-        "average_invoice": "متوسط الفاتورة",
-        "transaction_details": "تفاصيل المعاملات",
-        "amount": "المبلغ",
-        "no_transactions": "لا توجد معاملات في هذه الفترة",
-        "enter_pin_label": "الرقم السري للتقرير (PIN)",
-        "enter_phone_or_name": "رقم الهاتف أو اسم المريض",
-        "phone_or_name_placeholder": "أدخل رقم الهاتف المسجل لدينا",
-        "enter_phone_or_name_error": "يرجى إدخال رقم الهاتف أو الاسم للتحقق",
-        "ensure_list1": "التأكد من كتابة الرقم السري (PIN) بشكل صحيح.",
-        "ensure_list2": "التأكد من إدخال رقم الهاتف الذي زودتنا به عند التسجيل.",
-        "print_report": "طباعة التقرير",
-    },
-    "en": {
-        # English translations (simplified version with only essential keys)
-        "dashboard": "Dashboard",
-        "patients": "Patients",
-        "orders": "Orders",
-        "finance": "Finance",
-        "settings": "Settings",
-        "logout": "Logout",
-        "add_order": "Add Order",
-        "search": "Search",
-        "name": "Name",
-        "phone": "Phone",
-        "test": "Test",
-        "price": "Price",
-        "actions": "Actions",
-        "pending": "Pending",
-        "published": "Published",
-        "view": "View",
-        "edit": "Edit",
-        "delete": "Delete",
-        "upload_result": "Upload Result",
-        "approve": "Approve",
-        "welcome": "Welcome",
-        "today_orders": "Today's Orders",
-        "pending_results": "Pending Results",
-        "patient_count": "Patient Count",
-        "order_count": "Order Count",
-        "login": "Login",
-        "username": "Username",
-        "password": "Password",
-        "submit": "Submit",
-        "back": "Back",
-        "save": "Save",
-        "cancel": "Cancel",
-        "error": "Error",
-        "success": "Success",
-        "loading": "Loading...",
-        "no_data": "No Data",
-        "all_rights_reserved": "All Rights Reserved",
-        "search_patient": "Search patient...",
-        "patient_name": "Patient Name",
-        "currency": "EGP",
-        "status": "Status",
-        "date": "Date",
-        "download": "Download",
-        "total": "Total",
-        "from_date": "From Date",
-        "to_date": "To Date",
-        "profile": "Profile",
-        "enter_pin": "Enter PIN",
-        "check_result": "Check Result",
-        "result_not_found": "Result not found or not published yet",
-        "search_error": "An error occurred while searching",
-        "lab_name": "Lab Name",
-        "publish_link": "Publish Link",
-        "default_language": "Default Language",
-        "show_language": "Show language option to users",
-        "admin": "Admin",
-        "employee": "Employee",
-        "patient_history": "Patient History",
-        "age": "Age",
-        "gender": "Gender",
-        "male": "male",
-        "female": "female",
-        "address": "Address",
-        "notes": "Notes",
-        "last_visit": "Last Visit",
-        "pin": "PIN",
-        "created_at": "Created At",
-        "upload_file": "Upload File",
-        "all": "All",
-        "filter": "Filter",
-        "home": "Home",
-        "language": "Language",
-        "arabic": "Arabic",
-        "english": "English",
-        "change_language": "Change Language",
-        # مفاتيح جديدة من القوالب
-        "quick_actions": "Quick Actions",
-        "patient_list": "Patient List",
-        "portal": "Portal",
-        "staff_perms": "Staff Permissions",
-        "view_finance": "View Finance",
-        "general_settings": "General Settings",
-        "permissions_and_language": "Permissions and Language",
-        "last_update": "Last Update",
-        "save_changes": "Save Changes",
-        "Save Data": "Save Data",
-        "orders_list": "Orders List",
-        "pending_approval": "Pending Approval",
-        "copy": "Copy",
-        "patient_name": "Patient Name",
-        "test_name": "Test Name",
-        "Register New Patient": "Register New Patient",
-        "Cancel and Go Back": "Cancel and Go Back",
-        "ready_to_publish": "Ready to Publish",
-        "waiting_approval": "Waiting Approval",
-        "in_lab": "In Lab",
-        "view_file": "View File",
-        "approve_result": "Approve Result",
-        "copied": "Copied successfully",
-        "new_order_registration": "New Test Order Registration",
-        "patient_name_or_phone": "Patient Name or Phone",
-        "search_patient_placeholder": "Search for existing patient or add new",
-        "start_typing_to_search": "Start typing to search for an existing patient",
-        "phone_help": "Mobile number (10-11 digits)",
-        "test_example": "Example: CBC - Complete Blood Count",
-        "save_order": "Save Order",
-        "no_results_add_new": "No results - a new patient will be added",
-        "cbc_test": "Complete Blood Count",
-        "fasting_sugar": "Fasting Blood Sugar",
-        "postprandial_sugar": "Postprandial Blood Sugar",
-        "liver_function": "Liver Function Tests",
-        "kidney_function": "Kidney Function Tests",
-        "lipid_profile": "Lipid Profile",
-        "vitamin_d": "Vitamin D",
-        "tsh": "Thyroid TSH",
-        "lab_management_system": "Laboratory Management System",
-        "test_credentials": "Test Credentials",
-        "patient_record": "Patient Record",
-        "full_list": "Full List",
-        "patient": "patient",
-        "not_available": "Not Available",
-        "view_history": "View History",
-        "total_orders": "Total Orders",
-        "ready_results": "Ready Results",
-        "visit_and_test_history": "Visit and Test History",
-        "ready": "Ready",
-        "in_process": "In Process",
-        "no_visits_registered": "No visits registered",
-        "back_to_patients": "Back to Patients List",
-        "patient_portal": "Patient Portal",
-        "result_inquiry": "Medical Test Results Inquiry",
-        "enter_your_pin": "Enter your PIN number",
-        "pin_help": "The secret number on your receipt",
-        "pin_placeholder": "XXXXXXXX",
-        "search_for_result": "Search for Result",
-        "searching": "Searching...",
-        "enter_pin": "Please enter PIN number",
-        "your_result_ready": "Your result is ready!",
-        "test_date": "Test Date",
-        "note": "Note",
-        "note_text": "Please consult your specialist doctor to understand the results correctly",
-        "ensure": "Make sure",
-        "ensure_list1": "Enter the PIN correctly",
-        "ensure_list2": "The result has been published by the laboratory",
-        "sorry": "Sorry",
-        "current_username": "Current Username",
-        "new_password_optional": "New password (leave blank if you don't want to change)",
-        "update_success": "Data updated successfully",
-        "username_taken": "This username is already taken",
-        "revenue_review": "Revenue and Accounts Review",
-        "filter_by_date": "Filter by Date",
-        "total_revenue": "Total Revenue",
-        "invoice_count": "Invoice Count",
-        "average_invoice": "Average Invoice",
-        "transaction_details": "Transaction Details",
-        "amount": "Amount",
-        "register_new_patient": "Register New Patient",
-        "name_placeholder": "Enter full name",
-        "optional": "Optional",
-        "notes_placeholder": "Any extra notes here...",
-        "save_data": "Save Data",
-        "cancel_and_back": "Cancel and Go Back",
-        "no_transactions": "No transactions in this period",
-        "enter_pin_label": "Report PIN Code",
-        "enter_phone_or_name": "Phone Number or Patient Name",
-        "phone_or_name_placeholder": "Enter your registered phone number",
-        "enter_phone_or_name_error": "Please enter phone number or name to verify",
-        "ensure_list1": "Make sure the PIN code is entered correctly.",
-        "ensure_list2": "Make sure to enter the phone number you provided us.",
-        "print_report": "Print Report",
-    }
-}
+
+# --- توحيد الأسماء وأرقام الهواتف (لمطابقة المرضى) ---
+ARABIC_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹", "01234567890123456789")
+ARABIC_LETTERS = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ى": "ي", "ـ": None})
+
+def normalize_name(name: str) -> str:
+    """توحيد كتابة الاسم: المسافات وأشكال الألف والياء والتطويل"""
+    return " ".join((name or "").translate(ARABIC_LETTERS).split()).casefold()
+
+NON_DIGITS = re.compile(r"\D")
+
+def normalize_phone(phone: str) -> str:
+    """توحيد رقم الهاتف: أرقام فقط وإزالة كود الدولة (+20)"""
+    digits = NON_DIGITS.sub("", (phone or "").translate(ARABIC_DIGITS))
+    if digits.startswith("00"):
+        digits = digits[2:]
+    if digits.startswith("20") and len(digits) == 12:
+        digits = "0" + digits[2:]
+    return digits
 
 # --- Database Models ---
 Base = declarative_base()
-engine = create_engine("sqlite:///lab.db", connect_args={"check_same_thread": False})
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///lab.db")
+# WAL: القراءة (ومنها النسخ الاحتياطي) لا توقف الكتابة والكتابة لا توقف القراءة
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# محرك غير متزامن (aiosqlite) للمسارات async حتى لا توقف الاستعلامات الـ event loop
+ASYNC_DATABASE_URL = DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # SQLite لا يطبق المفاتيح الأجنبية (ON DELETE CASCADE) إلا إذا تم تفعيلها لكل اتصال
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+@event.listens_for(engine, "before_cursor_execute")
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def before_sql(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def after_sql(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    SQL_LATENCY.observe(elapsed)
+    stats = request_sql_stats.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        # نص الاستعلام فقط: القيم فيها أسماء المرضى وأرقام هواتفهم
+        logger.warning(f"Slow query ({elapsed * 1000:.0f} ms): {statement}")
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True)
@@ -995,12 +655,58 @@ class Patient(Base):
     address = Column(String, nullable=True)
     last_visit = Column(DateTime, default=datetime.now)
     notes = Column(Text, nullable=True)
-    orders = relationship("TestOrder", back_populates="patient", order_by="desc(TestOrder.created_at)")
+    # الاسم والهاتف بعد التوحيد: مفتاح فريد يمنع تكرار نفس المريض (بدون هاتف لا يكفي الاسم وحده)
+    name_key = Column(String, nullable=True)
+    phone_key = Column(String, nullable=True)
+    # lazy="dynamic": لا يتم تحميل كل طلبات المريض دفعة واحدة، السجل يُعرض على صفحات
+    orders = relationship("TestOrder", back_populates="patient", order_by="desc(TestOrder.created_at)",
+                          passive_deletes=True, lazy="dynamic")
+    stats = relationship("PatientStats", uselist=False, lazy="joined", passive_deletes=True)
+
+    __table_args__ = (
+        Index("ux_patients_phone_name", phone_key, name_key, unique=True, sqlite_where=phone_key != ""),
+    )
+
+@event.listens_for(Patient, "before_insert")
+@event.listens_for(Patient, "before_update")
+def set_patient_keys(mapper, connection, patient):
+    patient.name_key = normalize_name(patient.name)
+    patient.phone_key = normalize_phone(patient.phone)
+
+class TestCatalog(Base):
+    """كتالوج التحاليل: الكود والاسم بكل لغة والسعر ومدة التسليم ومدة الاحتفاظ بالنتيجة"""
+    __tablename__ = "test_catalog"
+    id = Column(Integer, primary_key=True)
+    code = Column(String, unique=True, nullable=False)
+    name_ar = Column(String, nullable=False)
+    name_en = Column(String, nullable=False)
+    price = Column(Integer, nullable=True)
+    currency = Column(String, default="ج.م")
+    turnaround_hours = Column(Integer, nullable=True)
+    retention_days = Column(Integer, nullable=True)  # None = RESULT_RETENTION_DAYS
+    active = Column(Boolean, default=True)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class Visit(Base):
+    """زيارة (طلب مجمّع): كل تحاليل المريض في نفس المرة تحت PIN واحد"""
+    __tablename__ = "visits"
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(Integer, ForeignKey("patients.id", ondelete="CASCADE"), index=True)
+    patient_name = Column(String, nullable=False)
+    pin = Column(String, unique=True, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.now)
+    patient = relationship("Patient")
+    orders = relationship("TestOrder", back_populates="visit", order_by="TestOrder.id", passive_deletes=True)
+
+# دورة حياة الطلب بالترتيب، وكل مرحلة بعد الأولى لها عمود وقت (collected_at ...) لحساب زمن الإنجاز
+ORDER_STATUSES = ("ordered", "collected", "resulted", "approved", "published", "expired")
+# قوائم عمل الفنيين: لكل حالة منها فهرس جزئي صغير (الطلبات المنشورة والمنتهية هي أغلب الجدول)
+WORKLIST_STATUSES = ("ordered", "collected", "resulted", "approved")
 
 class TestOrder(Base):
     __tablename__ = "orders"
     id = Column(Integer, primary_key=True)
-    patient_id = Column(Integer, ForeignKey("patients.id"))
+    patient_id = Column(Integer, ForeignKey("patients.id", ondelete="CASCADE"))
     patient_name = Column(String, nullable=False)
     test_name = Column(String, nullable=False)
     price = Column(Integer, nullable=False)
@@ -1012,7 +718,107 @@ class TestOrder(Base):
     is_locked = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.now)
     notes = Column(Text, nullable=True)
+    catalog_id = Column(Integer, ForeignKey("test_catalog.id"), nullable=True)
+    visit_id = Column(Integer, ForeignKey("visits.id", ondelete="CASCADE"), nullable=True)
+    # الحالة تتغير فقط عن طريق order_transition الذي يحدث معها published / admin_approved / is_locked
+    status = Column(String, nullable=False, default="ordered", server_default="ordered")
+    collected_at = Column(DateTime, nullable=True)
+    resulted_at = Column(DateTime, nullable=True)
+    approved_at = Column(DateTime, nullable=True)
+    published_at = Column(DateTime, nullable=True)
+    expired_at = Column(DateTime, nullable=True)
     patient = relationship("Patient", back_populates="orders")
+    visit = relationship("Visit", back_populates="orders")
+
+    __table_args__ = (
+        Index("ix_orders_patient_created", patient_id, created_at.desc(), id.desc()),
+        Index("ix_orders_catalog_created", catalog_id, created_at),
+        Index("ix_orders_visit", visit_id),
+        Index("ix_orders_created", created_at),
+        # ملف واحد قد يخص كل تحاليل الزيارة: طابور الحذف يتأكد من عدم استخدامه قبل حذفه
+        Index("ix_orders_result_file", result_file, sqlite_where=result_file.isnot(None)),
+        # قوائم العمل (WORKLIST_STATUSES): فهرس صغير لكل حالة بترتيب التسجيل
+        Index("ix_orders_worklist_ordered", created_at, sqlite_where=status == "ordered"),
+        Index("ix_orders_worklist_collected", created_at, sqlite_where=status == "collected"),
+        Index("ix_orders_worklist_resulted", created_at, sqlite_where=status == "resulted"),
+        Index("ix_orders_worklist_approved", created_at, sqlite_where=status == "approved"),
+        # AUTOINCREMENT: لا يُعاد استخدام id طلب محذوف أو منقول للأرشيف (بدونها SQLite يعطي MAX(id) + 1)
+        {"sqlite_autoincrement": True},
+    )
+
+class ArchivedOrder(Base):
+    """الطلبات الأقدم من ARCHIVE_AFTER_DAYS (بنفس أعمدة orders ونفس id) حتى يبقى جدول الطلبات صغيراً
+
+    لا تُقرأ إلا عندما تتطلب فلاتر التاريخ ذلك (انظر archive_newest).
+    """
+    __tablename__ = "orders_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    patient_id = Column(Integer, ForeignKey("patients.id", ondelete="CASCADE"))
+    patient_name = Column(String, nullable=False)
+    test_name = Column(String, nullable=False)
+    price = Column(Integer, nullable=False)
+    currency = Column(String, default="ج.م")
+    pin = Column(String, nullable=False, index=True)
+    result_file = Column(String, nullable=True)
+    published = Column(Boolean, default=False)
+    admin_approved = Column(Boolean, default=False)
+    is_locked = Column(Boolean, default=False)
+    created_at = Column(DateTime, index=True)
+    notes = Column(Text, nullable=True)
+    catalog_id = Column(Integer, nullable=True)
+    visit_id = Column(Integer, nullable=True)
+    status = Column(String, nullable=False, default="ordered", server_default="ordered")
+    collected_at = Column(DateTime, nullable=True)
+    resulted_at = Column(DateTime, nullable=True)
+    approved_at = Column(DateTime, nullable=True)
+    published_at = Column(DateTime, nullable=True)
+    expired_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_orders_archive_patient_created", patient_id, created_at.desc(), id.desc()),
+    )
+
+class ArchiveStats(Base):
+    """عدد طلبات الأرشيف وأحدث تاريخ فيه (يحدثهما trigger) لمعرفة هل نحتاج الأرشيف دون قراءته"""
+    __tablename__ = "archive_stats"
+    id = Column(Integer, primary_key=True)
+    order_count = Column(Integer, default=0, nullable=False)
+    newest_order_at = Column(DateTime, nullable=True)
+
+class PatientStats(Base):
+    """ملخص جاهز لكل مريض (يتم تحديثه بواسطة triggers على جدول الطلبات) بدلاً من حسابه عند كل عرض"""
+    __tablename__ = "patient_stats"
+    patient_id = Column(Integer, ForeignKey("patients.id", ondelete="CASCADE"), primary_key=True)
+    visit_count = Column(Integer, default=0)
+    lifetime_spend = Column(Integer, default=0)
+    published_count = Column(Integer, default=0)
+    last_test = Column(String, nullable=True)
+    last_order_at = Column(DateTime, nullable=True)
+
+class FileDeletion(Base):
+    """ملفات نتائج تنتظر الحذف من القرص (تضاف تلقائياً بواسطة triggers عند حذف أو تغيير الطلب)"""
+    __tablename__ = "file_deletion_queue"
+    id = Column(Integer, primary_key=True)
+    path = Column(String, nullable=False)
+    queued_at = Column(DateTime, default=datetime.now)
+
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+    id = Column(Integer, primary_key=True)
+    source = Column(String, nullable=False)
+    checksum = Column(String, index=True, nullable=False)
+    status = Column(String, default="running")
+    rows_done = Column(Integer, default=0)
+    patients_created = Column(Integer, default=0)
+    orders_created = Column(Integer, default=0)
+    # الصفوف المرفوضة وأرقام PIN القديمة التي تغيرت مسجلة في report_file (CSV لكل مهمة)
+    rows_skipped = Column(Integer, default=0)
+    pins_remapped = Column(Integer, default=0)
+    report_file = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now)
 
 class SystemSettings(Base):
     __tablename__ = "settings"
@@ -1025,9 +831,422 @@ class SystemSettings(Base):
     show_language_to_users = Column(Boolean, default=False)
     show_finance_to_users = Column(Boolean, default=False)
 
-Base.metadata.create_all(bind=engine)
+class AuditEntry(Base):
+    """سجل التدقيق: إضافة فقط (triggers تمنع التعديل والحذف) وكل سطر يحمل بصمة تشمل بصمة السطر السابق"""
+    __tablename__ = "audit_log"
+    id = Column(Integer, primary_key=True)
+    at = Column(DateTime, nullable=False, index=True)
+    username = Column(String, nullable=True)
+    action = Column(String, nullable=False)
+    entity = Column(String, nullable=False)
+    entity_id = Column(String, nullable=True)
+    payload = Column(Text, nullable=True)  # JSON مختصر: القيم قبل وبعد التعديل أو بيانات الحدث
+    hash = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index("ix_audit_entity", entity, entity_id, at),
+    )
+
+class ResultValue(Base):
+    """قيم النتائج كسلسلة زمنية لكل مريض (جدول WITHOUT ROWID)
+
+    المفتاح الأساسي (patient_id, analyte, observed_at, order_id) هو ترتيب التخزين نفسه: كل قيم تحليل واحد
+    لمريض متجاورة ومرتبة بالتاريخ، فمنحنى التحليل قراءة متصلة واحدة من الجدول بدون الرجوع لفهرس آخر.
+    order_id بدون مفتاح أجنبي: نقل الطلب للأرشيف يحذفه من orders ويجب أن تبقى قيمه،
+    والحذف الفعلي للطلب يحذفها عبر trigger.
+    """
+    __tablename__ = "result_values"
+    patient_id = Column(Integer, ForeignKey("patients.id", ondelete="CASCADE"), primary_key=True, autoincrement=False)
+    analyte = Column(String, primary_key=True)
+    observed_at = Column(DateTime, primary_key=True)
+    order_id = Column(Integer, primary_key=True, autoincrement=False)
+    value = Column(String, nullable=True)        # كما أرسلها الجهاز ("5.4" أو "<0.5" أو "Positive")
+    value_num = Column(Float, nullable=True)     # الجزء الرقمي للمنحنيات والإحصاء
+    units = Column(String, nullable=True)
+    reference_range = Column(String, nullable=True)
+    ref_low = Column(Float, nullable=True)
+    ref_high = Column(Float, nullable=True)
+    flag = Column(String, nullable=True)  # L / H / LL / HH / A ... من الجهاز أو محسوبة من المدى، والطبيعي NULL
+    abnormal = Column(Boolean, default=False, nullable=False)
+    instrument = Column(String, nullable=True)
+    received_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # إعادة إرسال نفس التحليل (إعادة تشغيل العينة) تستبدل القيمة القديمة
+        Index("ix_result_values_order_analyte", order_id, analyte, unique=True),
+        # النتائج غير الطبيعية لمريض بالتاريخ: فهرس صغير يضم فقط الصفوف غير الطبيعية
+        Index("ix_result_values_abnormal", patient_id, observed_at.desc(), sqlite_where=text("abnormal = 1")),
+        # إحصاء تحليل على كل المرضى في فترة: الفهرس يحتوي كل الأعمدة المطلوبة (covering)
+        Index("ix_result_values_analyte", analyte, observed_at, value_num, abnormal),
+        {"sqlite_with_rowid": False},
+    )
+
+class Notification(Base):
+    """طابور إشعارات المرضى (outbox): يُضاف في نفس transaction الاعتماد ويرسله NotificationWorker"""
+    __tablename__ = "notification_outbox"
+    id = Column(Integer, primary_key=True)
+    provider = Column(String, nullable=False)
+    recipient = Column(String, nullable=False)
+    message = Column(Text, nullable=False)
+    order_id = Column(Integer, nullable=True)
+    patient_id = Column(Integer, ForeignKey("patients.id", ondelete="CASCADE"), nullable=True)
+    status = Column(String, default="pending", nullable=False)  # pending / sent / failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.now, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # الـ worker يبحث فقط في الإشعارات المنتظرة: الفهرس لا يكبر مع الإشعارات المرسلة
+        Index("ix_outbox_due", provider, next_attempt_at, sqlite_where=text("status = 'pending'")),
+    )
+
+class WebSession(Base):
+    """جلسات المستخدمين (الكوكي يحمل المعرّف فقط، انظر ServerSessionMiddleware)"""
+    __tablename__ = "web_sessions"
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, index=True, nullable=True)
+    data = Column(Text, nullable=False)
+    expires_at = Column(Integer, index=True, nullable=False)
+
+class TableVersion(Base):
+    """رقم إصدار لكل جدول يزيد مع كل كتابة عليه (بواسطة triggers) ويدخل في ETag الصفحات"""
+    __tablename__ = "table_versions"
+    name = Column(String, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+VERSIONED_TABLES = ("orders", "patients", "users", "settings", "test_catalog")
+
+def backfill_order_status(conn, table: str):
+    """حالة الطلبات من الأعمدة القديمة مرة واحدة عند الترقية (أوقات المراحل السابقة غير معروفة فتبقى NULL)
+
+    الحذف بعد مدة الاحتفاظ يفرغ الملف والنشر ويترك admin_approved = 1.
+    """
+    backfilled = conn.execute(text(f"""
+        UPDATE {table} SET status = CASE
+            WHEN published = 1 THEN 'published'
+            WHEN result_file IS NOT NULL AND admin_approved = 1 THEN 'approved'
+            WHEN result_file IS NOT NULL THEN 'resulted'
+            WHEN admin_approved = 1 THEN 'expired'
+            ELSE 'resulted' END,
+        is_locked = published = 1 OR (result_file IS NULL AND admin_approved = 1)
+        WHERE published = 1 OR admin_approved = 1 OR result_file IS NOT NULL
+            OR EXISTS (SELECT 1 FROM result_values WHERE order_id = {table}.id)
+    """)).rowcount
+    logger.info(f"Order status backfilled for {backfilled} orders in {table}")
+
+def ensure_schema():
+    """ترقية قواعد البيانات القديمة (create_all لا يضيف أعمدة لجداول موجودة)"""
+    with engine.begin() as conn:
+        columns = {row[1] for row in conn.execute(text("PRAGMA table_info(patients)"))}
+        if "name_key" not in columns:
+            conn.execute(text("ALTER TABLE patients ADD COLUMN name_key VARCHAR"))
+            conn.execute(text("ALTER TABLE patients ADD COLUMN phone_key VARCHAR"))
+            rows = conn.execute(text("SELECT id, name, phone FROM patients ORDER BY id")).all()
+            keep = {}
+            merged = 0
+            for pid, name, phone in rows:
+                key = (normalize_name(name), normalize_phone(phone))
+                if key[1] and key in keep:
+                    # مريض مكرر: البيانات الناقصة في السجل الأقدم تُكمل من المكرر، ثم تنتقل طلباته إليه ويُحذف
+                    conn.execute(text("""
+                        UPDATE patients SET
+                            age = COALESCE(age, (SELECT age FROM patients WHERE id = :dup)),
+                            gender = COALESCE(gender, (SELECT gender FROM patients WHERE id = :dup)),
+                            address = COALESCE(address, (SELECT address FROM patients WHERE id = :dup)),
+                            notes = COALESCE(notes, (SELECT notes FROM patients WHERE id = :dup)),
+                            last_visit = NULLIF(MAX(COALESCE(last_visit, ''),
+                                                    COALESCE((SELECT last_visit FROM patients WHERE id = :dup), '')), '')
+                        WHERE id = :keep
+                    """), {"keep": keep[key], "dup": pid})
+                    conn.execute(text("UPDATE orders SET patient_id = :keep WHERE patient_id = :dup"),
+                                 {"keep": keep[key], "dup": pid})
+                    conn.execute(text("DELETE FROM patients WHERE id = :dup"), {"dup": pid})
+                    merged += 1
+                    continue
+                keep[key] = pid
+                conn.execute(text("UPDATE patients SET name_key = :n, phone_key = :p WHERE id = :id"),
+                             {"n": key[0], "p": key[1], "id": pid})
+            logger.info(f"Patient keys backfilled, {merged} duplicates merged")
+        # المفتاح كان على كل المرضى: مرضى بدون هاتف بنفس الاسم ليسوا بالضرورة نفس الشخص
+        index_sql = conn.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND name = 'ux_patients_phone_name'"
+        )).scalar()
+        if index_sql and "WHERE" not in index_sql:
+            conn.execute(text("DROP INDEX ux_patients_phone_name"))
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_patients_phone_name ON patients (phone_key, name_key) WHERE phone_key != ''"
+        ))
+
+    # إعادة بناء جدول الطلبات القديم حتى يحصل على ON DELETE CASCADE و AUTOINCREMENT
+    # (SQLite لا يعدل المفاتيح الأجنبية ولا نوع المفتاح بـ ALTER)
+    with engine.connect() as conn:
+        fks = conn.execute(text("PRAGMA foreign_key_list(orders)")).all()
+        table_sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'orders'")).scalar()
+        # orders_old باقٍ من إعادة بناء سابقة لم تكتمل (قبل أن تصبح في transaction واحدة): نكمل النقل
+        leftover = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'orders_old'")).scalar()
+        rebuild = not any(fk[2] == "patients" and fk[6] == "CASCADE" for fk in fks) or "AUTOINCREMENT" not in table_sql
+        if leftover or rebuild:
+            conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            # بدون legacy: RENAME يغير أي إشارة لـ orders في الجداول الأخرى إلى orders_old
+            conn.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+            conn.commit()
+            # pysqlite لا يبدأ transaction قبل أوامر DDL: BEGIN صريح حتى تُنفذ كل الخطوات أو لا شيء منها
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                if not leftover:
+                    for (index_name,) in conn.execute(text(
+                        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'orders' AND sql IS NOT NULL"
+                    )).all():
+                        conn.execute(text(f"DROP INDEX {index_name}"))
+                    conn.execute(text("ALTER TABLE orders RENAME TO orders_old"))
+                    TestOrder.__table__.create(conn)
+                old_columns = [row[1] for row in conn.execute(text("PRAGMA table_info(orders_old)"))]
+                columns = [c for c in old_columns if c in TestOrder.__table__.columns]
+                # طلبات أُضيفت بعد إعادة البناء الناقصة قد تأخذ id طلب قديم: القديم يُنقل بـ id جديد
+                clashes = conn.execute(text("SELECT id FROM orders_old WHERE id IN (SELECT id FROM orders)")).scalars().all()
+                conn.execute(text(
+                    f"INSERT INTO orders ({', '.join(columns)}) SELECT {', '.join(columns)} FROM orders_old "
+                    "WHERE id NOT IN (SELECT id FROM orders)"
+                ))
+                if clashes:
+                    without_id = ", ".join(c for c in columns if c != "id")
+                    conn.execute(text(
+                        f"INSERT INTO orders ({without_id}) SELECT {without_id} FROM orders_old "
+                        f"WHERE id IN (SELECT value FROM json_each(:ids)) ORDER BY id"
+                    ), {"ids": json.dumps(clashes)})
+                    logger.warning(f"Recovered orders renumbered (old ids {clashes[:20]})")
+                conn.execute(text("DROP TABLE orders_old"))
+                # الجدول الجديد ينشئ status بقيمته الافتراضية 'ordered'
+                if "status" not in old_columns:
+                    backfill_order_status(conn, "orders")
+                # الأرقام الجديدة تبدأ بعد أكبر id في الجدول والأرشيف معاً
+                conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'orders'"))
+                conn.execute(text(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT 'orders', MAX("
+                    "COALESCE((SELECT MAX(id) FROM orders), 0), COALESCE((SELECT MAX(id) FROM orders_archive), 0))"
+                ))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+                conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+                conn.commit()
+            logger.info("Orders table rebuilt with ON DELETE CASCADE and AUTOINCREMENT")
+
+    # ترقية result_values من جدول بـ id إلى السلسلة الزمنية WITHOUT ROWID (مع حساب القيم الرقمية والعلامات)
+    with engine.begin() as conn:
+        if "id" in {row[1] for row in conn.execute(text("PRAGMA table_info(result_values)"))}:
+            rows = conn.execute(text(
+                "SELECT order_id, patient_id, analyte, value, units, reference_range, flag, observed_at, instrument, "
+                "received_at FROM result_values"
+            )).mappings().all()
+            # الـ triggers تشير للجدول بالاسم: تُحذف هنا وتُنشأ من جديد مع باقي الـ triggers
+            conn.execute(text("DROP TRIGGER IF EXISTS trg_orders_delete_results"))
+            conn.execute(text("DROP TRIGGER IF EXISTS trg_orders_archive_delete_results"))
+            conn.execute(text("DROP TABLE result_values"))
+            ResultValue.__table__.create(conn)
+            if rows:
+                conn.execute(insert(ResultValue), [result_value_row(
+                    **{k: row[k] for k in ("order_id", "patient_id", "analyte", "value", "units",
+                                           "reference_range", "flag", "instrument")},
+                    observed_at=datetime.fromisoformat(row["observed_at"]) if row["observed_at"] else None,
+                    received_at=datetime.fromisoformat(row["received_at"]) if row["received_at"] else None
+                ) for row in rows])
+            logger.info(f"result_values rebuilt as a time-series table ({len(rows)} values)")
+
+    with engine.begin() as conn:
+        if "rows_skipped" not in {row[1] for row in conn.execute(text("PRAGMA table_info(import_jobs)"))}:
+            conn.execute(text("ALTER TABLE import_jobs ADD COLUMN rows_skipped INTEGER DEFAULT 0"))
+            conn.execute(text("ALTER TABLE import_jobs ADD COLUMN pins_remapped INTEGER DEFAULT 0"))
+            conn.execute(text("ALTER TABLE import_jobs ADD COLUMN report_file VARCHAR"))
+        order_columns = {row[1] for row in conn.execute(text("PRAGMA table_info(orders)"))}
+        if "catalog_id" not in order_columns:
+            conn.execute(text("ALTER TABLE orders ADD COLUMN catalog_id INTEGER REFERENCES test_catalog(id)"))
+        if "visit_id" not in order_columns:
+            # الطلبات القديمة تبقى بدون زيارة (visit_id = NULL) وتعمل بالـ PIN الخاص بها كما كانت
+            conn.execute(text("ALTER TABLE orders ADD COLUMN visit_id INTEGER REFERENCES visits(id) ON DELETE CASCADE"))
+        for table in ("orders", "orders_archive"):
+            if "status" not in {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN status VARCHAR NOT NULL DEFAULT 'ordered'"))
+                for name in ORDER_STATUSES[1:]:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name}_at DATETIME"))
+                backfill_order_status(conn, table)
+        for name in WORKLIST_STATUSES:
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_orders_worklist_{name} ON orders (created_at) WHERE status = '{name}'"
+            ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_orders_patient_created ON orders (patient_id, created_at DESC, id DESC)"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_catalog_created ON orders (catalog_id, created_at)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_visit ON orders (visit_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_created ON orders (created_at)"))
+        # ترقية: هذه الـ triggers كانت قبل الأرشيف (النقل إليه ليس حذفاً، وملخص المريض يشمل الأرشيف)
+        for (name,) in conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'orders' AND name IN "
+            "('trg_patient_stats_delete', 'trg_patient_stats_update_old', 'trg_patient_stats_update_new', "
+            "'trg_orders_delete_file') AND sql NOT LIKE '%orders_archive%'"
+        )).all():
+            conn.execute(text(f"DROP TRIGGER {name}"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_orders_result_file ON orders (result_file) WHERE result_file IS NOT NULL"
+        ))
+        # ملخص المريض: إضافة طلب تحدث الملخص مباشرة، والتعديل والحذف يعيدان حسابه من الفهرس
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS trg_patient_stats_insert AFTER INSERT ON orders
+            WHEN new.patient_id IS NOT NULL
+            BEGIN
+                INSERT INTO patient_stats (patient_id, visit_count, lifetime_spend, published_count, last_test, last_order_at)
+                VALUES (new.patient_id, 1, new.price, COALESCE(new.published, 0), new.test_name, new.created_at)
+                ON CONFLICT (patient_id) DO UPDATE SET
+                    visit_count = visit_count + 1,
+                    lifetime_spend = lifetime_spend + excluded.lifetime_spend,
+                    published_count = published_count + excluded.published_count,
+                    last_test = CASE WHEN excluded.last_order_at >= COALESCE(last_order_at, '')
+                                     THEN excluded.last_test ELSE last_test END,
+                    last_order_at = MAX(COALESCE(last_order_at, ''), excluded.last_order_at);
+            END
+        """))
+        for name, event_sql, pid in (
+            ("trg_patient_stats_delete",
+             "AFTER DELETE ON orders WHEN NOT EXISTS (SELECT 1 FROM orders_archive WHERE id = old.id)", "old.patient_id"),
+            ("trg_patient_stats_update_old",
+             "AFTER UPDATE OF patient_id, price, published, test_name, created_at ON orders", "old.patient_id"),
+            ("trg_patient_stats_update_new",
+             "AFTER UPDATE OF patient_id ON orders WHEN new.patient_id IS NOT old.patient_id", "new.patient_id"),
+        ):
+            # عند حذف المريض نفسه (CASCADE) لا داعي لإعادة الحساب لكل طلب
+            conn.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS {name} {event_sql}
+                BEGIN
+                    INSERT OR REPLACE INTO patient_stats
+                        (patient_id, visit_count, lifetime_spend, published_count, last_test, last_order_at)
+                    SELECT * FROM (
+                        SELECT {pid}, COUNT(*), COALESCE(SUM(price), 0), COALESCE(SUM(published), 0),
+                               COALESCE(
+                                   (SELECT test_name FROM orders WHERE patient_id = {pid} ORDER BY created_at DESC LIMIT 1),
+                                   (SELECT test_name FROM orders_archive WHERE patient_id = {pid} ORDER BY created_at DESC LIMIT 1)
+                               ),
+                               MAX(created_at)
+                        FROM (
+                            SELECT price, published, created_at FROM orders WHERE patient_id = {pid}
+                            UNION ALL
+                            SELECT price, published, created_at FROM orders_archive WHERE patient_id = {pid}
+                        )
+                    ) WHERE EXISTS (SELECT 1 FROM patients WHERE id = {pid});
+                END
+            """))
+        if not conn.execute(text("SELECT 1 FROM patient_stats LIMIT 1")).first():
+            conn.execute(text("""
+                INSERT INTO patient_stats (patient_id, visit_count, lifetime_spend, published_count, last_test, last_order_at)
+                SELECT o.patient_id, COUNT(*), COALESCE(SUM(o.price), 0), COALESCE(SUM(o.published), 0),
+                       (SELECT test_name FROM orders WHERE patient_id = o.patient_id ORDER BY created_at DESC LIMIT 1),
+                       MAX(o.created_at)
+                FROM orders o JOIN patients p ON p.id = o.patient_id
+                GROUP BY o.patient_id
+            """))
+
+        # أي ملف نتيجة يخرج من قاعدة البيانات (حذف الطلب أو المريض أو استبدال الملف) يدخل طابور الحذف
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS trg_orders_delete_file AFTER DELETE ON orders
+            WHEN old.result_file IS NOT NULL AND NOT EXISTS (SELECT 1 FROM orders_archive WHERE id = old.id)
+            BEGIN
+                INSERT INTO file_deletion_queue (path, queued_at) VALUES (old.result_file, datetime('now', 'localtime'));
+            END
+        """))
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS trg_orders_archive_delete_file AFTER DELETE ON orders_archive
+            WHEN old.result_file IS NOT NULL
+            BEGIN
+                INSERT INTO file_deletion_queue (path, queued_at) VALUES (old.result_file, datetime('now', 'localtime'));
+            END
+        """))
+        # ملخص الأرشيف: العدد للوحة التحكم، وأحدث تاريخ لمعرفة هل تحتاج فلاتر التاريخ الأرشيف
+        conn.execute(text("INSERT OR IGNORE INTO archive_stats (id, order_count) VALUES (1, 0)"))
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS trg_archive_stats_insert AFTER INSERT ON orders_archive
+            BEGIN
+                UPDATE archive_stats SET order_count = order_count + 1,
+                    newest_order_at = MAX(COALESCE(newest_order_at, ''), new.created_at)
+                WHERE id = 1;
+            END
+        """))
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS trg_archive_stats_delete AFTER DELETE ON orders_archive
+            BEGIN
+                UPDATE archive_stats SET order_count = order_count - 1 WHERE id = 1;
+            END
+        """))
+        # قيم النتائج تُحذف مع الطلب، ولا تُحذف عند نقله للأرشيف
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS trg_orders_delete_results AFTER DELETE ON orders
+            WHEN NOT EXISTS (SELECT 1 FROM orders_archive WHERE id = old.id)
+            BEGIN
+                DELETE FROM result_values WHERE order_id = old.id;
+            END
+        """))
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS trg_orders_archive_delete_results AFTER DELETE ON orders_archive
+            BEGIN
+                DELETE FROM result_values WHERE order_id = old.id;
+            END
+        """))
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS trg_orders_replace_file AFTER UPDATE OF result_file ON orders
+            WHEN old.result_file IS NOT NULL AND old.result_file IS NOT new.result_file
+            BEGIN
+                INSERT INTO file_deletion_queue (path, queued_at) VALUES (old.result_file, datetime('now', 'localtime'));
+            END
+        """))
+
+        # سجل التدقيق للإضافة فقط: أي تعديل أو حذف يفشل (والتلاعب المباشر في الملف تكشفه سلسلة البصمات)
+        for op in ("UPDATE", "DELETE"):
+            conn.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_audit_log_no_{op.lower()} BEFORE {op} ON audit_log
+                BEGIN
+                    SELECT RAISE(ABORT, 'audit_log is append-only');
+                END
+            """))
+
+        # أي كتابة على الجداول التي تعرضها الصفحات ترفع رقم إصدارها فيتغير الـ ETag
+        for table in VERSIONED_TABLES:
+            conn.execute(text("INSERT OR IGNORE INTO table_versions (name, version) VALUES (:name, 0)"), {"name": table})
+            for op in ("INSERT", "UPDATE", "DELETE"):
+                conn.execute(text(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{op.lower()} AFTER {op} ON {table}
+                    BEGIN
+                        UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                    END
+                """))
+
+def init_db():
+    """إنشاء الجداول وترقية القواعد القديمة (يُستدعى عند التشغيل وليس عند الاستيراد)"""
+    with engine.connect() as conn:
+        conn.exec_driver_sql(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")  # يُحفظ داخل ملف القاعدة
+    Base.metadata.create_all(bind=engine)
+    ensure_schema()
 
 # --- Pydantic Models ---
+class BulkOrderFilter(BaseModel):
+    status: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+class BulkOrderAction(BaseModel):
+    action: str
+    ids: Optional[List[int]] = None
+    filter: Optional[BulkOrderFilter] = None
+
+    @validator('action')
+    def action_must_be_known(cls, v):
+        if v not in ("approve", "publish", "republish"):
+            raise ValueError('الإجراء يجب أن يكون approve أو publish أو republish')
+        return v
+
 class OrderCreate(BaseModel):
     name: str
     phone: Optional[str] = None
@@ -1055,6 +1274,10 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def get_current_user(request: Request):
     user = request.session.get("user")
     if not user:
@@ -1069,10 +1292,10 @@ def require_admin(request: Request):
 
 # --- Utility Functions ---
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def generate_secure_pin(phone: str = None) -> str:
     """Generate 6-digit PIN: last 2 digits of phone + 4 random digits"""
@@ -1084,6 +1307,73 @@ def generate_secure_pin(phone: str = None) -> str:
     random_four = f"{random.randint(1000, 9999)}"
     return last_two + random_four
 
+def upsert_patient(db: Session, name: str, phone: str, age=None, gender=None, address=None, notes=None):
+    """إضافة المريض أو تحديث آخر زيارة له بأمر واحد (INSERT ... ON CONFLICT)
+
+    لا تقوم بعمل commit حتى يتم حفظ المريض والطلب في نفس الـ transaction.
+    ترجع (id, name) للمريض الموجود أو الجديد. بدون رقم هاتف يُضاف مريض جديد دائماً.
+    """
+    now = datetime.now()
+    phone_key = normalize_phone(phone)
+    stmt = sqlite_insert(Patient).values(
+        name=name, phone=phone, age=age, gender=gender, address=address, notes=notes,
+        last_visit=now, name_key=normalize_name(name), phone_key=phone_key
+    )
+    if not phone_key:
+        return db.execute(stmt.returning(Patient.id, Patient.name)).one()
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Patient.phone_key, Patient.name_key],
+        index_where=Patient.phone_key != "",
+        set_={
+            "last_visit": now,
+            "age": func.coalesce(stmt.excluded.age, Patient.age),
+            "gender": func.coalesce(stmt.excluded.gender, Patient.gender),
+            "address": func.coalesce(stmt.excluded.address, Patient.address),
+            "notes": func.coalesce(stmt.excluded.notes, Patient.notes),
+        }
+    ).returning(Patient.id, Patient.name)
+    return db.execute(stmt).one()
+
+def generate_visit_pin(db: Session, phone: str = None) -> str:
+    """PIN جديد لا يتكرر مع أي زيارة أو طلب قديم ولا مع بداية PIN طلب (pin-1، pin-2) (استعلام واحد لكل محاولة)"""
+    while True:
+        pin = generate_secure_pin(phone)
+        # "." بعد "-" مباشرة في الترتيب: المدى [pin-, pin.) هو كل ما يبدأ بـ pin- ويستخدم فهرس pin
+        taken = db.execute(
+            select(Visit.id).where(Visit.pin == pin).union_all(
+                select(TestOrder.id).where(or_(TestOrder.pin == pin, and_(
+                    TestOrder.pin >= f"{pin}-", TestOrder.pin < f"{pin}."))),
+                select(ArchivedOrder.id).where(or_(ArchivedOrder.pin == pin, and_(
+                    ArchivedOrder.pin >= f"{pin}-", ArchivedOrder.pin < f"{pin}.")))
+            ).limit(1)
+        ).first()
+        if not taken:
+            return pin
+
+def create_visit(db: Session, patient, lines: List[dict], phone: str = None, currency: str = "ج.م") -> Visit:
+    """إنشاء زيارة بكل تحاليلها في الـ transaction الحالية (بدون commit مثل upsert_patient)
+
+    كل سطر dict فيه test_name و price و catalog_id. كل التحاليل تُضاف بأمر INSERT واحد (executemany)
+    فعدد الاستعلامات ثابت مهما كان عدد التحاليل. PIN التحليل هو PIN الزيارة إذا كانت تحليلاً واحداً،
+    وإلا PIN الزيارة ثم رقم السطر (451234-1، 451234-2، ...).
+    """
+    now = datetime.now()
+    visit = Visit(patient_id=patient.id, patient_name=patient.name, pin=generate_visit_pin(db, phone), created_at=now)
+    db.add(visit)
+    db.flush()
+    db.execute(insert(TestOrder), [{
+        "visit_id": visit.id,
+        "patient_id": patient.id,
+        "patient_name": patient.name,
+        "test_name": line["test_name"],
+        "price": line["price"],
+        "currency": currency,
+        "pin": visit.pin if len(lines) == 1 else f"{visit.pin}-{n}",
+        "catalog_id": line.get("catalog_id"),
+        "created_at": now
+    } for n, line in enumerate(lines, 1)])
+    return visit
+
 def get_or_create_settings(db: Session) -> SystemSettings:
     settings = db.query(SystemSettings).first()
     if not settings:
@@ -1107,48 +1397,2055 @@ def get_language(request: Request, db: Session = None):
     
     return "ar"
 
+def translations_for(lang: str) -> dict:
+    from translations import TRANSLATIONS  # جدول الترجمة الكبير يُحمّل عند عرض أول صفحة فقط
+    return TRANSLATIONS.get(lang, TRANSLATIONS["ar"])
+
 def get_translations(request: Request, db: Session = None):
     """الحصول على النصوص المترجمة للغة الحالية"""
     lang = get_language(request, db)
-    return TRANSLATIONS.get(lang, TRANSLATIONS["ar"])
+    return translations_for(lang)
+
+async def get_settings_async(db: AsyncSession) -> SystemSettings:
+    """نفس get_or_create_settings لكن للجلسة غير المتزامنة"""
+    settings = (await db.execute(select(SystemSettings).limit(1))).scalar_one_or_none()
+    if not settings:
+        settings = SystemSettings()
+        db.add(settings)
+        await db.commit()
+        await db.refresh(settings)
+    return settings
+
+async def get_language_async(request: Request, db: AsyncSession) -> str:
+    user_session = request.session.get("user")
+    if user_session and user_session.get("language"):
+        return user_session.get("language")
+    return (await get_settings_async(db)).default_language
+
+# --- HTTP Caching (ETag) ---
+@lru_cache(maxsize=None)
+def etag_salt() -> str:
+    """يتغير مع تعديل الكود أو القوالب حتى لا تبقى نسخة قديمة من الصفحة في المتصفح
+    (يُحسب عند أول صفحة وليس عند الاستيراد، فالسكربتات تستورد lab_app من أي مجلد)"""
+    if os.getenv("ETAG_SALT"):
+        return os.getenv("ETAG_SALT")
+    paths = [__file__, os.path.join(os.path.dirname(os.path.abspath(__file__)), "translations.py")]
+    if os.path.isdir(TEMPLATES_DIR):
+        paths += [os.path.join(TEMPLATES_DIR, f) for f in os.listdir(TEMPLATES_DIR)]
+    return str(max(os.path.getmtime(p) for p in paths if os.path.isfile(p)))
+
+TABLE_VERSIONS_SQL = text("SELECT name, version FROM table_versions")
+
+def get_table_versions(db: Session) -> dict:
+    return dict(db.execute(TABLE_VERSIONS_SQL).all())
+
+async def get_table_versions_async(db: AsyncSession) -> dict:
+    return dict((await db.execute(TABLE_VERSIONS_SQL)).all())
+
+def page_etag(request: Request, versions: dict, *extra) -> str:
+    """ETag للصفحة = إصدارات الجداول + المستخدم وصلاحياته ولغته + الرابط"""
+    user = request.session.get("user") or {}
+    parts = [etag_salt(), request.url.path, request.url.query,
+             user.get("id"), user.get("username"), user.get("role"), user.get("can_view_finance"), user.get("language")]
+    parts += [f"{name}:{versions[name]}" for name in sorted(versions)]
+    parts += extra
+    return 'W/"' + hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest() + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def with_etag(response: Response, etag: str) -> Response:
+    # private: الصفحة خاصة بالمستخدم، no-cache: المتصفح يتحقق من الخادم في كل مرة (ويحصل على 304 إن لم يتغير شيء)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def not_modified(etag: str) -> Response:
+    return with_etag(Response(status_code=304), etag)
+
+# --- كتالوج التحاليل ---
+class TestCatalogIndex:
+    """فهرس بادئات (trie) في الذاكرة لكتالوج التحاليل: البحث أثناء الكتابة لا يلمس جدول الكتالوج،
+    ويُعاد بناؤه عندما يتغير إصدار الجدول في table_versions (حتى لو تغير من عملية أخرى)"""
+
+    MAX_MATCHES = 20  # أقصى عدد نتائج محفوظ في كل عقدة
+
+    def __init__(self):
+        # (version, trie, entries, exact) تُستبدل مرة واحدة حتى لا يرى البحث فهرساً نصف مبني
+        self.state = (None, {}, {}, {})
+
+    @property
+    def version(self):
+        return self.state[0]
+
+    @property
+    def entries(self) -> dict:
+        return self.state[2]
+
+    def build(self, rows, version):
+        root, entries, exact = {}, {}, {}
+        for row in sorted(rows, key=lambda r: r.code):
+            entries[row.id] = {
+                "id": row.id, "code": row.code, "name_ar": row.name_ar, "name_en": row.name_en,
+                "price": row.price, "currency": row.currency, "turnaround_hours": row.turnaround_hours,
+            }
+            terms = {normalize_name(term) for term in (row.code, row.name_ar, row.name_en) if term}
+            for term in terms:
+                exact.setdefault(term, row.id)
+            # كل كلمة داخل الاسم بداية بحث أيضاً ("profile" تجد "Lipid Profile")
+            for key in terms | {word for term in terms for word in term.split()}:
+                node = root
+                for char in key:
+                    node = node.setdefault(char, {})
+                    ids = node.setdefault("", [])
+                    if len(ids) < self.MAX_MATCHES and row.id not in ids:
+                        ids.append(row.id)
+        self.state = (version, root, entries, exact)
+
+    def search(self, prefix: str, limit: int = 10) -> List[dict]:
+        _, node, entries, _ = self.state
+        key = normalize_name(prefix)
+        if not key:
+            return list(entries.values())[:limit]
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                return []
+        return [entries[i] for i in node[""][:limit]]
+
+    def match(self, name: str) -> Optional[dict]:
+        """التحليل الذي كوده أو اسمه هو name بالضبط (بعد التوحيد)"""
+        _, _, entries, exact = self.state
+        catalog_id = exact.get(normalize_name(name))
+        return entries.get(catalog_id)
+
+test_catalog = TestCatalogIndex()
+
+def get_test_catalog(db: Session) -> TestCatalogIndex:
+    version = get_table_versions(db).get("test_catalog")
+    if version != test_catalog.version:
+        test_catalog.build(db.query(TestCatalog).filter(TestCatalog.active == True).all(), version)
+    return test_catalog
+
+async def get_test_catalog_async(db: AsyncSession) -> TestCatalogIndex:
+    version = (await get_table_versions_async(db)).get("test_catalog")
+    if version != test_catalog.version:
+        rows = (await db.execute(select(TestCatalog).where(TestCatalog.active == True))).scalars().all()
+        test_catalog.build(rows, version)
+    return test_catalog
+
+def publish_result_online(publish_link: str, item: dict):
+    """إرسال نتيجة واحدة أونلاين (يعمل في الخلفية بعد الرد على المستخدم)"""
+    import requests
+
+    try:
+        with open(item["file_path"], "rb") as f:
+            response = requests.post(
+                publish_link,
+                data={k: v for k, v in item.items() if k != "file_path"},
+                files={"file": (os.path.basename(item["file_path"]), f)},
+                timeout=30
+            )
+        if response.status_code == 200:
+            logger.info(f"Result sent online for order {item['pin']}")
+        else:
+            logger.warning(f"Online upload failed with status {response.status_code}")
+    except Exception as e:
+        logger.error(f"Error sending result online: {e}")
+
+def order_status_criteria(status: Optional[str]) -> list:
+    """شروط تصفية الطلبات حسب الحالة (نفس التصفية المستخدمة في صفحة الطلبات)"""
+    if status == "pending":
+        return [TestOrder.status.in_(WORKLIST_STATUSES)]
+    if status == "published":
+        return [TestOrder.status == "published"]
+    if status == "pending_approval":
+        return [TestOrder.status == "resulted", TestOrder.result_file.isnot(None)]
+    return []
+
+# الانتقالات المسموحة: الرجوع إلى resulted عند رفع ملف جديد (تصحيح نتيجة منشورة أو منتهية)،
+# و published → published إعادة نشر لا تغير أوقات المراحل
+ORDER_TRANSITIONS = {
+    "ordered": ("collected", "resulted"),
+    "collected": ("resulted",),
+    "resulted": ("resulted", "approved", "published"),
+    "approved": ("resulted", "approved", "published"),
+    "published": ("resulted", "published", "expired"),
+    "expired": ("resulted",),
+}
+
+def order_transition(*statuses: str, now: datetime = None):
+    """أمر UPDATE ينقل الطلبات إلى آخر حالة في statuses مروراً بما قبلها (الاعتماد والنشر معاً: "approved", "published")
+
+    يُكمل بـ .where() لتحديد الطلبات و .values() لأعمدة أخرى (result_file). الطلبات التي لا يسمح
+    ORDER_TRANSITIONS بانتقالها لا يشملها الأمر. وقت المرحلة لا يتغير إذا كان الطلب وصلها ولم يرجع عنها
+    (إعادة النشر)، والرجوع لمرحلة سابقة يمسح أوقات ما بعدها. الأعمدة القديمة تُحدث في نفس الأمر:
+    published للمنشور، admin_approved لما بعد الاعتماد، is_locked للمنشور والمنتهي.
+    """
+    target = statuses[-1]
+    rank = ORDER_STATUSES.index(target)
+    now = now or datetime.now()
+    values = {
+        "status": target,
+        "published": target == "published",
+        "admin_approved": target in ("approved", "published", "expired"),
+        "is_locked": target in ("published", "expired"),
+    }
+    for i, name in enumerate(ORDER_STATUSES[1:], 1):
+        column = getattr(TestOrder, f"{name}_at")
+        if name in statuses:
+            values[column.key] = case((TestOrder.status.in_(ORDER_STATUSES[i:rank + 1]), column), else_=now)
+        elif i > rank:
+            values[column.key] = None
+    sources = [name for name, targets in ORDER_TRANSITIONS.items() if target in targets]
+    return update(TestOrder).where(TestOrder.status.in_(sources)).values(**values)
+
+WORKLIST_PAGE_SIZE = 200
+# مراحل زمن الإنجاز (TAT): من عمود وقت إلى عمود وقت
+TAT_STAGES = {
+    "collection": ("created_at", "collected_at"),
+    "analysis": ("collected_at", "resulted_at"),
+    "verification": ("resulted_at", "approved_at"),
+    "total": ("created_at", "published_at"),
+}
+
+def status_entered_at(order: TestOrder) -> datetime:
+    """وقت دخول الطلب حالته الحالية (الطلبات القديمة قبل إضافة الأوقات: وقت التسجيل)"""
+    if order.status == "ordered":
+        return order.created_at
+    return getattr(order, f"{order.status}_at") or order.created_at
+
+async def worklist_orders(db: AsyncSession, status: str, after: datetime = None, after_id: int = 0,
+                          limit: int = WORKLIST_PAGE_SIZE) -> List[TestOrder]:
+    """الأقدم أولاً من الفهرس الجزئي ix_orders_worklist_<status>، والصفحة التالية تبدأ بعد (after, after_id)"""
+    query = select(TestOrder).where(TestOrder.status == status)
+    if after:
+        # تحاليل الزيارة لها نفس وقت التسجيل: id يكمل الترتيب
+        query = query.where(or_(TestOrder.created_at > after, and_(TestOrder.created_at == after, TestOrder.id > after_id)))
+    return (await db.execute(query.order_by(TestOrder.created_at, TestOrder.id).limit(limit))).scalars().all()
+
+def turnaround_times(db: Session, start: datetime, end: datetime, test_name: str = None) -> dict:
+    """زمن الإنجاز بالدقائق لكل مرحلة في TAT_STAGES للطلبات المسجلة في الفترة
+
+    الطلب يدخل في المرحلة إذا وصل نهايتها (النتيجة من الجهاز مباشرة بدون تسجيل الاستلام لا تدخل في collection).
+    """
+    import statistics
+
+    columns = [((func.julianday(getattr(TestOrder, end_column)) - func.julianday(getattr(TestOrder, start_column))) * 1440)
+               for start_column, end_column in TAT_STAGES.values()]
+    query = select(*columns).where(TestOrder.created_at >= start, TestOrder.created_at <= end)
+    if test_name:
+        query = query.where(TestOrder.test_name == test_name)
+    rows = db.execute(query).all()
+    metrics = {}
+    for i, stage in enumerate(TAT_STAGES):
+        minutes = [row[i] for row in rows if row[i] is not None]
+        if not minutes:
+            metrics[stage] = {"count": 0}
+            continue
+        if len(minutes) > 1:
+            cuts = statistics.quantiles(minutes, n=10, method="inclusive")
+            median, p90 = cuts[4], cuts[8]
+        else:
+            median = p90 = minutes[0]
+        metrics[stage] = {"count": len(minutes), "mean": round(statistics.fmean(minutes), 1),
+                          "median": round(median, 1), "p90": round(p90, 1), "max": round(max(minutes), 1)}
+    return metrics
+
+def extract_pin(filename: str) -> Optional[str]:
+    """استخراج رقم PIN من اسم ملف النتيجة (مثال: 451234_cbc.pdf)"""
+    match = PIN_PATTERN.search(os.path.basename(filename or ""))
+    return match.group(1) if match else None
+
+def save_result_stream(source, file_path: str, max_size: int = MAX_FILE_SIZE) -> int:
+    """نسخ الملف على دفعات إلى القرص دون تحميله كاملاً في الذاكرة، ويرجع الحجم"""
+    written = 0
+    try:
+        with open(file_path, "wb") as buffer:
+            while True:
+                chunk = source.read(64 * 1024)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_size:
+                    raise ValueError("file too large")
+                buffer.write(chunk)
+    except Exception:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    return written
+
+def publish_results_batch(publish_link: str, items: list):
+    """إرسال مجموعة نتائج أونلاين في مهمة خلفية واحدة على اتصال واحد (requests.Session)
+
+    كل عنصر هو dict فيه file_path وبيانات الطلب (pin, patient, test, phone, price, currency).
+    بدون PUBLISH_BATCH_SIZE يُرسل كل ملف في طلب منفصل بنفس صيغة publish_result_online (file + بيانات الطلب)
+    """
+    import requests
+
+    sent = 0
+    size = PUBLISH_BATCH_SIZE or 1
+    with requests.Session() as session:
+        for start in range(0, len(items), size):
+            batch = items[start:start + size]
+            handles = []
+            try:
+                if PUBLISH_BATCH_SIZE:
+                    files = []
+                    for item in batch:
+                        f = open(item["file_path"], "rb")
+                        handles.append(f)
+                        files.append(("files", (os.path.basename(item["file_path"]), f)))
+                    data = {"results": json.dumps([{k: v for k, v in item.items() if k != "file_path"}
+                                                   for item in batch], ensure_ascii=False)}
+                else:
+                    item = batch[0]
+                    f = open(item["file_path"], "rb")
+                    handles.append(f)
+                    files = {"file": (os.path.basename(item["file_path"]), f)}
+                    data = {k: v for k, v in item.items() if k != "file_path"}
+                response = session.post(publish_link, data=data, files=files, timeout=60 if PUBLISH_BATCH_SIZE else 30)
+                if response.status_code == 200:
+                    sent += len(batch)
+                else:
+                    logger.warning(f"Online upload failed with status {response.status_code}")
+            except Exception as e:
+                logger.error(f"Error sending results online: {e}")
+            finally:
+                for f in handles:
+                    f.close()
+    logger.info(f"Published {sent}/{len(items)} results online")
+    return sent
+
+def process_file_deletions(batch_size: int = 500):
+    """حذف ملفات النتائج الموجودة في طابور الحذف من القرص (يعمل في الخلفية)"""
+    db = SessionLocal()
+    try:
+        while True:
+            batch = db.query(FileDeletion).order_by(FileDeletion.id).limit(batch_size).all()
+            if not batch:
+                break
+            # ملف نتيجة الزيارة مشترك بين تحاليلها: لا يُحذف ما دام أحدها يستخدمه
+            in_use = {path for (path,) in db.query(TestOrder.result_file).filter(
+                TestOrder.result_file.in_({item.path for item in batch})
+            )}
+            for item in batch:
+                if item.path not in in_use and os.path.exists(item.path):
+                    try:
+                        os.remove(item.path)
+                    except OSError as e:
+                        logger.warning(f"Could not delete result file {item.path}: {e}")
+            db.execute(delete(FileDeletion).where(FileDeletion.id.in_([item.id for item in batch])))
+            db.commit()
+            logger.info(f"Deleted {len(batch)} queued result files")
+    except Exception as e:
+        logger.error(f"File deletion queue error: {e}")
+        db.rollback()
+    finally:
+        db.close()
 
 def cleanup_old_results():
     """حذف النتائج الأقدم من RESULT_RETENTION_DAYS يوم"""
     db = SessionLocal()
     try:
-        cutoff_date = datetime.now() - timedelta(days=RESULT_RETENTION_DAYS)
-        old_orders = db.query(TestOrder).filter(
-            TestOrder.published == True,
-            TestOrder.created_at < cutoff_date
-        ).all()
+        # مدة الاحتفاظ من كتالوج التحاليل إن وُجدت، وإلا RESULT_RETENTION_DAYS
+        retention = {}
+        for catalog_id, days in db.query(TestCatalog.id, TestCatalog.retention_days).filter(
+            TestCatalog.retention_days.isnot(None), TestCatalog.retention_days != RESULT_RETENTION_DAYS
+        ):
+            retention.setdefault(days, []).append(catalog_id)
+        custom_ids = [i for ids in retention.values() for i in ids]
+        groups = [(RESULT_RETENTION_DAYS, or_(TestOrder.catalog_id.is_(None), TestOrder.catalog_id.notin_(custom_ids)))]
+        groups += [(days, TestOrder.catalog_id.in_(ids)) for days, ids in retention.items()]
         
         deleted_count = 0
-        for order in old_orders:
-            if order.result_file and os.path.exists(order.result_file):
-                try:
-                    os.remove(order.result_file)
-                except:
-                    pass
-            order.result_file = None
-            order.published = False
-            deleted_count += 1
+        for days, criteria in groups:
+            # الملفات نفسها تدخل طابور الحذف عن طريق trigger عند تفريغ result_file (المنشورة فقط تنتهي)
+            deleted_count += db.execute(
+                order_transition("expired")
+                .where(TestOrder.created_at < datetime.now() - timedelta(days=days), criteria)
+                .values(result_file=None)
+                .execution_options(synchronize_session=False)
+            ).rowcount
         
         db.commit()
         logger.info(f"تم حذف {deleted_count} نتيجة قديمة")
     except Exception as e:
-        logger.error(f"خطأ في الحذف: {e}")
+        logger.error(f"خطأ في الحذف: {e}")
+        db.rollback()
+    finally:
+        db.close()
+    process_file_deletions()
+
+# --- الاستيراد المجمع من CSV (ترحيل البيانات من نظام قديم) ---
+def generate_import_pin(phone: str = None) -> str:
+    """PIN للطلبات المستوردة: 8 أرقام لأن مساحة الـ 6 أرقام لا تكفي ملايين الطلبات القديمة"""
+    return generate_secure_pin(phone) + f"{random.randint(10, 99)}"
+
+def _sqlite_dt(value: datetime) -> str:
+    # نفس الصيغة التي يخزن بها SQLAlchemy التواريخ في SQLite حتى تعمل المقارنات في الاستعلامات
+    return value.isoformat(sep=" ", timespec="microseconds")
+
+@lru_cache(maxsize=65536)
+def _parse_import_date(value: str) -> str:
+    """تحويل تاريخ الـ CSV إلى صيغة التخزين (مع cache لأن التواريخ تتكرر كثيراً في الملفات القديمة)"""
+    value = value.strip()
+    try:
+        return _sqlite_dt(datetime.fromisoformat(value))
+    except ValueError:
+        pass
+    for fmt in ("%d/%m/%Y %H:%M", "%d/%m/%Y"):
+        try:
+            return _sqlite_dt(datetime.strptime(value, fmt))
+        except ValueError:
+            continue
+    raise ValueError(f"تاريخ غير صالح: {value}")
+
+def file_checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _parse_import_price(value: str) -> int:
+    try:
+        return int(float(value or 0))
+    except (ValueError, OverflowError):
+        raise ValueError(f"سعر غير صالح: {value}")
+
+def import_csv_file(path: str, batch_size: int = IMPORT_BATCH_SIZE, progress=None) -> dict:
+    """استيراد المرضى والطلبات من ملف CSV على دفعات كبيرة
+
+    الأعمدة: name, phone, age, gender, address, test_name, price, currency, created_at, pin, status
+    (الصف الذي لا يحتوي على test_name يضيف المريض فقط؛ status اختياري وافتراضياً IMPORT_ORDER_STATUS)
+
+    - الملف يُقرأ كـ stream ولا يُحمّل في الذاكرة
+    - كل دفعة تُكتب بـ executemany داخل transaction واحدة مع حفظ موضع التقدم
+    - عند إعادة تشغيل نفس الملف بعد فشل يكمل من آخر دفعة تم حفظها
+    - الصف غير الصالح (بدون اسم، سعر أو تاريخ خاطئ) لا يوقف الاستيراد: يُتخطى ويُكتب في تقرير المهمة
+      مع سبب الرفض، وكذلك كل PIN قديم مكرر أو مستخدم تم استبداله (row, pin, new_pin, error)
+    """
+    import csv
+
+    checksum = file_checksum(path)
+    db = SessionLocal()
+    try:
+        job = db.query(ImportJob).filter(
+            ImportJob.checksum == checksum, ImportJob.status != "done"
+        ).order_by(ImportJob.id.desc()).first()
+        if not job:
+            job = ImportJob(source=os.path.basename(path), checksum=checksum)
+            db.add(job)
+        job.status = "running"
+        job.error = None
+        db.commit()
+        db.refresh(job)
+        if not job.report_file:
+            os.makedirs(IMPORT_DIR, exist_ok=True)
+            job.report_file = os.path.join(IMPORT_DIR, f"import_{job.id}_report.csv")
+            db.commit()
+        job_id, skip, report_file = job.id, job.rows_done or 0, job.report_file
+    finally:
+        db.close()
+
+    conn = engine.raw_connection()
+    cursor = conn.cursor()
+    try:
+        # خريطة المرضى الموجودين (الاسم + الهاتف بعد التوحيد) لمنع التكرار؛ بدون هاتف كل صف مريض جديد
+        known = {}
+        for pid, name_key, phone_key in cursor.execute("SELECT id, name_key, phone_key FROM patients WHERE phone_key != ''"):
+            known[(name_key, phone_key)] = pid
+        next_patient_id = (cursor.execute("SELECT MAX(id) FROM patients").fetchone()[0] or 0) + 1
+
+        stats = {"job_id": job_id, "rows_done": skip, "patients_created": 0, "orders_created": 0,
+                 "rows_skipped": 0, "remapped_pins": [], "report_file": report_file}
+        started = time.perf_counter()
+
+        def write_report(lines):
+            new_file = not os.path.exists(report_file)
+            with open(report_file, "a", newline="", encoding="utf-8-sig" if new_file else "utf-8") as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(["row", "pin", "new_pin", "error"])
+                writer.writerows(lines)
+
+        def flush(rows):
+            nonlocal next_patient_id
+            # حجز قفل الكتابة من البداية حتى لا يتعارض توزيع أرقام المرضى مع الإضافة من الواجهة
+            cursor.execute("BEGIN IMMEDIATE")
+            next_patient_id = max(next_patient_id, (cursor.execute("SELECT MAX(id) FROM patients").fetchone()[0] or 0) + 1)
+            new_patients, orders, visits, skipped = [], [], {}, []
+            now = _sqlite_dt(datetime.now())
+            for number, row in rows:
+                name = (row.get("name") or "").strip()
+                test_name = (row.get("test_name") or "").strip()
+                try:
+                    if not name:
+                        raise ValueError("الاسم مطلوب")
+                    raw_date = (row.get("created_at") or "").strip()
+                    created_at = _parse_import_date(raw_date) if raw_date else now
+                    price = _parse_import_price(row.get("price")) if test_name else 0
+                    status = (row.get("status") or "").strip().lower() or IMPORT_ORDER_STATUS
+                    if status not in ORDER_STATUSES:
+                        raise ValueError(f"حالة غير معروفة: {status}")
+                except ValueError as e:
+                    skipped.append([number, (row.get("pin") or "").strip(), "", str(e)])
+                    continue
+                phone = (row.get("phone") or "").strip()
+                key = (normalize_name(name), normalize_phone(phone))
+                patient_id = known.get(key)
+                if patient_id is None:
+                    patient_id = next_patient_id
+                    next_patient_id += 1
+                    if key[1]:
+                        known[key] = patient_id
+                    age = (row.get("age") or "").strip()
+                    new_patients.append((
+                        patient_id, name, phone or None, int(age) if age.isdigit() else None,
+                        row.get("gender") or None, row.get("address") or None, created_at, key[0], key[1]
+                    ))
+                if visits.get(patient_id) is None or visits[patient_id] < created_at:
+                    visits[patient_id] = created_at
+
+                if test_name:
+                    pin = (row.get("pin") or "").strip()
+                    orders.append([
+                        patient_id, name, test_name, price, row.get("currency") or "ج.م", pin,
+                        created_at, phone, number, pin, status
+                    ])
+
+            # توزيع أرقام PIN دفعة واحدة والتحقق من التكرار باستعلامات IN بدلاً من استعلام لكل طلب
+            taken = set()
+            for order in orders:
+                while not order[5] or order[5] in taken:
+                    order[5] = generate_import_pin(order[7])
+                taken.add(order[5])
+            while True:
+                clashes = set()
+                pins = [o[5] for o in orders]
+                for start in range(0, len(pins), 900):
+                    chunk = pins[start:start + 900]
+                    placeholders = ",".join("?" * len(chunk))
+                    # PIN زيارة متعددة التحاليل ليس PIN أي طلب، لكن رفع النتائج يطابقه بنفس المفتاح
+                    clashes.update(r[0] for r in cursor.execute(
+                        f"SELECT pin FROM orders WHERE pin IN ({placeholders}) "
+                        f"UNION ALL SELECT pin FROM orders_archive WHERE pin IN ({placeholders}) "
+                        f"UNION ALL SELECT pin FROM visits WHERE pin IN ({placeholders})", chunk * 3
+                    ))
+                if not clashes:
+                    break
+                for order in orders:
+                    if order[5] in clashes:
+                        order[5] = generate_import_pin(order[7])
+                        while order[5] in taken:
+                            order[5] = generate_import_pin(order[7])
+                        taken.add(order[5])
+
+            cursor.executemany(
+                "INSERT INTO patients (id, name, phone, age, gender, address, last_visit, name_key, phone_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                new_patients
+            )
+            cursor.executemany(
+                "INSERT INTO orders (patient_id, patient_name, test_name, price, currency, pin, created_at, status, "
+                "published, admin_approved, is_locked) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                # الأعمدة القديمة بنفس قواعد order_transition
+                [(*o[:7], o[10], o[10] == "published", o[10] in ("approved", "published", "expired"),
+                  o[10] in ("published", "expired")) for o in orders]
+            )
+            cursor.executemany(
+                "UPDATE patients SET last_visit = MAX(COALESCE(last_visit, ?), ?) WHERE id = ?",
+                [(v, v, pid) for pid, v in visits.items()]
+            )
+            remapped = [[o[8], o[9], o[5], ""] for o in orders if o[9] and o[9] != o[5]]
+            stats["rows_done"] += len(rows)
+            stats["patients_created"] += len(new_patients)
+            stats["orders_created"] += len(orders)
+            stats["rows_skipped"] += len(skipped)
+            stats["remapped_pins"] += [{"row": r[0], "pin": r[1], "new_pin": r[2]} for r in remapped]
+            cursor.execute(
+                "UPDATE import_jobs SET rows_done = ?, patients_created = patients_created + ?, "
+                "orders_created = orders_created + ?, rows_skipped = rows_skipped + ?, "
+                "pins_remapped = pins_remapped + ?, updated_at = ? WHERE id = ?",
+                (stats["rows_done"], len(new_patients), len(orders), len(skipped), len(remapped),
+                 _sqlite_dt(datetime.now()), job_id)
+            )
+            conn.commit()
+            if skipped or remapped:
+                write_report(sorted(skipped + remapped))
+
+            elapsed = time.perf_counter() - started
+            stats["rows_per_second"] = int((stats["rows_done"] - skip) / elapsed) if elapsed else 0
+            logger.info(f"Import job {job_id}: {stats['rows_done']} rows ({stats['rows_per_second']} rows/s)")
+            if progress:
+                progress(dict(stats))
+
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            for _ in range(skip):
+                if next(reader, None) is None:
+                    break
+            batch = []
+            # رقم الصف في التقرير: رقم صف البيانات في الملف (بعد سطر العناوين) بدءاً من 1
+            for number, row in enumerate(reader, skip + 1):
+                batch.append((number, row))
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    batch = []
+            if batch:
+                flush(batch)
+
+        cursor.execute("UPDATE import_jobs SET status = 'done', updated_at = ? WHERE id = ?",
+                       (_sqlite_dt(datetime.now()), job_id))
+        conn.commit()
+        stats["status"] = "done"
+        return stats
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Import job {job_id} failed: {e}")
+        cursor.execute("UPDATE import_jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                       (str(e), _sqlite_dt(datetime.now()), job_id))
+        conn.commit()
+        raise
+    finally:
+        conn.close()
+
+# --- سجل التدقيق (Audit Trail) ---
+AUDIT_FLUSH_SECONDS = 1.0     # أقصى مدة يبقى فيها الحدث في الذاكرة قبل كتابته
+AUDIT_BATCH_SIZE = 500        # امتلاء الدفعة يكتبها فوراً دون انتظار
+AUDIT_PAGE_SIZE = 100
+AUDIT_ENTITIES = ("order", "visit", "patient", "user", "settings", "test_catalog", "orders", "database")
+
+def audit_hash(prev: str, at: str, username, action: str, entity: str, entity_id, payload) -> str:
+    """بصمة السطر: تشمل بصمة السطر السابق، فتعديل أو حذف أي سطر يكسر كل ما بعده"""
+    fields = (prev, at, username or "", action, entity, entity_id or "", payload or "")
+    return hashlib.sha256("\x1f".join(fields).encode()).hexdigest()
+
+class AuditWriter:
+    """يجمع أحداث التدقيق في الذاكرة ويكتبها على دفعات (group commit) من thread منفصل
+
+    record() لا تلمس قاعدة البيانات فلا تضيف شيئاً يذكر لزمن الطلب. الدفعة تُكتب بـ executemany
+    داخل BEGIN IMMEDIATE وتُحسب البصمات من آخر سطر مكتوب، فتبقى السلسلة صحيحة مع أكثر من worker.
+    قبل start() (السكربتات والاختبارات) تُكتب الأحداث مباشرة.
+    """
+
+    def __init__(self, flush_seconds: float = AUDIT_FLUSH_SECONDS, batch_size: int = AUDIT_BATCH_SIZE):
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.pending = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def record(self, user, action: str, entity: str, entity_id=None, **payload):
+        """user: بيانات المستخدم من الجلسة (أو اسمه)، payload: أي بيانات إضافية قابلة للتحويل إلى JSON"""
+        username = user.get("username") if isinstance(user, dict) else user
+        entry = (
+            _sqlite_dt(datetime.now()), username, action, entity,
+            None if entity_id is None else str(entity_id),
+            json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str) if payload else None
+        )
+        with self.lock:
+            self.pending.append(entry)
+            full = len(self.pending) >= self.batch_size
+        if self.thread is None:
+            self.flush()
+        elif full:
+            self.wake.set()
+
+    def flush(self) -> int:
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            conn = engine.raw_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                row = cursor.execute("SELECT hash FROM audit_log ORDER BY id DESC LIMIT 1").fetchone()
+                prev = row[0] if row else ""
+                rows = []
+                for entry in batch:
+                    prev = audit_hash(prev, *entry)
+                    rows.append(entry + (prev,))
+                cursor.executemany(
+                    "INSERT INTO audit_log (at, username, action, entity, entity_id, payload, hash) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                conn.commit()
+                return len(rows)
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Audit flush error ({len(batch)} events kept for retry): {e}")
+                with self.lock:
+                    self.pending[:0] = batch
+                return 0
+            finally:
+                conn.close()
+
+    def run(self):
+        while self.thread is not None:
+            self.wake.wait(self.flush_seconds)
+            self.wake.clear()
+            self.flush()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="audit-writer", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        thread, self.thread = self.thread, None
+        if thread is not None:
+            self.wake.set()
+            thread.join(timeout=5)
+        self.flush()
+
+audit = AuditWriter()
+
+def audit_changes(obj, **values) -> dict:
+    """تعيين القيم الجديدة على الكائن وإرجاع ما تغير فقط {الحقل: [القديم، الجديد]} لسجل التدقيق"""
+    changes = {}
+    for field, value in values.items():
+        old = getattr(obj, field)
+        if old != value:
+            changes[field] = [old, value]
+            setattr(obj, field, value)
+    return changes
+
+def verify_audit_chain() -> dict:
+    """إعادة حساب سلسلة البصمات من أول سطر: يرجع أول سطر لا تطابق بصمته (تم تعديله أو حذف ما قبله)"""
+    prev, checked = "", 0
+    with engine.connect() as conn:
+        for row in conn.execute(text(
+            "SELECT id, at, username, action, entity, entity_id, payload, hash FROM audit_log ORDER BY id"
+        )):
+            expected = audit_hash(prev, *row[1:7])
+            if expected != row.hash:
+                return {"ok": False, "checked": checked, "broken_id": row.id}
+            prev = row.hash
+            checked += 1
+    # آخر بصمة تكفي لإثبات السجل كله حتى هذه اللحظة (يمكن حفظها خارج النظام)
+    return {"ok": True, "checked": checked, "last_hash": prev}
+
+# --- إشعارات المرضى (SMS / WhatsApp) ---
+NOTIFY_PROVIDER = os.getenv("NOTIFY_PROVIDER", "")           # sms / whatsapp (fake للتجربة فقط)، فارغ = بدون إشعارات
+NOTIFY_PORTAL_URL = os.getenv("NOTIFY_PORTAL_URL", "")        # رابط صفحة النتائج في نص الرسالة
+NOTIFY_COUNTRY_CODE = os.getenv("NOTIFY_COUNTRY_CODE", "20")
+NOTIFY_POLL_SECONDS = 2.0      # فحص الطابور عند عدم وجود إضافات جديدة (إعادة المحاولة المؤجلة)
+NOTIFY_MAX_ATTEMPTS = 6
+NOTIFY_BACKOFF_SECONDS = 30    # 30 ثانية ثم تتضاعف: 1، 2، 4 ... دقائق
+NOTIFY_BACKOFF_MAX = 3600
+NOTIFY_LEASE_SECONDS = 300     # دفعة محجوزة لم يكتمل إرسالها (توقف الخادم) تعود للطابور بعدها
+
+def international_phone(phone: str) -> Optional[str]:
+    """رقم الهاتف بالصيغة الدولية بدون + (كما تطلبه بوابات SMS و WhatsApp)"""
+    digits = normalize_phone(phone)
+    if len(digits) < 8:
+        return None
+    return NOTIFY_COUNTRY_CODE + digits[1:] if digits.startswith("0") else digits
+
+class NotificationProvider(ABC):
+    """مزود إرسال: مزود جديد يكفي أن يطبق send_batch ويُضاف بـ register_provider"""
+
+    name = "base"
+    batch_size = 50          # عدد الرسائل في كل استدعاء send_batch
+    rate_per_second = 10.0   # أقصى معدل إرسال يسمح به المزود
+
+    @abstractmethod
+    def send_batch(self, items: List[dict]) -> dict:
+        """يعمل في thread منفصل. items: [{id, recipient, message}]، يرجع {id: None عند النجاح أو نص الخطأ}"""
+
+class FakeProvider(NotificationProvider):
+    """مزود محلي للتجربة: لا يرسل شيئاً، يحفظ آخر الرسائل في الذاكرة ويفشل بنسبة fail_rate"""
+
+    name = "fake"
+    batch_size = 100
+
+    def __init__(self):
+        self.rate_per_second = float(os.getenv("NOTIFY_FAKE_RATE", "200"))
+        self.fail_rate = float(os.getenv("NOTIFY_FAKE_FAIL_RATE", "0"))
+        self.latency = float(os.getenv("NOTIFY_FAKE_LATENCY", "0.05"))
+        self.sent = deque(maxlen=1000)
+
+    def send_batch(self, items: List[dict]) -> dict:
+        time.sleep(self.latency)
+        results = {}
+        for item in items:
+            if random.random() < self.fail_rate:
+                results[item["id"]] = "fake failure"
+            else:
+                self.sent.append(item)
+                results[item["id"]] = None
+        return results
+
+class SmsGatewayProvider(NotificationProvider):
+    """بوابة SMS عبر HTTP تقبل عدة رسائل في الطلب الواحد (NOTIFY_SMS_URL و NOTIFY_SMS_TOKEN)"""
+
+    name = "sms"
+    batch_size = 100
+
+    def __init__(self):
+        self.url = os.getenv("NOTIFY_SMS_URL", "")
+        self.token = os.getenv("NOTIFY_SMS_TOKEN", "")
+        self.sender = os.getenv("NOTIFY_SMS_SENDER", "LAB")
+        self.rate_per_second = float(os.getenv("NOTIFY_SMS_RATE", "20"))
+
+    def send_batch(self, items: List[dict]) -> dict:
+        import requests
+
+        response = requests.post(self.url, json={
+            "sender": self.sender,
+            "messages": [{"to": item["recipient"], "text": item["message"], "ref": str(item["id"])} for item in items]
+        }, headers={"Authorization": f"Bearer {self.token}"}, timeout=30)
+        error = None if response.status_code == 200 else f"HTTP {response.status_code}: {response.text[:200]}"
+        return {item["id"]: error for item in items}
+
+class WhatsAppProvider(NotificationProvider):
+    """WhatsApp Cloud API (رسالة لكل طلب HTTP، على اتصال واحد لكل دفعة)"""
+
+    name = "whatsapp"
+    batch_size = 20
+
+    def __init__(self):
+        self.url = f"https://graph.facebook.com/v18.0/{os.getenv('NOTIFY_WHATSAPP_PHONE_ID', '')}/messages"
+        self.token = os.getenv("NOTIFY_WHATSAPP_TOKEN", "")
+        self.rate_per_second = float(os.getenv("NOTIFY_WHATSAPP_RATE", "10"))
+
+    def send_batch(self, items: List[dict]) -> dict:
+        import requests
+
+        results = {}
+        with requests.Session() as session:
+            session.headers["Authorization"] = f"Bearer {self.token}"
+            for item in items:
+                try:
+                    response = session.post(self.url, json={
+                        "messaging_product": "whatsapp", "to": item["recipient"],
+                        "type": "text", "text": {"body": item["message"]}
+                    }, timeout=15)
+                    results[item["id"]] = None if response.status_code == 200 else \
+                        f"HTTP {response.status_code}: {response.text[:200]}"
+                except Exception as e:
+                    results[item["id"]] = str(e) or type(e).__name__
+        return results
+
+NOTIFY_PROVIDERS = {}
+
+def register_provider(provider: NotificationProvider):
+    NOTIFY_PROVIDERS[provider.name] = provider
+
+for _provider in (FakeProvider(), SmsGatewayProvider(), WhatsAppProvider()):
+    register_provider(_provider)
+
+class RateLimiter:
+    """حد المعدل لكل مزود (token bucket): acquire(n) تنتظر حتى يُسمح بإرسال n رسالة"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self, n: int = 1):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # دفعة أكبر من سعة الـ bucket تمر عندما يمتلئ ويصبح الرصيد سالباً لما بعدها
+            if self.tokens >= min(n, self.capacity):
+                self.tokens -= n
+                return
+            await asyncio.sleep((min(n, self.capacity) - self.tokens) / self.rate)
+
+def queue_result_notifications(db: Session, order_ids: List[int]) -> int:
+    """إضافة إشعار "النتيجة جاهزة" في نفس transaction الاعتماد (بدون commit) بأمر INSERT واحد
+
+    رسالة واحدة لكل زيارة بـ PIN الزيارة: تُضاف عند نشر آخر تحاليلها (في نفس الطلب أو في طلب سابق)،
+    فاعتماد تحاليل الزيارة واحداً تلو الآخر لا يرسل رسالة لكل تحليل.
+    """
+    if not NOTIFY_PROVIDER or not order_ids:
+        return 0
+    selected = set(order_ids)
+    columns = (TestOrder.id, TestOrder.pin, TestOrder.visit_id, TestOrder.test_name, TestOrder.patient_id,
+               TestOrder.status, Patient.phone, Visit.pin.label("visit_pin"))
+    rows = []
+    for start in range(0, len(order_ids), 900):
+        rows += db.query(*columns).join(Patient, TestOrder.patient_id == Patient.id).outerjoin(
+            Visit, TestOrder.visit_id == Visit.id
+        ).filter(TestOrder.id.in_(order_ids[start:start + 900])).all()
+    visit_ids = list({row.visit_id for row in rows if row.visit_id})
+    for start in range(0, len(visit_ids), 900):
+        rows += [row for row in db.query(*columns).join(Patient, TestOrder.patient_id == Patient.id).join(
+            Visit, TestOrder.visit_id == Visit.id
+        ).filter(TestOrder.visit_id.in_(visit_ids[start:start + 900])).all() if row.id not in selected]
+    groups = {}
+    for row in sorted(rows, key=lambda r: r.id):
+        groups.setdefault(("visit", row.visit_id) if row.visit_id else ("order", row.id), []).append(row)
+    # زيارة فيها تحليل لم تظهر نتيجته بعد: الرسالة مع اعتماد آخر تحليل
+    groups = {key: lines for key, lines in groups.items()
+              if all(line.id in selected or line.status in ("published", "expired") for line in lines)}
+
+    settings = get_or_create_settings(db)
+    template = translations_for(settings.default_language)["notify_result_ready"]
+    records = []
+    for lines in groups.values():
+        recipient = international_phone(lines[0].phone)
+        if not recipient:
+            continue
+        records.append({
+            "provider": NOTIFY_PROVIDER,
+            "recipient": recipient,
+            "message": template.format(
+                lab=settings.lab_name, tests=", ".join(line.test_name for line in lines),
+                pin=lines[0].visit_pin if len(lines) > 1 else lines[0].pin, url=NOTIFY_PORTAL_URL
+            ).strip(),
+            "order_id": lines[0].id,
+            "patient_id": lines[0].patient_id
+        })
+    if records:
+        db.execute(insert(Notification), records)
+    return len(records)
+
+class NotificationWorker:
+    """يرسل إشعارات الـ outbox داخل الـ event loop دون أن يشغل threads الطلبات
+
+    - مهمة asyncio لكل مزود: مزود بطيء أو متوقف لا يؤخر الآخرين
+    - كل دفعة تُحجز بأمر UPDATE ... RETURNING واحد (تأجيل next_attempt_at لمدة NOTIFY_LEASE_SECONDS)
+      فلا يرسل أكثر من worker نفس الرسالة، والدفعة التي توقف إرسالها تعود تلقائياً
+    - حد معدل لكل مزود، وإعادة المحاولة بمهلة تتضاعف حتى NOTIFY_MAX_ATTEMPTS
+    - استعلامات القاعدة عبر aiosqlite والإرسال (requests) في thread منفصل
+    """
+
+    def __init__(self, providers: dict = NOTIFY_PROVIDERS):
+        self.providers = providers
+        self.loop = None
+        self.events = {}
+        self.tasks = []
+
+    async def start(self):
+        """مهمة للمزود المختار فقط، ولمزود سابق ما زالت له رسائل معلقة (بدون مزود = الإشعارات متوقفة)"""
+        if not NOTIFY_PROVIDER:
+            return
+        async with AsyncSessionLocal() as db:
+            names = {NOTIFY_PROVIDER} | set((await db.execute(
+                select(Notification.provider).where(Notification.status == "pending").distinct()
+            )).scalars().all())
+        self.loop = asyncio.get_running_loop()
+        for name in sorted(names):
+            provider = self.providers.get(name)
+            if provider is None:
+                logger.warning(f"Unknown notification provider: {name}")
+                continue
+            self.events[provider.name] = asyncio.Event()
+            self.tasks.append(asyncio.create_task(self.run(provider)))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.events = {}
+        self.loop = None
+
+    def wake(self):
+        """يُستدعى بعد commit الاعتماد (من أي thread) حتى يبدأ الإرسال فوراً دون انتظار الفحص الدوري"""
+        if self.loop is not None:
+            for event in self.events.values():
+                self.loop.call_soon_threadsafe(event.set)
+
+    async def run(self, provider: NotificationProvider):
+        limiter = RateLimiter(provider.rate_per_second)
+        event = self.events[provider.name]
+        while True:
+            try:
+                claimed = await self.send_due(provider, limiter)
+            except asyncio.CancelledError:
+                raise
+            except OperationalError as e:
+                # القاعدة مشغولة بكتابة طويلة (استيراد أو أرشفة): المحاولة في الدورة التالية
+                logger.warning(f"Notification worker ({provider.name}) skipped a cycle: {e.orig}")
+                claimed = 0
+            except Exception as e:
+                logger.error(f"Notification worker error ({provider.name}): {e}")
+                claimed = 0
+            if claimed < provider.batch_size:
+                try:
+                    await asyncio.wait_for(event.wait(), NOTIFY_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+
+    async def send_due(self, provider: NotificationProvider, limiter: RateLimiter) -> int:
+        now = datetime.now()
+        due = select(Notification.id).where(
+            Notification.status == "pending", Notification.provider == provider.name, Notification.next_attempt_at <= now
+        ).order_by(Notification.next_attempt_at).limit(provider.batch_size)
+        async with AsyncSessionLocal() as db:
+            # قراءة أولاً: الفحص الدوري بدون إشعارات مستحقة لا يفتح transaction كتابة
+            if (await db.execute(due.limit(1))).first() is None:
+                return 0
+            items = [dict(row._mapping) for row in (await db.execute(
+                update(Notification).where(Notification.id.in_(due)).values(
+                    attempts=Notification.attempts + 1, next_attempt_at=now + timedelta(seconds=NOTIFY_LEASE_SECONDS)
+                ).returning(Notification.id, Notification.recipient, Notification.message, Notification.attempts),
+                execution_options={"synchronize_session": False}
+            )).all()]
+            await db.commit()
+        if not items:
+            return 0
+
+        await limiter.acquire(len(items))
+        try:
+            results = await asyncio.to_thread(provider.send_batch, items)
+        except Exception as e:
+            results = {item["id"]: str(e) or type(e).__name__ for item in items}
+
+        now = datetime.now()
+        changes = []
+        for item in items:
+            error = results.get(item["id"], "no result from provider")
+            if error is None:
+                changes.append({"id": item["id"], "status": "sent", "sent_at": now, "last_error": None})
+            elif item["attempts"] >= NOTIFY_MAX_ATTEMPTS:
+                changes.append({"id": item["id"], "status": "failed", "last_error": error})
+            else:
+                delay = min(NOTIFY_BACKOFF_MAX, NOTIFY_BACKOFF_SECONDS * 2 ** (item["attempts"] - 1))
+                changes.append({"id": item["id"], "last_error": error,
+                                "next_attempt_at": now + timedelta(seconds=delay * random.uniform(0.8, 1.2))})
+        async with AsyncSessionLocal() as db:
+            # تحديث بالمفتاح الأساسي لكل مجموعة أعمدة متشابهة (executemany)
+            for keys in {tuple(sorted(change)) for change in changes}:
+                await db.execute(update(Notification), [c for c in changes if tuple(sorted(c)) == keys])
+            await db.commit()
+        failed = sum(1 for c in changes if c.get("status") != "sent")
+        if failed:
+            logger.warning(f"Notifications via {provider.name}: {len(items) - failed} sent, {failed} failed")
+        return len(items)
+
+notifier = NotificationWorker()
+
+# --- قيم النتائج (منحنيات المريض وإحصاء التحاليل) ---
+RESULT_NUMBER = re.compile(r"[-+]?\d+(?:[.,]\d+)?")
+REFERENCE_RANGE = re.compile(r"^\s*([-+]?\d+(?:[.,]\d+)?)\s*(?:-|–|to)\s*([-+]?\d+(?:[.,]\d+)?)\s*$")
+NORMAL_FLAGS = {"", "N"}
+RESULT_VALUE_FIELDS = ("value", "value_num", "units", "reference_range", "ref_low", "ref_high", "flag", "abnormal", "instrument")
+TREND_MAX_POINTS = 500      # أقصى عدد قيم لكل تحليل في منحنى المريض (الأحدث)
+ABNORMAL_PAGE_SIZE = 200
+
+def parse_result_number(value: Optional[str]) -> Optional[float]:
+    """الجزء الرقمي من النتيجة: "5.4" → 5.4 و "<0.5" → 0.5 و "Positive" → None"""
+    match = RESULT_NUMBER.search(value or "")
+    return float(match.group().replace(",", ".")) if match else None
+
+def parse_reference_range(text: Optional[str]) -> Tuple[Optional[float], Optional[float]]:
+    """المدى المرجعي: "70-110" و "0.4 - 4.0" و "<5" و ">40" → (الحد الأدنى، الحد الأعلى)"""
+    text = (text or "").strip()
+    match = REFERENCE_RANGE.match(text)
+    if match:
+        return tuple(float(x.replace(",", ".")) for x in match.groups())
+    if text[:1] in "<≤":
+        return None, parse_result_number(text)
+    if text[:1] in ">≥":
+        return parse_result_number(text), None
+    return None, None
+
+def result_value_row(order_id: int, patient_id: int, analyte: str, value: Optional[str] = None,
+                     units: Optional[str] = None, reference_range: Optional[str] = None, flag: Optional[str] = None,
+                     observed_at: Optional[datetime] = None, instrument: Optional[str] = None,
+                     received_at: Optional[datetime] = None) -> dict:
+    """صف result_values: القيمة الرقمية والمدى والعلامة تُحسب مرة واحدة عند الحفظ وليس عند كل قراءة"""
+    value_num = parse_result_number(value)
+    ref_low, ref_high = parse_reference_range(reference_range)
+    flag = (flag or "").strip().upper()
+    if not flag and value_num is not None:
+        # الجهاز لم يرسل علامة: نحسبها من المدى المرجعي
+        if ref_low is not None and value_num < ref_low:
+            flag = "L"
+        elif ref_high is not None and value_num > ref_high:
+            flag = "H"
+    received_at = received_at or datetime.now()
+    return {
+        "order_id": order_id, "patient_id": patient_id, "analyte": analyte,
+        "observed_at": observed_at or received_at, "received_at": received_at,
+        "value": value, "value_num": value_num, "units": units, "reference_range": reference_range,
+        "ref_low": ref_low, "ref_high": ref_high, "flag": None if flag in NORMAL_FLAGS else flag, "abnormal": flag not in NORMAL_FLAGS,
+        "instrument": instrument
+    }
+
+def patient_trends(db: Session, patient_id: int, analyte: Optional[str] = None, since: Optional[datetime] = None) -> dict:
+    """منحنيات المريض بصيغة أعمدة {analyte: {t: [...], v: [...], flag: [...]}} من قراءة متصلة واحدة للمفتاح الأساسي"""
+    query = select(
+        ResultValue.analyte, ResultValue.observed_at, ResultValue.value, ResultValue.value_num, ResultValue.flag,
+        ResultValue.units, ResultValue.ref_low, ResultValue.ref_high, ResultValue.order_id
+    ).where(ResultValue.patient_id == patient_id)
+    if analyte:
+        query = query.where(ResultValue.analyte == analyte)
+    if since:
+        query = query.where(ResultValue.observed_at >= since)
+    # نفس ترتيب المفتاح الأساسي: بدون خطوة ترتيب منفصلة
+    query = query.order_by(ResultValue.analyte, ResultValue.observed_at, ResultValue.order_id)
+
+    trends = {}
+    for row in db.execute(query):
+        series = trends.get(row.analyte)
+        if series is None:
+            series = trends[row.analyte] = {"units": None, "ref_low": None, "ref_high": None,
+                                            "t": [], "v": [], "value": [], "flag": [], "order_id": []}
+        series["t"].append(row.observed_at.isoformat())
+        series["v"].append(row.value_num)
+        series["value"].append(row.value)
+        series["flag"].append(row.flag)
+        series["order_id"].append(row.order_id)
+        # الوحدة والمدى من آخر قيمة (قد يتغير الجهاز أو الكاشف مع الوقت)
+        series["units"] = row.units or series["units"]
+        series["ref_low"], series["ref_high"] = row.ref_low, row.ref_high
+    for series in trends.values():
+        for key in ("t", "v", "value", "flag", "order_id"):
+            del series[key][:-TREND_MAX_POINTS]
+    return trends
+
+def analyte_statistics(values: List[float], abnormal: List[bool]) -> dict:
+    """إحصاء وصفي لقيم تحليل على كل المرضى بعمليات numpy المتجهة (statistics فقط إذا لم تُثبت المتطلبات كاملة)"""
+    if not values:
+        return {"count": 0}
+    try:
+        import numpy as np  # ثقيل في الاستيراد، لذلك يُحمّل عند أول طلب إحصاء فقط
+    except ImportError:
+        np = None
+    if np is not None:
+        array = np.asarray(values, dtype=np.float64)
+        p2_5, p25, p50, p75, p97_5 = np.percentile(array, [2.5, 25, 50, 75, 97.5]).tolist()
+        stats = {"mean": float(array.mean()), "sd": float(array.std(ddof=1)) if len(array) > 1 else 0.0,
+                 "min": float(array.min()), "max": float(array.max()),
+                 "abnormal_rate": float(np.count_nonzero(abnormal)) / len(abnormal)}
+    else:
+        import statistics
+
+        ordered = sorted(values)
+        if len(ordered) > 1:
+            cuts = statistics.quantiles(ordered, n=40, method="inclusive")
+            p2_5, p25, p50, p75, p97_5 = cuts[0], cuts[9], cuts[19], cuts[29], cuts[38]
+        else:
+            p2_5 = p25 = p50 = p75 = p97_5 = ordered[0]
+        stats = {"mean": statistics.fmean(ordered), "sd": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+                 "min": ordered[0], "max": ordered[-1], "abnormal_rate": sum(abnormal) / len(abnormal)}
+    stats.update(count=len(values), p2_5=p2_5, p25=p25, median=p50, p75=p75, p97_5=p97_5)
+    return stats
+
+# --- تقارير النتائج PDF ---
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+REPORT_CACHE_DAYS = 30        # التقارير غير المرتبطة بأي طلب (معاينات قديمة) تُحذف بعدها
+REPORT_LAYOUT_VERSION = "1"   # يُغير عند تعديل شكل التقرير في report_pdf حتى لا تُستخدم النسخ المحفوظة
+REPORT_LABELS = ("patient_name", "pin", "age", "date", "analyte", "result", "units", "reference_range",
+                 "result_flag", "report_footer")
+
+report_pool = None
+report_pool_lock = threading.Lock()
+reports_in_flight = {}
+
+def get_report_pool():
+    """عمليات الرسم (spawn: لا تنسخ threads الخادم ولا اتصالات القاعدة) تُنشأ عند أول تقرير"""
+    global report_pool
+    with report_pool_lock:
+        if report_pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            import report_pdf
+
+            report_pool = ProcessPoolExecutor(
+                REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"), initializer=report_pdf.warm_up
+            )
+    return report_pool
+
+def stop_report_pool():
+    global report_pool
+    with report_pool_lock:
+        if report_pool is not None:
+            report_pool.shutdown(wait=False, cancel_futures=True)
+            report_pool = None
+
+def report_logo(logo_path: Optional[str]) -> Optional[Tuple[str, float]]:
+    """ملف الشعار من رابطه في الإعدادات (/static/images/logo.png) مع وقت تعديله ليدخل في بصمة التقرير"""
+    path = (logo_path or "").lstrip("/")
+    if not path:
+        return None
+    # الشعار المرفوع في مجلد التشغيل، وإلا الشعار المرفق مع البرنامج
+    for candidate in (path, os.path.join(RESOURCE_DIR, path)):
+        if os.path.isfile(candidate):
+            return os.path.abspath(candidate), os.path.getmtime(candidate)
+    return None
+
+def report_content(settings: SystemSettings, patient: Patient, orders: List[TestOrder], values: list, pin: str) -> dict:
+    """كل ما يظهر في التقرير (ولا شيء غيره): بصمته هي مفتاح النسخة المحفوظة"""
+    lang = settings.default_language if settings.default_language in ("ar", "en") else "ar"
+    t = translations_for(lang)
+    rows = {}
+    for v in values:
+        rows.setdefault(v.order_id, []).append([v.analyte, v.value, v.units, v.reference_range, v.flag])
+    return {
+        "lang": lang,
+        "labels": {key: t.get(key, key) for key in REPORT_LABELS},
+        "lab_name": settings.lab_name,
+        "logo": report_logo(settings.logo_path),
+        "patient": {"name": patient.name, "age": patient.age},
+        "pin": pin,
+        "date": orders[0].created_at.strftime("%Y-%m-%d"),
+        "tests": [{"name": o.test_name, "rows": rows[o.id]} for o in orders if o.id in rows]
+    }
+
+def report_digest(content: dict) -> str:
+    payload = json.dumps([REPORT_LAYOUT_VERSION, content], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+async def render_report_cached(content: dict, renderer: str = "render_report") -> str:
+    """مسار التقرير المحفوظ ببصمة محتواه، ويُرسم في عملية منفصلة فقط إن لم يكن موجوداً
+
+    إعادة الطباعة والتنزيل من البوابة لا ترسم من جديد، وطلبان لنفس التقرير في نفس الوقت يرسمانه مرة واحدة.
+    renderer: دالة الرسم في report_pdf (render_report أو render_labels لملصقات العينات).
+    """
+    import report_pdf
+
+    digest = report_digest(content)
+    path = os.path.join(REPORT_DIR, f"{digest}.pdf")
+    if os.path.exists(path):
+        return path
+    future = reports_in_flight.get(digest)
+    if future is None:
+        render = getattr(report_pdf, renderer)
+        future = asyncio.wrap_future(get_report_pool().submit(render, content, os.path.abspath(path)))
+        reports_in_flight[digest] = future
+        future.add_done_callback(lambda _: reports_in_flight.pop(digest, None))
+    await asyncio.shield(future)
+    return path
+
+async def order_report(db: AsyncSession, order_id: int) -> Optional[Tuple[List[TestOrder], Patient, Optional[dict]]]:
+    """تحاليل التقرير (كل تحاليل الزيارة أو التحليل وحده) والمريض ومحتوى التقرير (None إذا لم تصل قيم بعد)"""
+    order = (await db.execute(
+        select(TestOrder).options(selectinload(TestOrder.patient), selectinload(TestOrder.visit)).where(TestOrder.id == order_id)
+    )).scalar_one_or_none()
+    if not order or not order.patient:
+        return None
+    orders = [order]
+    if order.visit_id:
+        orders = (await db.execute(
+            select(TestOrder).where(TestOrder.visit_id == order.visit_id).order_by(TestOrder.id)
+        )).scalars().all()
+    values = (await db.execute(
+        select(ResultValue.order_id, ResultValue.analyte, ResultValue.value, ResultValue.units,
+               ResultValue.reference_range, ResultValue.flag)
+        .where(ResultValue.order_id.in_([o.id for o in orders]))
+        .order_by(ResultValue.order_id, ResultValue.analyte)
+    )).all()
+    if not values:
+        return orders, order.patient, None
+    pin = order.visit.pin if order.visit and len(orders) > 1 else order.pin
+    return orders, order.patient, report_content(await get_settings_async(db), order.patient, orders, values, pin)
+
+def cleanup_report_cache(max_age_days: int = REPORT_CACHE_DAYS):
+    """حذف التقارير المحفوظة القديمة التي لم تعد ملف نتيجة لأي طلب (المعاينات والنسخ قبل تعديل القيم)"""
+    cutoff = time.time() - max_age_days * 86400
+    try:
+        old = [os.path.join(REPORT_DIR, name) for name in os.listdir(REPORT_DIR)
+               if os.path.getmtime(os.path.join(REPORT_DIR, name)) < cutoff]
+    except FileNotFoundError:
+        return
+    db = SessionLocal()
+    try:
+        in_use = set()
+        for start in range(0, len(old), 900):
+            in_use.update(path for (path,) in db.query(TestOrder.result_file).filter(
+                TestOrder.result_file.in_(old[start:start + 900])
+            ))
+    finally:
+        db.close()
+    for path in old:
+        if path not in in_use:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not delete cached report {path}: {e}")
+
+# --- ملصقات العينات (باركود) ---
+LABEL_SIZE_MM = tuple(float(x) for x in os.getenv("LABEL_SIZE_MM", "50x25").lower().split("x"))
+LABEL_DPI = int(os.getenv("LABEL_DPI", "203"))    # دقة طابعة Zebra (203 أو 300) لأوامر ZPL
+LABEL_SYMBOLOGIES = ("code128", "qr")
+LABEL_MAX_COPIES = 10                             # أنابيب لنفس التحليل
+
+async def label_orders(db: AsyncSession, visit_id: int = None, day: date = None) -> List[list]:
+    """بيانات الملصقات [PIN التحليل، المريض، التحليل، التاريخ] لزيارة أو لكل طلبات يوم بترتيب التسجيل"""
+    query = select(TestOrder.pin, TestOrder.patient_name, TestOrder.test_name, TestOrder.created_at)
+    if visit_id is not None:
+        query = query.where(TestOrder.visit_id == visit_id)
+    else:
+        start = datetime.combine(day, datetime.min.time())
+        query = query.where(TestOrder.created_at >= start, TestOrder.created_at < start + timedelta(days=1))
+    rows = (await db.execute(query.order_by(TestOrder.created_at, TestOrder.id))).all()
+    return [[pin, name, test, created.strftime("%Y-%m-%d")] for pin, name, test, created in rows]
+
+def zpl_field(text) -> str:
+    """قيمة حقل ZPL مع ^FH: الرموز _ و ^ و ~ تُكتب hex حتى لا تقرأها الطابعة كأوامر"""
+    return "^FH^FD" + str(text).replace("_", "_5F").replace("^", "_5E").replace("~", "_7E") + "^FS"
+
+@lru_cache(maxsize=8)
+def zpl_format(symbology: str, size_mm: Tuple[float, float], dpi: int) -> Tuple[str, str]:
+    """قالب الملصق (^DF) يُرسل مرة في أول الدفعة وتحفظه الطابعة، وكل ملصق بعده قيم حقوله فقط (^XF)
+
+    يرجع (اسم القالب في الطابعة، أوامر تعريفه). الحقول: 1 المريض، 2 بيانات الباركود، 3 الـ PIN، 4 التحليل والتاريخ.
+    """
+    dots = dpi / 25.4
+    width, height = round(size_mm[0] * dots), round(size_mm[1] * dots)
+    margin = round(1.5 * dots)
+    small, large = round(height * 0.09), round(height * 0.13)
+    name = f"R:LAB{symbology.upper()}.ZPL"
+    if symbology == "qr":
+        # QR يساراً (version 2 = 25 وحدة) والنصوص بجانبه
+        magnification = max(1, min(10, (height - 2 * margin) // 29))
+        x = 2 * margin + magnification * 25
+        text_width = width - x - margin
+        fields = (
+            f"^FO{margin},{margin}^BQN,2,{magnification}^FN2^FS"
+            f"^FO{x},{margin}^A0N,{large},{large}^FB{text_width},2,0,L^FN1^FS"
+            f"^FO{x},{margin + 2 * large + 8}^A0N,{large},{large}^FB{text_width},1,0,L^FN3^FS"
+            f"^FO{x},{margin + 3 * large + 16}^A0N,{small},{small}^FB{text_width},2,0,L^FN4^FS"
+        )
+    else:
+        text_width = width - 2 * margin
+        bar_height = round(height * 0.42)
+        module = max(2, round(dots * 0.25))   # عرض أنحف خط 0.25 مم على الأقل حتى يقرأه الماسح
+        fields = (
+            f"^FO{margin},{margin}^A0N,{small},{small}^FB{text_width},1,0,C^FN1^FS"
+            f"^FO{margin},{margin + small + 4}^BY{module}^BCN,{bar_height},N,N,N^FN2^FS"
+            f"^FO{margin},{margin + small + bar_height + 8}^A0N,{large},{large}^FB{text_width},1,0,C^FN3^FS"
+            f"^FO{margin},{height - margin - small}^A0N,{small},{small}^FB{text_width},1,0,C^FN4^FS"
+        )
+    # ^CI28: نصوص UTF-8، ^PA: تشكيل العربي واتجاهه في الطابعات التي تدعمه
+    return name, f"^XA^DF{name}^FS^CI28^PA0,1,1,0^PW{width}^LL{height}{fields}^XZ\n"
+
+def zpl_labels(rows: List[list], symbology: str, copies: int = 1) -> str:
+    """كل ملصقات الدفعة كأمر ZPL واحد للطابعة (النسخ بـ ^PQ: الطابعة تكررها بدون إعادة إرسال)"""
+    name, definition = zpl_format(symbology, LABEL_SIZE_MM, LABEL_DPI)
+    labels = [definition]
+    for pin, patient_name, test, day in rows:
+        data = f"QA,{pin}" if symbology == "qr" else pin
+        labels.append(
+            f"^XA^CI28^XF{name}^FS^FN1{zpl_field(patient_name)}^FN2{zpl_field(data)}^FN3{zpl_field(pin)}"
+            f"^FN4{zpl_field(f'{test}  {day}')}^PQ{copies}^XZ\n"
+        )
+    return "".join(labels)
+
+# --- استقبال النتائج من أجهزة التحليل (ASTM / HL7) ---
+ANALYZER_PORT = int(os.getenv("ANALYZER_PORT", "0"))     # 0 = بدون استقبال من الأجهزة
+ANALYZER_HOST = os.getenv("ANALYZER_HOST", "0.0.0.0")
+ANALYZER_BATCH_SIZE = 500        # أقصى عدد رسائل في transaction واحدة
+ANALYZER_IDLE_TIMEOUT = 600      # إغلاق الاتصال الصامت (الأجهزة تعيد الاتصال تلقائياً)
+ANALYZER_MAX_FRAME = 64 * 1024   # إطار أطول من هذا بدون نهاية = بيانات تالفة
+# نتائج ASTM التي أُكدت للجهاز ثم فشل حفظها (سطر JSON لكل رسالة) حتى لا تضيع
+ANALYZER_FAILED_FILE = os.path.join(IMPORT_DIR, "analyzer_failed.jsonl")
+
+ENQ, ACK, NAK, EOT, STX, ETX, ETB = 0x05, 0x06, 0x15, 0x04, 0x02, 0x03, 0x17
+MLLP_START, MLLP_END = b"\x0b", b"\x1c\r"
+
+def analyzer_datetime(value: str) -> Optional[datetime]:
+    """تاريخ ASTM / HL7 بصيغة YYYYMMDD[HHMM[SS]] (مع تجاهل الكسور والمنطقة الزمنية)"""
+    digits = (value or "")[:14]
+    for fmt, size in (("%Y%m%d%H%M%S", 14), ("%Y%m%d%H%M", 12), ("%Y%m%d", 8)):
+        if len(digits) >= size:
+            try:
+                return datetime.strptime(digits[:size], fmt)
+            except ValueError:
+                return None
+    return None
+
+def astm_checksum(body: bytes) -> bytes:
+    """مجموع البايتات من رقم الإطار حتى ETX/ETB (mod 256) بصيغة hex من خانتين"""
+    return b"%02X" % (sum(body) & 0xFF)
+
+def parse_astm_records(text: str, instrument: str = None) -> List[dict]:
+    """سجلات ASTM E1394 (H / P / O / R / L) → قائمة نتائج؛ رقم العينة (O-3) هو PIN الطلب"""
+    results = []
+    field, component = "|", "^"
+    accession = None
+    for record in text.replace("\n", "\r").split("\r"):
+        if len(record) < 2:
+            continue
+        kind = record[0].upper()
+        if kind == "H":
+            # H|\^&|||<اسم الجهاز>^...: الحرف الثاني يحدد فاصل الحقول والتالي فاصل المكونات
+            field = record[1]
+            component = record[3] if len(record) > 3 else "^"
+            fields = record.split(field)
+            if len(fields) > 4 and fields[4]:
+                instrument = fields[4].split(component)[0] or instrument
+            continue
+        fields = record.split(field)
+        if kind == "O":
+            # بعض الأجهزة تضع رقم العينة في O-3 وبعضها في O-4 (رقم العينة عند الجهاز)
+            specimen = (len(fields) > 2 and fields[2]) or (len(fields) > 3 and fields[3]) or ""
+            accession = specimen.split(component)[0].strip() or None
+        elif kind == "R" and accession and len(fields) > 3:
+            test_id = [c for c in fields[2].split(component) if c.strip()]
+            if not test_id:
+                continue
+            results.append({
+                "accession": accession,
+                # ^^^GLU^...: رمز التحليل هو المكون الرابع (أول مكون غير فارغ)
+                "analyte": test_id[0].strip(),
+                "value": fields[3].split(component)[0].strip() or None,
+                "units": (fields[4].strip() or None) if len(fields) > 4 else None,
+                "reference_range": (fields[5].strip() or None) if len(fields) > 5 else None,
+                "flag": (fields[6].strip() or None) if len(fields) > 6 else None,
+                "observed_at": analyzer_datetime(fields[12]) if len(fields) > 12 else None,
+                "instrument": instrument
+            })
+        elif kind == "L":
+            accession = None
+    return results
+
+def parse_hl7_message(text: str) -> Tuple[Optional[str], List[dict]]:
+    """رسالة HL7 v2 ORU^R01 → (MSH-10 رقم الرسالة للـ ACK، النتائج)؛ رقم العينة من OBR-3 أو OBR-2"""
+    segments = [s for s in text.replace("\n", "\r").split("\r") if s]
+    if not segments or not segments[0].startswith("MSH") or len(segments[0]) < 8:
+        raise ValueError("missing MSH segment")
+    field, component = segments[0][3], segments[0][4]
+    msh = segments[0].split(field)
+    # MSH-1 هو فاصل الحقول نفسه، لذلك MSH-n = msh[n - 1]
+    control_id = msh[9] if len(msh) > 9 else None
+    instrument = (msh[2].split(component)[0] or None) if len(msh) > 2 else None
+    results = []
+    accession = None
+    for segment in segments[1:]:
+        fields = segment.split(field)
+        if fields[0] == "OBR":
+            filler = fields[3] if len(fields) > 3 else ""
+            placer = fields[2] if len(fields) > 2 else ""
+            accession = (filler or placer).split(component)[0].strip() or None
+        elif fields[0] == "OBX" and accession and len(fields) > 5:
+            identifier = [c for c in fields[3].split(component) if c.strip()]
+            if not identifier:
+                continue
+            results.append({
+                "accession": accession,
+                "analyte": identifier[0].strip(),
+                "value": fields[5].split(component)[0].strip() or None,
+                "units": (fields[6].split(component)[0].strip() or None) if len(fields) > 6 else None,
+                "reference_range": (fields[7].strip() or None) if len(fields) > 7 else None,
+                "flag": (fields[8].strip() or None) if len(fields) > 8 else None,
+                "observed_at": analyzer_datetime(fields[14]) if len(fields) > 14 else None,
+                "instrument": instrument
+            })
+    return control_id, results
+
+def hl7_ack(control_id: Optional[str], code: str = "AA", message: str = "") -> bytes:
+    """رد ACK بإطار MLLP: AA قبول، AE خطأ في التطبيق (مثلاً PIN غير معروف)، AR رفض الرسالة"""
+    now = datetime.now().strftime("%Y%m%d%H%M%S")
+    text = (f"MSH|^~\\&|LAB|LAB|||{now}||ACK^R01|{control_id or now}|P|2.5\r"
+            f"MSA|{code}|{control_id or ''}|{message}\r")
+    return MLLP_START + text.encode("utf-8") + MLLP_END
+
+class AstmReceiver:
+    """طبقة الإطارات ASTM E1381 (بدون I/O): feed ترجع (الرد للجهاز، نصوص الإرسالات المكتملة)
+
+    ENQ → ACK، كل إطار STX FN text ETX|ETB C1 C2 CR LF سليم → ACK وغير ذلك → NAK ليعيد الجهاز إرساله،
+    EOT ينهي الإرسال. الإطار المكرر (نفس الرقم بعد ضياع الـ ACK) يُرد عليه ACK ولا يُضاف مرتين.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.parts = []
+        self.last_frame = None
+
+    def feed(self, data: bytes) -> Tuple[bytes, List[str]]:
+        self.buffer += data
+        replies = bytearray()
+        messages = []
+        while self.buffer:
+            byte = self.buffer[0]
+            if byte == STX:
+                end = self.buffer.find(b"\n")
+                if end == -1:
+                    if len(self.buffer) > ANALYZER_MAX_FRAME:
+                        self.buffer.clear()
+                        replies.append(NAK)
+                    break
+                frame = bytes(self.buffer[1:end + 1])
+                del self.buffer[:end + 1]
+                replies.append(self.accept_frame(frame))
+                continue
+            del self.buffer[:1]
+            if byte == ENQ:
+                self.parts, self.last_frame = [], None
+                replies.append(ACK)
+            elif byte == EOT:
+                if self.parts:
+                    messages.append("".join(self.parts))
+                self.parts, self.last_frame = [], None
+            # غير ذلك (CR / LF زائدة بين الإطارات) يُتجاهل
+        return bytes(replies), messages
+
+    def accept_frame(self, frame: bytes) -> int:
+        # frame = FN text ETX|ETB C1 C2 CR LF
+        if len(frame) < 6 or frame[-2:] != b"\r\n" or frame[-5] not in (ETX, ETB):
+            return NAK
+        body, checksum = frame[:-4], frame[-4:-2]
+        if astm_checksum(body).upper() != checksum.upper():
+            return NAK
+        if body[0] != self.last_frame:
+            self.last_frame = body[0]
+            self.parts.append(body[1:-1].decode("latin-1"))
+        return ACK
+
+class MllpReceiver:
+    """إطارات MLLP لرسائل HL7: VT message FS CR"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[str]:
+        self.buffer += data
+        messages = []
+        while True:
+            start = self.buffer.find(MLLP_START)
+            if start == -1:
+                self.buffer.clear()
+                break
+            end = self.buffer.find(MLLP_END, start)
+            if end == -1:
+                del self.buffer[:start]
+                if len(self.buffer) > ANALYZER_MAX_FRAME * 16:
+                    self.buffer.clear()
+                break
+            messages.append(bytes(self.buffer[start + 1:end]).decode("utf-8", errors="replace"))
+            del self.buffer[:end + 2]
+        return messages
+
+def store_analyzer_results(db: Session, results: List[dict]) -> Tuple[set, set]:
+    """حفظ دفعة نتائج بأمر INSERT ... ON CONFLICT واحد ونقل طلباتها إلى resulted (بدون commit)
+
+    يرجع (أرقام العينات التي لا تطابق أي طلب، {(order_id, الجهاز)} للطلبات التي وصلت نتائجها).
+
+    رقم العينة هو PIN التحليل، أو PIN الزيارة: عندها يُطابق رمز التحليل مع كود الكتالوج أو اسم التحليل
+    وإلا يُسجل على أول تحليل في الزيارة.
+    """
+    accessions = list({r["accession"] for r in results})
+    lines = {}
+    for start in range(0, len(accessions), 400):
+        chunk = accessions[start:start + 400]
+        for row in db.query(
+            TestOrder.id, TestOrder.pin, TestOrder.patient_id, TestOrder.test_name, TestCatalog.code, Visit.pin.label("visit_pin")
+        ).outerjoin(TestCatalog, TestOrder.catalog_id == TestCatalog.id).outerjoin(Visit, TestOrder.visit_id == Visit.id).filter(
+            or_(TestOrder.pin.in_(chunk), Visit.pin.in_(chunk))
+        ).order_by(TestOrder.id).all():
+            for key in {row.pin, row.visit_pin} & set(chunk):
+                lines.setdefault(key, []).append(row)
+
+    rows = {}
+    unmatched = set()
+    for r in results:
+        candidates = lines.get(r["accession"])
+        if not candidates:
+            unmatched.add(r["accession"])
+            continue
+        analyte = r["analyte"].casefold()
+        order = next((c for c in candidates if analyte in ((c.code or "").casefold(), c.test_name.casefold())), candidates[0])
+        # نفس التحليل مرتين في الدفعة: الأحدث يغلب
+        rows[(order.id, r["analyte"])] = result_value_row(
+            order_id=order.id, patient_id=order.patient_id, **{k: r[k] for k in (
+                "analyte", "value", "units", "reference_range", "flag", "observed_at", "instrument"
+            )}
+        )
+    if rows:
+        stmt = sqlite_insert(ResultValue)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[ResultValue.order_id, ResultValue.analyte],
+            set_={name: stmt.excluded[name] for name in RESULT_VALUE_FIELDS + ("observed_at", "received_at")}
+        ), list(rows.values()))
+        # العينة خرجت من قائمة انتظار الأجهزة؛ نتيجة متأخرة لطلب معتمد أو منشور لا تعيده للمراجعة
+        db.execute(order_transition("resulted").where(
+            TestOrder.id.in_({row["order_id"] for row in rows.values()}), TestOrder.status.in_(("ordered", "collected"))
+        ).execution_options(synchronize_session=False))
+    return unmatched, {(row["order_id"], row["instrument"]) for row in rows.values()}
+
+class AnalyzerListener:
+    """خادم TCP (asyncio) لأجهزة التحليل: يكتشف البروتوكول من أول بايت (VT = HL7 عبر MLLP، غير ذلك ASTM)
+
+    كل الرسائل من كل الاتصالات تدخل طابوراً واحداً وتُحفظ على دفعات (group commit): ما يصل أثناء حفظ دفعة
+    يُحفظ في الدفعة التالية في transaction واحدة، فلا تأخير إضافي عند قلة الرسائل وعدد commits أقل عند كثرتها.
+    ACK رسائل HL7 يُرسل بعد الحفظ الفعلي، أما ASTM فيؤكد كل إطار فور استلامه (حسب المعيار).
+    إذا فشلت الدفعة يُعاد حفظ رسائلها واحدة واحدة فلا تُسقط رسالة تالفة باقي الدفعة؛ رسالة HL7 الفاشلة
+    تأخذ AE فيعيد الجهاز إرسالها، ورسالة ASTM الفاشلة تُسجّل في ANALYZER_FAILED_FILE.
+    """
+
+    def __init__(self):
+        self.server = None
+        self.queue = None
+        self.writer_task = None
+
+    async def start(self, host: str = ANALYZER_HOST, port: int = ANALYZER_PORT):
+        self.queue = asyncio.Queue()
+        self.writer_task = asyncio.create_task(self.write_batches())
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info(f"Analyzer listener on {host}:{port}")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.writer_task:
+            # حفظ ما تبقى في الطابور قبل الإغلاق
+            await self.queue.join()
+            self.writer_task.cancel()
+            await asyncio.gather(self.writer_task, return_exceptions=True)
+            self.writer_task = None
+
+    def submit(self, results: List[dict], acknowledged: bool = False) -> Optional[asyncio.Future]:
+        """acknowledged: الجهاز استلم ACK مسبقاً فلا أحد ينتظر النتيجة (ASTM) → لا future"""
+        future = None if acknowledged else asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((results, future, time.perf_counter()))
+        return future
+
+    async def write_batches(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < ANALYZER_BATCH_SIZE and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                unmatched = await asyncio.to_thread(self.commit_batch, [r for results, _, _ in batch for r in results])
+                outcomes = [({r["accession"] for r in results} & unmatched, None) for results, _, _ in batch]
+            except Exception as e:
+                logger.error(f"Analyzer batch of {len(batch)} messages failed ({e}), retrying one by one")
+                outcomes = await asyncio.to_thread(self.commit_each, [results for results, _, _ in batch])
+            now = time.perf_counter()
+            ANALYZER_BATCH.observe(len(batch))
+            for (results, future, received), (unmatched, error) in zip(batch, outcomes):
+                ANALYZER_LATENCY.observe(now - received)
+                if future is None:
+                    if error:
+                        self.save_failed(results, error)
+                elif not future.done():
+                    if error:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(unmatched)
+                self.queue.task_done()
+
+    @classmethod
+    def commit_each(cls, messages: List[List[dict]]) -> List[tuple]:
+        """حفظ كل رسالة في transaction مستقلة → [(unmatched, error)] بنفس الترتيب"""
+        outcomes = []
+        for results in messages:
+            try:
+                outcomes.append((cls.commit_batch(results), None))
+            except Exception as e:
+                outcomes.append((set(), e))
+        return outcomes
+
+    @staticmethod
+    def save_failed(results: List[dict], error: Exception):
+        accessions = ", ".join(sorted({r["accession"] for r in results}))
+        logger.error(f"Analyzer results not stored ({error}), saved to {ANALYZER_FAILED_FILE}: {accessions}")
+        try:
+            os.makedirs(os.path.dirname(ANALYZER_FAILED_FILE), exist_ok=True)
+            with open(ANALYZER_FAILED_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"failed_at": datetime.now().isoformat(timespec="seconds"), "error": str(error),
+                                    "results": results}, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            logger.error(f"Could not save failed analyzer results: {e}")
+
+    @staticmethod
+    def commit_batch(results: List[dict]) -> set:
+        if not results:
+            return set()
+        db = SessionLocal()
+        try:
+            unmatched, stored = store_analyzer_results(db, results)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        for order_id, instrument in stored:
+            audit.record(f"analyzer:{instrument or 'unknown'}", "result", "order", order_id)
+        if unmatched:
+            logger.warning(f"Analyzer results for unknown PINs: {', '.join(sorted(unmatched)[:20])}")
+        return unmatched
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        astm, mllp, protocol = AstmReceiver(), MllpReceiver(), None
+        try:
+            while True:
+                data = await asyncio.wait_for(reader.read(65536), ANALYZER_IDLE_TIMEOUT)
+                if not data:
+                    break
+                if protocol is None:
+                    protocol = "hl7" if data.lstrip(b"\r\n")[:1] == MLLP_START else "astm"
+                if protocol == "hl7":
+                    for message in mllp.feed(data):
+                        writer.write(await self.handle_hl7(message))
+                else:
+                    replies, messages = astm.feed(data)
+                    for message in messages:
+                        results = parse_astm_records(message)
+                        if results:
+                            self.submit(results, acknowledged=True)
+                    writer.write(replies)
+                await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Analyzer connection {peer} error: {e}")
+        finally:
+            writer.close()
+
+    async def handle_hl7(self, message: str) -> bytes:
+        try:
+            control_id, results = parse_hl7_message(message)
+        except (ValueError, IndexError) as e:
+            return hl7_ack(None, "AR", str(e))
+        if not results:
+            return hl7_ack(control_id)
+        try:
+            unmatched = await self.submit(results)
+        except Exception:
+            return hl7_ack(control_id, "AE", "storage error")
+        if unmatched:
+            return hl7_ack(control_id, "AE", f"unknown accession {', '.join(sorted(unmatched))}")
+        return hl7_ack(control_id)
+
+analyzer_listener = AnalyzerListener()
+
+# --- أرشيف الطلبات القديمة ---
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))   # 0 = بدون أرشفة
+ARCHIVE_BATCH_SIZE = 5000     # طلبات في كل transaction حتى لا تنتظر الإضافة من الواجهة طويلاً
+ARCHIVE_BATCH_SLEEP = 0.01
+ORDER_COLUMNS = ", ".join(column.name for column in TestOrder.__table__.columns)
+archive_lock = threading.Lock()
+
+def archive_old_orders(days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """نقل الطلبات الأقدم من days يوم من orders إلى orders_archive على دفعات، ويرجع عدد الطلبات المنقولة
+
+    النقل إدراج في الأرشيف ثم حذف من orders بنفس الـ id: triggers الحذف تتعرف على الطلب المنقول
+    فلا تحذف ملف نتيجته ولا تعيد حساب ملخص المريض. orders.id بـ AUTOINCREMENT فلا يتكرر id موجود في الأرشيف.
+    """
+    if days <= 0 or not archive_lock.acquire(blocking=False):
+        return 0
+    moved = 0
+    cutoff = _sqlite_dt(datetime.now() - timedelta(days=days))
+    conn = engine.raw_connection()
+    cursor = conn.cursor()
+    try:
+        while True:
+            cursor.execute("BEGIN IMMEDIATE")
+            ids = json.dumps([row[0] for row in cursor.execute(
+                "SELECT id FROM orders WHERE created_at < ? ORDER BY created_at LIMIT ?", (cutoff, batch_size)
+            )])
+            cursor.execute(
+                f"INSERT INTO orders_archive ({ORDER_COLUMNS}, archived_at) "
+                f"SELECT {ORDER_COLUMNS}, ? FROM orders WHERE id IN (SELECT value FROM json_each(?))",
+                (_sqlite_dt(datetime.now()), ids)
+            )
+            count = cursor.rowcount
+            cursor.execute("DELETE FROM orders WHERE id IN (SELECT value FROM json_each(?))", (ids,))
+            conn.commit()
+            moved += count
+            if count < batch_size:
+                break
+            time.sleep(ARCHIVE_BATCH_SLEEP)
+        logger.info(f"Archived {moved} orders older than {days} days")
+        return moved
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Archive error: {e}")
+        raise
+    finally:
+        conn.close()
+        archive_lock.release()
+
+def archive_newest(db: Session) -> Optional[datetime]:
+    """أحدث تاريخ طلب في الأرشيف (None إذا كان فارغاً): فلتر التاريخ يحتاج الأرشيف فقط إذا بدأ قبله"""
+    stats = db.get(ArchiveStats, 1)
+    return stats.newest_order_at if stats and stats.order_count else None
+
+# --- النسخ الاحتياطي أثناء التشغيل ---
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "14"))                          # عدد النسخ المحفوظة
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))   # 0 = بدون جدولة
+BACKUP_INCLUDE_FILES = os.getenv("BACKUP_INCLUDE_FILES", "1") == "1"
+BACKUP_STEP_PAGES = 256       # صفحات في كل خطوة (1MB بحجم الصفحة الافتراضي)
+BACKUP_STEP_SLEEP = 0.005     # استراحة بين الخطوات حتى تكتب الطلبات الأخرى (add_order)
+BACKUP_MAX_RESTARTS = 5
+backup_lock = threading.Lock()
+
+class BackupRestarted(Exception):
+    pass
+
+def _copy_database(dest: str) -> dict:
+    """نسخة متسقة بـ SQLite backup API (بدون WAL: على خطوات حتى لا يُمسك قفل القراءة طويلاً)"""
+    src = sqlite3.connect(engine.url.database)
+    dst = sqlite3.connect(dest)
+    state = {"remaining": None, "restarts": 0}
+
+    def progress(status, remaining, total):
+        # كتابة من اتصال آخر أثناء النسخ تجعل SQLite يبدأ من جديد
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > BACKUP_MAX_RESTARTS:
+                raise BackupRestarted()
+        state["remaining"] = remaining
+
+    try:
+        if src.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+            # في وضع WAL النسخ يقرأ لقطة ثابتة والكتابة مستمرة في ملف الـ WAL، فخطوة واحدة لا توقف أحداً
+            src.backup(dst, pages=-1)
+        else:
+            try:
+                src.backup(dst, pages=BACKUP_STEP_PAGES, progress=progress, sleep=BACKUP_STEP_SLEEP)
+            except BackupRestarted:
+                # قاعدة مشغولة جداً: خطوة واحدة (قفل قراءة واحد طوال النسخ، لكنه ينتهي دائماً)
+                logger.warning("Backup restarted too often, copying in a single step")
+                src.backup(dst, pages=-1)
+        pages = dst.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+    return {"pages": pages, "restarts": state["restarts"]}
+
+def _gzip_file(source: str, dest: str) -> str:
+    """ضغط الملف ويرجع sha256 للمحتوى الأصلي (قبل الضغط)"""
+    digest = hashlib.sha256()
+    with open(source, "rb") as src, gzip.open(dest + ".tmp", "wb", compresslevel=6) as dst:
+        for chunk in iter(lambda: src.read(1024 * 1024), b""):
+            digest.update(chunk)
+            dst.write(chunk)
+    os.replace(dest + ".tmp", dest)
+    return digest.hexdigest()
+
+def _backup_result_files(previous: dict) -> dict:
+    """نسخ ملفات النتائج إلى مخزن حسب المحتوى (files/<sha256>): الملف الموجود في نسخة سابقة لا يُنسخ مرة أخرى،
+    والملف الذي لم يتغير حجمه ولا تاريخه لا تُعاد قراءته لحساب البصمة"""
+    files = {}
+    if not os.path.isdir(UPLOAD_DIR):
+        return files
+    for entry in os.scandir(UPLOAD_DIR):
+        if not entry.is_file():
+            continue
+        st = entry.stat()
+        old = previous.get(entry.name)
+        if old and old["size"] == st.st_size and old["mtime"] == st.st_mtime:
+            digest = old["sha256"]
+        else:
+            digest = file_checksum(entry.path)
+        stored = os.path.join(BACKUP_DIR, "files", digest[:2], digest)
+        if not os.path.exists(stored):
+            os.makedirs(os.path.dirname(stored), exist_ok=True)
+            shutil.copyfile(entry.path, stored + ".tmp")
+            os.replace(stored + ".tmp", stored)
+        files[entry.name] = {"sha256": digest, "size": st.st_size, "mtime": st.st_mtime}
+    return files
+
+def list_backups() -> List[dict]:
+    """النسخ الموجودة من الأحدث للأقدم"""
+    manifests = []
+    for path in sorted(glob.glob(os.path.join(BACKUP_DIR, "lab-*.json")), reverse=True):
+        with open(path, encoding="utf-8") as f:
+            manifests.append(json.load(f))
+    return manifests
+
+def verify_backup(manifest: dict, check_files: bool = False) -> dict:
+    """التحقق من النسخة: بصمة قاعدة البيانات بعد فك الضغط + PRAGMA integrity_check (+ بصمات ملفات النتائج)"""
+    problems = []
+    db_path = os.path.join(BACKUP_DIR, manifest["database"])
+    fd, tmp_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        digest = hashlib.sha256()
+        with gzip.open(db_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                digest.update(chunk)
+                dst.write(chunk)
+        if digest.hexdigest() != manifest["sha256"]:
+            problems.append("database checksum mismatch")
+        conn = sqlite3.connect(tmp_path)
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            conn.close()
+        if result != "ok":
+            problems.append(f"integrity_check: {result}")
+    except (OSError, sqlite3.DatabaseError) as e:
+        problems.append(str(e))
+    finally:
+        os.remove(tmp_path)
+
+    for name, info in manifest.get("files", {}).items():
+        stored = os.path.join(BACKUP_DIR, "files", info["sha256"][:2], info["sha256"])
+        if not os.path.exists(stored):
+            problems.append(f"missing file {name}")
+        elif check_files and file_checksum(stored) != info["sha256"]:
+            problems.append(f"file checksum mismatch {name}")
+    return {"name": manifest["name"], "ok": not problems, "problems": problems}
+
+def rotate_backups(keep: int = BACKUP_KEEP):
+    """حذف النسخ الأقدم من آخر keep نسخة، ثم ملفات النتائج التي لم تعد أي نسخة تشير إليها"""
+    manifests = list_backups()
+    for manifest in manifests[keep:]:
+        for name in (manifest["database"], manifest["name"] + ".json"):
+            path = os.path.join(BACKUP_DIR, name)
+            if os.path.exists(path):
+                os.remove(path)
+    referenced = {info["sha256"] for m in manifests[:keep] for info in m.get("files", {}).values()}
+    for path in glob.glob(os.path.join(BACKUP_DIR, "files", "*", "*")):
+        if os.path.basename(path) not in referenced:
+            os.remove(path)
+
+def run_backup(include_files: bool = BACKUP_INCLUDE_FILES) -> Optional[dict]:
+    """نسخة احتياطية كاملة دون إيقاف الخدمة: نسخ على خطوات، ضغط، تحقق، ثم تدوير النسخ القديمة"""
+    if not backup_lock.acquire(blocking=False):
+        logger.info("Backup already running, skipped")
+        return None
+    try:
+        started = time.perf_counter()
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        name = f"lab-{datetime.now():%Y%m%d-%H%M%S}"
+        while os.path.exists(os.path.join(BACKUP_DIR, name + ".db.gz")):
+            time.sleep(0.2)  # نسختان في نفس الثانية
+            name = f"lab-{datetime.now():%Y%m%d-%H%M%S}"
+        raw_path = os.path.join(BACKUP_DIR, name + ".db.partial")
+        try:
+            copy_stats = _copy_database(raw_path)
+            sha256 = _gzip_file(raw_path, os.path.join(BACKUP_DIR, name + ".db.gz"))
+        finally:
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+
+        previous = list_backups()
+        manifest = {
+            "name": name,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "database": name + ".db.gz",
+            "sha256": sha256,
+            "pages": copy_stats["pages"],
+            "restarts": copy_stats["restarts"],
+            "files": _backup_result_files(previous[0].get("files", {}) if previous else {}) if include_files else {},
+        }
+        verification = verify_backup(manifest)
+        if not verification["ok"]:
+            os.remove(os.path.join(BACKUP_DIR, manifest["database"]))
+            raise RuntimeError(f"Backup {name} failed verification: {verification['problems']}")
+        manifest["seconds"] = round(time.perf_counter() - started, 2)
+        with open(os.path.join(BACKUP_DIR, name + ".json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        rotate_backups()
+        logger.info(f"Backup {name} done in {manifest['seconds']}s ({manifest['pages']} pages, {len(manifest['files'])} files)")
+        return manifest
+    except Exception as e:
+        logger.error(f"Backup failed: {e}")
+        raise
+    finally:
+        backup_lock.release()
+
+def restore_backup(manifest: dict, db_dest: str, files_dest: Optional[str] = None):
+    """فك النسخة إلى db_dest (وملفات النتائج إلى files_dest) - يجب إيقاف الخدمة قبل استبدال lab.db"""
+    with gzip.open(os.path.join(BACKUP_DIR, manifest["database"]), "rb") as src, open(db_dest, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    if files_dest:
+        os.makedirs(files_dest, exist_ok=True)
+        for name, info in manifest.get("files", {}).items():
+            shutil.copyfile(os.path.join(BACKUP_DIR, "files", info["sha256"][:2], info["sha256"]),
+                            os.path.join(files_dest, name))
+
+# تشغيل الحذف التلقائي كل 24 ساعة
+scheduler = None
+
+def start_scheduler():
+    global scheduler
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(cleanup_old_results, 'interval', hours=24)
+    scheduler.add_job(process_file_deletions, 'interval', minutes=5)
+    scheduler.add_job(cleanup_report_cache, 'interval', hours=24)
+    scheduler.add_job(session_store.purge_expired, 'interval', hours=1)
+    if ARCHIVE_AFTER_DAYS > 0:
+        scheduler.add_job(archive_old_orders, 'interval', hours=24)
+    if BACKUP_INTERVAL_HOURS > 0:
+        scheduler.add_job(run_backup, 'interval', hours=BACKUP_INTERVAL_HOURS)
+    scheduler.start()
+
+def stop_scheduler():
+    if scheduler is not None and scheduler.running:
+        scheduler.shutdown(wait=False)
+
+# --- Startup ---
+# التحاليل التي كانت اختصارات في الترجمة فقط: الكود ومفتاح الاسم
+DEFAULT_TESTS = {
+    "CBC": "cbc_test", "FBS": "fasting_sugar", "PPBS": "postprandial_sugar", "LFT": "liver_function",
+    "KFT": "kidney_function", "LIPID": "lipid_profile", "VITD": "vitamin_d", "TSH": "tsh",
+}
+
+def seed_test_catalog(db: Session):
+    """كتالوج مبدئي (بدون أسعار) وربط الطلبات القديمة التي تحمل نفس الكود أو الاسم"""
+    ar, en = translations_for("ar"), translations_for("en")
+    for code, key in DEFAULT_TESTS.items():
+        db.add(TestCatalog(code=code, name_ar=ar[key], name_en=en[key]))
+    db.flush()
+    link_orders_to_catalog(db)
+
+def link_orders_to_catalog(db: Session, catalog_id: Optional[int] = None) -> int:
+    """ربط الطلبات غير المرتبطة بالكتالوج إذا كان اسم التحليل فيها هو الكود أو أحد أسماء التحليل"""
+    return db.execute(text(f"""
+        UPDATE orders SET catalog_id = (
+            SELECT c.id FROM test_catalog c
+            WHERE lower(trim(orders.test_name)) IN (lower(c.code), lower(c.name_ar), lower(c.name_en))
+            {"AND c.id = :catalog_id" if catalog_id else ""}
+        )
+        WHERE catalog_id IS NULL AND EXISTS (
+            SELECT 1 FROM test_catalog c
+            WHERE lower(trim(orders.test_name)) IN (lower(c.code), lower(c.name_ar), lower(c.name_en))
+            {"AND c.id = :catalog_id" if catalog_id else ""}
+        )
+    """), {"catalog_id": catalog_id}).rowcount
+
+def link_catalog_entry(catalog_id: int):
+    """ربط الطلبات القديمة بتحليل أضيف للكتالوج (في الخلفية لأنه يمر على جدول الطلبات كله)"""
+    db = SessionLocal()
+    try:
+        linked = link_orders_to_catalog(db, catalog_id)
+        db.commit()
+        if linked:
+            logger.info(f"Linked {linked} orders to catalog entry {catalog_id}")
+    except Exception as e:
+        logger.error(f"Catalog link error: {e}")
         db.rollback()
     finally:
         db.close()
 
-# تشغيل الحذف التلقائي كل 24 ساعة
-scheduler = BackgroundScheduler()
-scheduler.add_job(cleanup_old_results, 'interval', hours=24)
-scheduler.start()
-
-# --- Startup ---
-@app.on_event("startup")
 def startup():
+    """تجهيز كل ما يحتاجه التطبيق قبل أول طلب (يعمل في lifespan)"""
+    for folder in APP_DIRS:
+        os.makedirs(folder, exist_ok=True)
+    # نسخة سطح المكتب: الصور الافتراضية (الشعار) تُنسخ مرة واحدة من الحزمة إلى مجلد البيانات
+    bundled_images = os.path.join(STATIC_DIR, "images")
+    if os.path.isdir(bundled_images) and os.path.abspath(bundled_images) != os.path.abspath(LOGO_DIR):
+        for name in os.listdir(bundled_images):
+            if not os.path.exists(os.path.join(LOGO_DIR, name)):
+                shutil.copy2(os.path.join(bundled_images, name), LOGO_DIR)
+    init_db()
+    seed_defaults()
+    warm_up()
+
+def seed_defaults():
     db = SessionLocal()
     try:
         if not db.query(User).filter(User.username == "admin").first():
@@ -1174,6 +3471,8 @@ def startup():
             logger.info("Created staff user")
         
         get_or_create_settings(db)
+        if not db.query(TestCatalog.id).first():
+            seed_test_catalog(db)
         db.commit()
     except Exception as e:
         logger.error(f"Startup error: {e}")
@@ -1181,8 +3480,15 @@ def startup():
     finally:
         db.close()
 
+def warm_up():
+    """تجهيز مسبق قبل أول طلب: ترجمة كل القوالب وفتح اتصال قاعدة البيانات (مع الـ PRAGMAs)"""
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.env.get_template(name)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
 # --- Authentication Routes ---
-@app.get('/login', response_class=HTMLResponse)
+@router.get('/login', response_class=HTMLResponse)
 def login_page(request: Request, db: Session = Depends(get_db)):
     if request.session.get("user"):
         return RedirectResponse("/", status_code=303)
@@ -1198,7 +3504,7 @@ def login_page(request: Request, db: Session = Depends(get_db)):
         "t": translations
     })
 
-@app.post('/login')
+@router.post('/login')
 def login(
     request: Request,
     username: str = Form(...),
@@ -1210,6 +3516,7 @@ def login(
         
         if not user or not verify_password(password, user.password):
             logger.warning(f"Failed login attempt for username: {username}")
+            audit.record(username, "login_failed", "user", user.id if user else None)
             
             lang = get_language(request, db)
             translations = get_translations(request, db)
@@ -1231,6 +3538,7 @@ def login(
         }
         
         logger.info(f"User {username} logged in successfully")
+        audit.record(username, "login", "user", user.id)
         return RedirectResponse("/", status_code=303)
     
     except Exception as e:
@@ -1247,7 +3555,7 @@ def login(
             "t": translations
         })
 
-@app.get('/logout')
+@router.get('/logout')
 def logout(request: Request):
     username = request.session.get("user", {}).get("username", "Unknown")
     request.session.clear()
@@ -1255,25 +3563,26 @@ def logout(request: Request):
     return RedirectResponse("/login", status_code=303)
 
 # --- Dashboard ---
-@app.get('/', response_class=HTMLResponse)
+@router.get('/', response_class=HTMLResponse)
 def dashboard(request: Request, db: Session = Depends(get_db)):
     try:
         user = get_current_user(request)
         
+        # تحديث الصفحة دون أي تغيير لا يعيد الاستعلامات ولا الرسم (عدد طلبات اليوم يعتمد على التاريخ)
+        etag = page_etag(request, get_table_versions(db), date.today())
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        
         p_count = db.query(Patient).count()
-        o_count = db.query(TestOrder).count()
+        # الطلبات المؤرشفة تدخل في العدد الكلي من الملخص دون قراءة الأرشيف
+        o_count = db.query(TestOrder).count() + (db.query(ArchiveStats.order_count).scalar() or 0)
         today_orders = db.query(TestOrder).filter(
-            func.date(TestOrder.created_at) == date.today()
+            TestOrder.created_at >= datetime.combine(date.today(), datetime.min.time())
         ).count()
         
-        pending_results = db.query(TestOrder).filter(
-            TestOrder.published == False
-        ).count()
+        pending_results = db.query(TestOrder).filter(*order_status_criteria("pending")).count()
         
-        pending_approval = db.query(TestOrder).filter(
-            TestOrder.result_file.isnot(None),
-            TestOrder.admin_approved == False
-        ).count()
+        pending_approval = db.query(TestOrder).filter(*order_status_criteria("pending_approval")).count()
         
         employee = None
         if user.get("role") == "admin":
@@ -1284,7 +3593,7 @@ def dashboard(request: Request, db: Session = Depends(get_db)):
         lang = get_language(request, db)
         translations = get_translations(request, db)
         
-        return templates.TemplateResponse("dashboard.html", {"request": request, "patient_count": p_count, "order_count": o_count, "today_orders": today_orders, "pending_results": pending_results, "pending_approval": pending_approval, "user": user, "employee": employee, "settings": settings, "lang": lang, "dir": "rtl" if lang == "ar" else "ltr", "t": translations, "show_finance": settings.show_finance_to_users})
+        return with_etag(templates.TemplateResponse("dashboard.html", {"request": request, "patient_count": p_count, "order_count": o_count, "today_orders": today_orders, "pending_results": pending_results, "pending_approval": pending_approval, "user": user, "employee": employee, "settings": settings, "lang": lang, "dir": "rtl" if lang == "ar" else "ltr", "t": translations, "show_finance": settings.show_finance_to_users}), etag)
     
     except HTTPException:
         return RedirectResponse("/login", status_code=303)
@@ -1293,7 +3602,7 @@ def dashboard(request: Request, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- Patient Management ---
-@app.get('/patients', response_class=HTMLResponse)
+@router.get('/patients', response_class=HTMLResponse)
 def patients_page(
     request: Request,
     search: Optional[str] = None,
@@ -1302,6 +3611,10 @@ def patients_page(
     try:
         user = get_current_user(request)
         
+        etag = page_etag(request, get_table_versions(db))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        
         query = db.query(Patient)
         if search:
             query = query.filter(
@@ -1316,7 +3629,7 @@ def patients_page(
         lang = get_language(request, db)
         translations = get_translations(request, db)
         
-        return templates.TemplateResponse("patients.html", {
+        return with_etag(templates.TemplateResponse("patients.html", {
             "request": request,
             "patients": patients,
             "search": search or "",
@@ -1324,13 +3637,18 @@ def patients_page(
             "lang": lang,
             "dir": "rtl" if lang == "ar" else "ltr",
             "t": translations
-        })
+        }), etag)
     
     except HTTPException:
         return RedirectResponse("/login", status_code=303)
 
-@app.get('/patient_details/{patient_id}', response_class=HTMLResponse)
-def patient_details(patient_id: int, request: Request, db: Session = Depends(get_db)):
+@router.get('/patient_details/{patient_id}', response_class=HTMLResponse)
+def patient_details(
+    patient_id: int,
+    request: Request,
+    before: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
     try:
         user = get_current_user(request)
         
@@ -1338,12 +3656,43 @@ def patient_details(patient_id: int, request: Request, db: Session = Depends(get
         if not patient:
             raise HTTPException(status_code=404, detail="المريض غير موجود")
         
+        # ترقيم الصفحات بالمفتاح (keyset): before = "<created_at>_<order id>" لآخر طلب في الصفحة السابقة
+        if before:
+            try:
+                before_date, before_id = before.rsplit("_", 1)
+                before_date, before_id = datetime.fromisoformat(before_date), int(before_id)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="before غير صالح")
+        
+        def history_page(model):
+            query = db.query(model).filter(model.patient_id == patient_id)
+            if before:
+                query = query.filter(or_(
+                    model.created_at < before_date,
+                    and_(model.created_at == before_date, model.id < before_id)
+                ))
+            return query.order_by(model.created_at.desc(), model.id.desc()).limit(HISTORY_PAGE_SIZE + 1).all()
+        
+        orders = history_page(TestOrder)
+        # الصفحة تكمل من الأرشيف فقط عندما لا تكفي الطلبات الحالية أو تصل إلى تاريخ الأرشيف
+        newest_archived = archive_newest(db)
+        if newest_archived and (len(orders) <= HISTORY_PAGE_SIZE or orders[-1].created_at <= newest_archived):
+            orders = sorted(orders + history_page(ArchivedOrder), key=lambda o: (o.created_at, o.id), reverse=True)
+        next_cursor = None
+        if len(orders) > HISTORY_PAGE_SIZE:
+            orders = orders[:HISTORY_PAGE_SIZE]
+            next_cursor = f"{orders[-1].created_at.isoformat()}_{orders[-1].id}"
+        
         lang = get_language(request, db)
         translations = get_translations(request, db)
         
         return templates.TemplateResponse("patient_history.html", {
             "request": request,
             "patient": patient,
+            "stats": patient.stats or PatientStats(visit_count=0, lifetime_spend=0, published_count=0),
+            "orders": orders,
+            "next_cursor": next_cursor,
+            "is_first_page": not before,
             "user": user,
             "lang": lang,
             "dir": "rtl" if lang == "ar" else "ltr",
@@ -1355,22 +3704,87 @@ def patient_details(patient_id: int, request: Request, db: Session = Depends(get
             return RedirectResponse("/login", status_code=303)
         raise
 
-@app.post('/delete_patient/{patient_id}')
-def delete_patient(patient_id: int, request: Request, db: Session = Depends(get_db)):
+@router.get('/patient/{patient_id}/trends')
+def patient_trends_api(
+    patient_id: int,
+    request: Request,
+    analyte: Optional[str] = None,
+    since: Optional[date] = None,
+    db: Session = Depends(get_db)
+):
+    """منحنيات نتائج المريض لكل تحليل (أو لتحليل واحد) بصيغة أعمدة جاهزة للرسم"""
+    get_current_user(request)
+    return {
+        "patient_id": patient_id,
+        "analytes": patient_trends(db, patient_id, analyte, datetime.combine(since, datetime.min.time()) if since else None)
+    }
+
+@router.get('/patient/{patient_id}/abnormal')
+def patient_abnormal_results(
+    patient_id: int,
+    request: Request,
+    before: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """النتائج غير الطبيعية للمريض (الأحدث أولاً) من الفهرس الجزئي ix_result_values_abnormal"""
+    get_current_user(request)
+    query = db.query(ResultValue).filter(ResultValue.patient_id == patient_id, ResultValue.abnormal == True)
+    if before:
+        query = query.filter(ResultValue.observed_at < before)
+    rows = query.order_by(ResultValue.observed_at.desc()).limit(ABNORMAL_PAGE_SIZE).all()
+    return [{
+        "analyte": r.analyte,
+        "observed_at": r.observed_at.isoformat(),
+        "value": r.value,
+        "units": r.units,
+        "reference_range": r.reference_range,
+        "flag": r.flag,
+        "order_id": r.order_id
+    } for r in rows]
+
+@router.get('/analytes/{analyte}/stats')
+def analyte_stats(
+    analyte: str,
+    request: Request,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: Session = Depends(get_db)
+):
+    """إحصاء تحليل على كل المرضى في فترة (المتوسط والانحراف والمئينات ونسبة النتائج غير الطبيعية)"""
+    require_admin(request)
+    query = select(ResultValue.value_num, ResultValue.abnormal).where(
+        ResultValue.analyte == analyte, ResultValue.value_num.isnot(None)
+    )
+    if start_date:
+        query = query.where(ResultValue.observed_at >= datetime.combine(start_date, datetime.min.time()))
+    if end_date:
+        query = query.where(ResultValue.observed_at <= datetime.combine(end_date, datetime.max.time()))
+    rows = db.execute(query).all()
+    return {
+        "analyte": analyte,
+        "start_date": start_date,
+        "end_date": end_date,
+        **analyte_statistics([r[0] for r in rows], [r[1] for r in rows])
+    }
+
+@router.post('/delete_patient/{patient_id}')
+def delete_patient(patient_id: int, request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     try:
-        require_admin(request)
-        patient = db.query(Patient).filter(Patient.id == patient_id).first()
-        if patient:
-            # حذف الطلبات المرتبطة أولاً لمنع تعارض قاعدة البيانات
-            db.query(TestOrder).filter(TestOrder.patient_id == patient_id).delete()
-            db.delete(patient)
-            db.commit()
-            logger.info(f"Patient {patient.id} deleted by admin")
+        user = require_admin(request)
+        # أمر واحد: قاعدة البيانات تحذف الطلبات (ON DELETE CASCADE) وملفاتها تدخل طابور الحذف
+        deleted = db.execute(
+            delete(Patient).where(Patient.id == patient_id).returning(Patient.name, Patient.phone)
+        ).first()
+        db.commit()
+        if deleted:
+            background_tasks.add_task(process_file_deletions)
+            audit.record(user, "delete", "patient", patient_id, name=deleted.name, phone=deleted.phone)
+            logger.info(f"Patient {patient_id} deleted by admin")
         return RedirectResponse('/patients', status_code=303)
     except HTTPException:
         return RedirectResponse("/login", status_code=303)
 
-@app.get('/edit_patient/{patient_id}')
+@router.get('/edit_patient/{patient_id}')
 def edit_patient_page(patient_id: int, request: Request, db: Session = Depends(get_db)):
     # هذه الدالة لفتح الصفحة فقط (GET)
     patient = db.query(Patient).filter(Patient.id == patient_id).first()
@@ -1387,7 +3801,7 @@ def edit_patient_page(patient_id: int, request: Request, db: Session = Depends(g
         "dir": "rtl" if lang == "ar" else "ltr"
     })
 
-@app.post('/edit_patient/{patient_id}')
+@router.post('/edit_patient/{patient_id}')
 def edit_patient(
     patient_id: int, request: Request,
     name: str = Form(...), phone: str = Form(...),
@@ -1396,29 +3810,31 @@ def edit_patient(
     db: Session = Depends(get_db)
 ):
     try:
-        require_admin(request)
+        user = require_admin(request)
         patient = db.query(Patient).filter(Patient.id == patient_id).first()
         if patient:
-            patient.name, patient.phone = name, phone
-            patient.age, patient.gender = age, gender
-            patient.address, patient.notes = address, notes
+            changes = audit_changes(patient, name=name, phone=phone, age=age, gender=gender, address=address, notes=notes)
             db.commit()
+            if changes:
+                audit.record(user, "update", "patient", patient_id, changes=changes)
         return RedirectResponse(f'/patient_details/{patient_id}', status_code=303)
     except HTTPException:
         return RedirectResponse("/login", status_code=303)
 
-@app.get('/search_patients')
-def search_patients(query: str, db: Session = Depends(get_db)):
+@router.get('/search_patients')
+async def search_patients(query: str, db: AsyncSession = Depends(get_async_db)):
     try:
-        patients = db.query(Patient).filter(
-            or_(Patient.name.ilike(f"%{query}%"), Patient.phone.ilike(f"%{query}%"))
-        ).limit(10).all()
-        return [{"name": p.name, "phone": p.phone or ""} for p in patients]
+        rows = (await db.execute(
+            select(Patient.name, Patient.phone).where(
+                or_(Patient.name.ilike(f"%{query}%"), Patient.phone.ilike(f"%{query}%"))
+            ).limit(10)
+        )).all()
+        return [{"name": name, "phone": phone or ""} for name, phone in rows]
     except Exception as e:
         logger.error(f"Search error: {e}")
         return []
 
-@app.get('/add_patient', response_class=HTMLResponse)
+@router.get('/add_patient', response_class=HTMLResponse)
 def add_patient_page(request: Request, db: Session = Depends(get_db)):
     # جرب تعطيل هذا السطر مؤقتاً بوضع # قبله
     # user = get_current_user(request) 
@@ -1430,7 +3846,7 @@ def add_patient_page(request: Request, db: Session = Depends(get_db)):
         "dir": "rtl" if lang == "ar" else "ltr", "search": ""
     })
 
-@app.post('/add_patient')
+@router.post('/add_patient')
 def add_patient_submit(
     request: Request, 
     name: str = Form(...), 
@@ -1443,16 +3859,9 @@ def add_patient_submit(
 ):
     try:
         user = get_current_user(request)
-        # إنشاء مريض جديد بكافة البيانات
-        new_patient = Patient(
-            name=name, 
-            phone=phone, 
-            age=age, 
-            gender=gender, 
-            address=address,
-            notes=notes
-        )
-        db.add(new_patient)
+        # إنشاء مريض جديد بكافة البيانات (أو تحديث بياناته إن كان مسجلاً بنفس الاسم والهاتف)
+        upsert_patient(db, name, phone, age=age, gender=gender or None,
+                       address=address or None, notes=notes or None)
         db.commit()
         return RedirectResponse('/patients', status_code=303)
     except Exception as e:
@@ -1460,35 +3869,104 @@ def add_patient_submit(
         db.rollback()
         return RedirectResponse('/patients', status_code=303)
 
+# --- Test Catalog ---
+@router.get('/search_tests')
+async def search_tests(request: Request, q: str = "", limit: int = 10, db: AsyncSession = Depends(get_async_db)):
+    """اقتراحات التحاليل أثناء كتابة الطلب (من الفهرس في الذاكرة)"""
+    get_current_user(request)
+    catalog = await get_test_catalog_async(db)
+    lang = await get_language_async(request, db)
+    return [{
+        "id": entry["id"],
+        "code": entry["code"],
+        "name": entry["name_en"] if lang == "en" else entry["name_ar"],
+        "price": entry["price"],
+        "currency": entry["currency"],
+        "turnaround_hours": entry["turnaround_hours"]
+    } for entry in catalog.search(q, min(limit, TestCatalogIndex.MAX_MATCHES))]
+
+@router.get('/catalog')
+def catalog_list(request: Request, db: Session = Depends(get_db)):
+    require_admin(request)
+    return [{
+        "id": c.id,
+        "code": c.code,
+        "name_ar": c.name_ar,
+        "name_en": c.name_en,
+        "price": c.price,
+        "currency": c.currency,
+        "turnaround_hours": c.turnaround_hours,
+        "retention_days": c.retention_days,
+        "active": c.active
+    } for c in db.query(TestCatalog).order_by(TestCatalog.code).all()]
+
+@router.post('/catalog')
+def catalog_save(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    code: str = Form(...),
+    name_ar: str = Form(...),
+    name_en: str = Form(...),
+    price: Optional[int] = Form(None),
+    currency: str = Form("ج.م"),
+    turnaround_hours: Optional[int] = Form(None),
+    retention_days: Optional[int] = Form(None),
+    catalog_id: Optional[int] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """إضافة تحليل للكتالوج أو تعديله (catalog_id)"""
+    user = require_admin(request)
+    code = code.strip().upper()
+    duplicate = db.query(TestCatalog.id).filter(TestCatalog.code == code, TestCatalog.id != catalog_id).first()
+    if duplicate:
+        raise HTTPException(status_code=400, detail="كود التحليل مستخدم")
+    entry = db.get(TestCatalog, catalog_id) if catalog_id else TestCatalog()
+    if entry is None:
+        raise HTTPException(status_code=404, detail="التحليل غير موجود")
+    changes = audit_changes(
+        entry, code=code, name_ar=name_ar.strip(), name_en=name_en.strip(), price=price, currency=currency,
+        turnaround_hours=turnaround_hours, retention_days=retention_days, active=True
+    )
+    db.add(entry)
+    db.commit()
+    if changes:
+        audit.record(user, "update" if catalog_id else "create", "test_catalog", entry.id, changes=changes)
+    background_tasks.add_task(link_catalog_entry, entry.id)
+    return JSONResponse({"status": "saved", "id": entry.id})
+
+@router.post('/catalog/{catalog_id}/delete')
+def catalog_delete(catalog_id: int, request: Request, db: Session = Depends(get_db)):
+    """إيقاف التحليل (لا يُحذف لأن الطلبات القديمة تشير إليه)"""
+    user = require_admin(request)
+    updated = db.query(TestCatalog).filter(TestCatalog.id == catalog_id).update({"active": False})
+    db.commit()
+    if updated:
+        audit.record(user, "disable", "test_catalog", catalog_id)
+    return JSONResponse({"status": "disabled" if updated else "not_found"})
+
 # --- Order Management ---
-@app.get('/orders', response_class=HTMLResponse)
-def orders_page(
+@router.get('/orders', response_class=HTMLResponse)
+async def orders_page(
     request: Request,
     status: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         user = get_current_user(request)
         
-        query = db.query(TestOrder)
-        
-        if status == "pending":
-            query = query.filter(TestOrder.published == False)
-        elif status == "published":
-            query = query.filter(TestOrder.published == True)
-        elif status == "pending_approval":
-            query = query.filter(
-                TestOrder.result_file.isnot(None),
-                TestOrder.admin_approved == False
-            )
+        etag = page_etag(request, await get_table_versions_async(db))
+        if etag_matches(request, etag):
+            return not_modified(etag)
         
-        orders = query.order_by(TestOrder.created_at.desc()).all()
-        settings = get_or_create_settings(db)
+        # بيانات المريض (الهاتف) تُحمّل مسبقاً باستعلام واحد لأن الجلسة غير المتزامنة لا تسمح بالتحميل الكسول
+        query = select(TestOrder).options(selectinload(TestOrder.patient)).where(*order_status_criteria(status))
+        orders = (await db.execute(query.order_by(TestOrder.created_at.desc()))).scalars().all()
+        settings = await get_settings_async(db)
         
-        lang = get_language(request, db)
-        translations = get_translations(request, db)
+        lang = await get_language_async(request, db)
+        translations = translations_for(lang)
         
-        return templates.TemplateResponse("orders.html", {
+        return with_etag(templates.TemplateResponse("orders.html", {
             "request": request,
             "orders": orders,
             "status_filter": status,
@@ -1497,12 +3975,12 @@ def orders_page(
             "lang": lang,
             "dir": "rtl" if lang == "ar" else "ltr",
             "t": translations
-        })
+        }), etag)
     
     except HTTPException:
         return RedirectResponse("/login", status_code=303)
 
-@app.get('/add_order', response_class=HTMLResponse)
+@router.get('/add_order', response_class=HTMLResponse)
 def add_order_page(request: Request, db: Session = Depends(get_db)):
     try:
         user = get_current_user(request)
@@ -1520,18 +3998,20 @@ def add_order_page(request: Request, db: Session = Depends(get_db)):
     except HTTPException:
         return RedirectResponse("/login", status_code=303)
 
-@app.post('/add_order')
+@router.post('/add_order')
 def add_order(
     request: Request,
     name: str = Form(...),
     phone: str = Form(...),
-    test: str = Form(...),
-    price: int = Form(...),
+    # الزيارة قد تحتوي عدة تحاليل: كل تحليل سطر له test و price و catalog_id بنفس الترتيب
+    test: List[str] = Form(...),
+    price: List[int] = Form(...),
     # الخانات الجديدة التي أضفناها في HTML
     age: str = Form(None),
     gender: str = Form(None),
     address: str = Form(None),
     currency: str = Form("ج.م"),
+    catalog_id: List[str] = Form(None),
     db: Session = Depends(get_db)
 ):
     try:
@@ -1540,53 +4020,38 @@ def add_order(
         if not phone or not phone.strip():
             raise HTTPException(status_code=400, detail="رقم الهاتف مطلوب")
         
-        # نستخدم نفس الكلاس الخاص بك لبيانات الطلب
-        order_data = OrderCreate(name=name, phone=phone, test=test, price=price, currency=currency)
-        
-        # البحث بنفس طريقتك الأصلية (تطابق الاسم والهاتف)
-        patient = db.query(Patient).filter(
-            Patient.name == name, 
-            Patient.phone == phone
-        ).first()
-
-        if not patient:
-            # مريض جديد: ننشئ المريض مع كل البيانات الجديدة
-            patient = Patient(
-                name=name, 
-                phone=phone,
-                age=age,
-                gender=gender,
-                address=address
-            )
-            db.add(patient)
-            db.commit()
-            db.refresh(patient)
-        else:
-            # مريض موجود: نحدث تاريخ الزيارة والبيانات في حال إدخالها/تغييرها
-            patient.last_visit = datetime.now()
-            if age: patient.age = age
-            if gender: patient.gender = gender
-            if address: patient.address = address
-            db.commit()
+        # نستخدم نفس الكلاس الخاص بك لبيانات كل تحليل (مع catalog_id المختار له إن وُجد)
+        selected_ids = list(catalog_id or []) + [""] * len(test)
+        orders_data = [(OrderCreate(name=name, phone=phone, test=t, price=p, currency=currency), selected)
+                       for t, p, selected in zip(test, price, selected_ids) if t.strip()]
+        if not orders_data:
+            raise HTTPException(status_code=400, detail="اختر تحليلاً واحداً على الأقل")
         
-        # توليد PIN فريد كما في كودك الأصلي
-        pin = generate_secure_pin(order_data.phone)
-        while db.query(TestOrder).filter(TestOrder.pin == pin).first():
-            pin = generate_secure_pin(order_data.phone)
-        
-        # إنشاء الطلب
-        new_order = TestOrder(
-            patient_id=patient.id,
-            patient_name=patient.name,
-            test_name=order_data.test,
-            price=order_data.price,
-            currency=currency,
-            pin=pin
+        # المريض (جديد أو موجود بنفس الاسم والهاتف بعد التوحيد) والزيارة بكل تحاليلها في transaction واحدة:
+        # الـ upsert يحدث آخر زيارة والبيانات المدخلة، ويمنع تكرار المريض عند الإرسال المتزامن
+        patient = upsert_patient(
+            db, orders_data[0][0].name, phone.strip(),
+            age=int(age) if age and age.strip().isdigit() else None,
+            gender=gender or None, address=address or None
         )
-        db.add(new_order)
+        
+        # ربط كل تحليل بالكتالوج: الاختيار من القائمة، أو كتابة كود / اسم تحليل موجود كما هو
+        catalog = get_test_catalog(db)
+        lines = []
+        for order_data, selected in orders_data:
+            entry = (catalog.entries.get(int(selected)) if selected.isdigit() else None) or catalog.match(order_data.test)
+            lines.append({
+                "test_name": order_data.test,
+                "price": order_data.price,
+                "catalog_id": entry["id"] if entry else None
+            })
+        
+        visit = create_visit(db, patient, lines, phone=phone.strip(), currency=currency)
         db.commit()
+        audit.record(user, "create", "visit", visit.id, pin=visit.pin, patient_id=patient.id,
+                     tests=[[line["test_name"], line["price"]] for line in lines])
         
-        logger.info(f"Order created: {pin} for patient {patient.name}")
+        logger.info(f"Visit created: {visit.pin} with {len(lines)} tests for patient {patient.name}")
         
         return RedirectResponse('/orders', status_code=303)
     
@@ -1597,66 +4062,342 @@ def add_order(
         db.rollback()
         raise HTTPException(status_code=500, detail="حدث خطأ أثناء إضافة الطلب")
 
-@app.post('/upload_result/{order_id}')
-async def upload_result(order_id: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
+@router.post('/upload_result/{order_id}')
+async def upload_result(
+    order_id: int,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_async_db)
+):
     try:
-        order = db.query(TestOrder).filter(TestOrder.id == order_id).first()
+        order = (await db.execute(
+            select(TestOrder).options(selectinload(TestOrder.patient)).where(TestOrder.id == order_id)
+        )).scalar_one_or_none()
         if not order: 
             raise HTTPException(status_code=404)
         
         # التأكد من البيانات قبل الرفع
-        patient = db.query(Patient).filter(Patient.id == order.patient_id).first()
+        patient = order.patient
         if not patient.phone or not order.price or order.price <= 0:
             return RedirectResponse('/orders?error=missing_data', status_code=303)
 
-        # قراءة محتوى الملف
-        content = await file.read()
         file_ext = os.path.splitext(file.filename)[1].lower()
         safe_filename = f"{order.pin}_{datetime.now().strftime('%H%M%S')}{file_ext}"
         file_path = os.path.join(UPLOAD_DIR, safe_filename)
         
-        # حفظ الملف محلياً
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
-        
-        # --- إرسال النتيجة أونلاين إلى الرابط المحدد ---
+        # حفظ الملف محلياً (الكتابة على القرص خارج الـ event loop)
         try:
-            import requests
-            online_url = settings.publish_link if 'settings' in locals() else FAKE_PUBLISH_LINK
-            with open(file_path, "rb") as f:
-                response = requests.post(
-                    online_url, 
-                    data={
-                        "pin": order.pin, 
-                        "patient": order.patient_name, 
-                        "test": order.test_name,
-                        "phone": patient.phone, 
-                        "price": order.price,
-                        "currency": order.currency
-                    },
-                    files={"file": (safe_filename, f)},
-                    timeout=30
-                )
-                if response.status_code == 200:
-                    logger.info(f"Result sent online for order {order.pin}")
-                else:
-                    logger.warning(f"Online upload failed with status {response.status_code}")
-        except Exception as e:
-            logger.error(f"Error sending result online: {e}")
-        # --- نهاية الإرسال أونلاين ---
+            await run_in_threadpool(save_result_stream, file.file, file_path)
+        except ValueError:
+            return RedirectResponse('/orders?error=file_too_large', status_code=303)
 
         # تحديث حالة الطلب
-        order.result_file = file_path
-        order.published = False
-        order.admin_approved = False
-        db.commit()
+        await db.execute(order_transition("resulted").where(TestOrder.id == order.id).values(result_file=file_path))
+        await db.commit()
+        audit.record(request.session.get("user"), "upload_result", "order", order.id, pin=order.pin, file=file_path)
+        
+        # إرسال النتيجة أونلاين إلى الرابط المحدد في الإعدادات بعد الرد على المستخدم
+        settings = await get_settings_async(db)
+        background_tasks.add_task(publish_result_online, settings.publish_link, {
+            "file_path": file_path,
+            "pin": order.pin,
+            "patient": order.patient_name,
+            "test": order.test_name,
+            "phone": patient.phone,
+            "price": order.price,
+            "currency": order.currency
+        })
         
         return RedirectResponse('/orders', status_code=303)
     except Exception as e:
         logger.error(f"Upload error: {e}")
         return RedirectResponse('/orders', status_code=303)
 
-@app.post('/admin_approve_order/{order_id}')
+@router.post('/upload_visit_result/{visit_id}')
+async def upload_visit_result(
+    visit_id: int,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """رفع تقرير واحد لكل تحاليل الزيارة: الملف يُحفظ مرة واحدة ويُربط بكل التحاليل بأمر UPDATE واحد"""
+    try:
+        user = get_current_user(request)
+        visit = (await db.execute(
+            select(Visit).options(selectinload(Visit.patient), selectinload(Visit.orders)).where(Visit.id == visit_id)
+        )).scalar_one_or_none()
+        if not visit or not visit.orders:
+            raise HTTPException(status_code=404)
+        
+        # التأكد من البيانات قبل الرفع
+        if not visit.patient or not visit.patient.phone or any(not o.price or o.price <= 0 for o in visit.orders):
+            return RedirectResponse('/orders?error=missing_data', status_code=303)
+
+        file_ext = os.path.splitext(file.filename)[1].lower()
+        safe_filename = f"{visit.pin}_{datetime.now().strftime('%H%M%S')}{file_ext}"
+        file_path = os.path.join(UPLOAD_DIR, safe_filename)
+        
+        try:
+            await run_in_threadpool(save_result_stream, file.file, file_path)
+        except ValueError:
+            return RedirectResponse('/orders?error=file_too_large', status_code=303)
+
+        await db.execute(order_transition("resulted").where(TestOrder.visit_id == visit.id).values(result_file=file_path))
+        await db.commit()
+        audit.record(user, "upload_result", "visit", visit.id, pin=visit.pin, file=file_path)
+        
+        # الزيارة تُرسل أونلاين كنتيجة واحدة بـ PIN الزيارة
+        settings = await get_settings_async(db)
+        background_tasks.add_task(publish_result_online, settings.publish_link, {
+            "file_path": file_path,
+            "pin": visit.pin,
+            "patient": visit.patient_name,
+            "test": ", ".join(o.test_name for o in visit.orders),
+            "phone": visit.patient.phone,
+            "price": sum(o.price for o in visit.orders),
+            "currency": visit.orders[0].currency
+        })
+        
+        return RedirectResponse('/orders', status_code=303)
+    except HTTPException as he:
+        if he.status_code == 401:
+            return RedirectResponse("/login", status_code=303)
+        raise
+    except Exception as e:
+        logger.error(f"Visit upload error: {e}")
+        return RedirectResponse('/orders', status_code=303)
+
+@router.post('/generate_report/{order_id}')
+async def generate_report(
+    order_id: int,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """تقرير PDF من قيم الأجهزة لكل تحاليل الزيارة، يُربط بها كملف النتيجة مثل التقرير المرفوع"""
+    try:
+        user = get_current_user(request)
+        report = await order_report(db, order_id)
+        if report is None:
+            raise HTTPException(status_code=404)
+        orders, patient, content = report
+        if content is None:
+            return RedirectResponse('/orders?error=no_results', status_code=303)
+        if not patient.phone or any(not o.price or o.price <= 0 for o in orders):
+            return RedirectResponse('/orders?error=missing_data', status_code=303)
+
+        file_path = await render_report_cached(content)
+        # نفس القيم = نفس الملف: لا حاجة لإعادة الاعتماد والنشر
+        changed = [o.id for o in orders if o.result_file != file_path]
+        if changed:
+            await db.execute(order_transition("resulted").where(TestOrder.id.in_(changed)).values(result_file=file_path))
+            await db.commit()
+            audit.record(user, "generate_report", "order", order_id, pin=content["pin"], file=file_path)
+            settings = await get_settings_async(db)
+            background_tasks.add_task(publish_result_online, settings.publish_link, {
+                "file_path": file_path,
+                "pin": content["pin"],
+                "patient": patient.name,
+                "test": ", ".join(o.test_name for o in orders),
+                "phone": patient.phone,
+                "price": sum(o.price for o in orders),
+                "currency": orders[0].currency
+            })
+        return RedirectResponse('/orders', status_code=303)
+    except HTTPException as he:
+        if he.status_code == 401:
+            return RedirectResponse("/login", status_code=303)
+        raise
+    except Exception as e:
+        logger.error(f"Report generation error: {e}")
+        return RedirectResponse('/orders', status_code=303)
+
+@router.get('/report/{order_id}')
+async def view_report(order_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """معاينة / إعادة طباعة التقرير بالقيم الحالية (من النسخة المحفوظة إن لم تتغير القيم)"""
+    get_current_user(request)
+    report = await order_report(db, order_id)
+    if report is None or report[2] is None:
+        raise HTTPException(status_code=404, detail="لا توجد نتائج لهذا الطلب")
+    content = report[2]
+    return FileResponse(await render_report_cached(content), media_type="application/pdf",
+                        filename=f"{content['pin']}.pdf", content_disposition_type="inline")
+
+@router.get('/labels')
+async def print_labels(
+    request: Request,
+    visit_id: Optional[int] = None,
+    day: Optional[date] = None,
+    output: str = "pdf",
+    symbology: str = "code128",
+    copies: int = 1,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """ملصقات العينات دفعة واحدة: تحاليل الزيارة (visit_id) أو كل طلبات اليوم (day، افتراضياً اليوم)
+
+    output=pdf ملف جاهز للطباعة (صفحة لكل ملصق) أو zpl يُرسل لطابعة Zebra مباشرة.
+    """
+    get_current_user(request)
+    if output not in ("pdf", "zpl") or symbology not in LABEL_SYMBOLOGIES or not 1 <= copies <= LABEL_MAX_COPIES:
+        raise HTTPException(status_code=400, detail="إعدادات الملصقات غير صحيحة")
+    day = day or date.today()
+    rows = await label_orders(db, visit_id, day)
+    if not rows:
+        raise HTTPException(status_code=404, detail="لا توجد طلبات")
+    title = f"labels-{rows[0][0].split('-')[0]}" if visit_id is not None else f"labels-{day}"
+
+    if output == "zpl":
+        return Response(zpl_labels(rows, symbology, copies), media_type="text/plain",
+                        headers={"Content-Disposition": f'attachment; filename="{title}.zpl"'})
+    path = await render_report_cached({
+        "title": title,
+        "symbology": symbology,
+        "copies": copies,
+        "size": list(LABEL_SIZE_MM),
+        "labels": rows
+    }, "render_labels")
+    return FileResponse(path, media_type="application/pdf", filename=f"{title}.pdf", content_disposition_type="inline")
+
+@router.post('/bulk_upload_results')
+async def bulk_upload_results(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """رفع مجموعة نتائج دفعة واحدة (ملفات متعددة أو ملف ZIP) وربطها بالطلبات عن طريق الـ PIN في اسم الملف"""
+    user = get_current_user(request)
+
+    # تجهيز قائمة المدخلات: كل عنصر (اسم الملف، دالة لفتح المحتوى كـ stream)
+    entries = []
+    archives = []
+    for upload in files:
+        if upload.filename.lower().endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(upload.file)
+            except zipfile.BadZipFile:
+                entries.append((upload.filename, None, False))
+                continue
+            archives.append(archive)
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                entries.append((info.filename, lambda a=archive, i=info: a.open(i), True))
+        else:
+            entries.append((upload.filename, lambda u=upload: u.file, False))
+
+    # جلب كل الطلبات المطلوبة باستعلام واحد بدلاً من استعلام لكل ملف
+    # (ملف باسم PIN الزيارة يخص كل تحاليلها، وملف باسم PIN التحليل يخصه وحده)
+    pins = {extract_pin(name) for name, _, _ in entries} - {None}
+    orders_by_pin = {}
+    if pins:
+        orders_by_pin = {o.pin: [o] for o in (await db.execute(
+            select(TestOrder).options(selectinload(TestOrder.patient)).where(TestOrder.pin.in_(pins))
+        )).scalars().all()}
+        for order, visit_pin in (await db.execute(
+            select(TestOrder, Visit.pin).options(selectinload(TestOrder.patient)).join(Visit, TestOrder.visit_id == Visit.id)
+            .where(Visit.pin.in_(pins)).order_by(TestOrder.id)
+        )).all():
+            if orders_by_pin.get(visit_pin, [None])[0] is not order:
+                orders_by_pin.setdefault(visit_pin, []).append(order)
+
+    semaphore = asyncio.Semaphore(BULK_UPLOAD_CONCURRENCY)
+    claimed = set()
+
+    async def process(name, opener, owns_stream):
+        report = {"file": name, "pin": extract_pin(name), "order_id": None, "status": "saved"}
+        file_ext = os.path.splitext(name)[1].lower()
+        if opener is None:
+            report["status"] = "invalid_archive"
+        elif file_ext not in ALLOWED_EXTENSIONS:
+            report["status"] = "invalid_type"
+        elif not report["pin"]:
+            report["status"] = "no_pin"
+        elif report["pin"] not in orders_by_pin:
+            report["status"] = "order_not_found"
+        elif any(o.id in claimed for o in orders_by_pin[report["pin"]]):
+            report["status"] = "duplicate"
+        if report["status"] != "saved":
+            return report
+
+        lines = orders_by_pin[report["pin"]]
+        claimed.update(o.id for o in lines)
+        report["order_id"] = lines[0].id
+        if len(lines) > 1:
+            report["order_ids"] = [o.id for o in lines]
+        safe_filename = f"{report['pin']}_{datetime.now().strftime('%H%M%S')}{file_ext}"
+        file_path = os.path.join(UPLOAD_DIR, safe_filename)
+
+        async with semaphore:
+            def write():
+                source = opener()
+                try:
+                    return save_result_stream(source, file_path)
+                finally:
+                    if owns_stream:
+                        source.close()
+            try:
+                report["size"] = await run_in_threadpool(write)
+                report["file_path"] = file_path
+            except ValueError:
+                report["status"] = "too_large"
+            except Exception as e:
+                logger.error(f"Bulk upload error for {name}: {e}")
+                report["status"] = "error"
+        return report
+
+    try:
+        reports = await asyncio.gather(*(process(*entry) for entry in entries))
+    finally:
+        for archive in archives:
+            archive.close()
+
+    # بيانات النشر والسجل من الطلبات المحملة، ثم تحديث كل الطلبات بأمر UPDATE واحد (CASE id → ملف)
+    to_publish, files_by_id, audited = [], {}, []
+    for report in reports:
+        if report["status"] != "saved":
+            continue
+        lines = orders_by_pin[report["pin"]]
+        file_path = report.pop("file_path")
+        order = lines[0]
+        to_publish.append({
+            "file_path": file_path,
+            "pin": report["pin"],
+            "patient": order.patient_name,
+            "test": ", ".join(o.test_name for o in lines),
+            "phone": order.patient.phone if order.patient else None,
+            "price": sum(o.price for o in lines),
+            "currency": order.currency
+        })
+        for o in lines:
+            files_by_id[o.id] = file_path
+            audited.append((o.id, o.pin, file_path))
+    ids = list(files_by_id)
+    for start in range(0, len(ids), 900):
+        chunk = {i: files_by_id[i] for i in ids[start:start + 900]}
+        await db.execute(order_transition("resulted").where(TestOrder.id.in_(chunk)).values(
+            result_file=case(chunk, value=TestOrder.id)
+        ))
+    await db.commit()
+    for order_id, pin, file_path in audited:
+        audit.record(user, "upload_result", "order", order_id, pin=pin, file=file_path, bulk=True)
+
+    # الإرسال أونلاين يتم على دفعات في الخلفية بعد الرد على المستخدم
+    if to_publish:
+        settings = await get_settings_async(db)
+        background_tasks.add_task(publish_results_batch, settings.publish_link, to_publish)
+
+    logger.info(f"Bulk upload: {len(to_publish)}/{len(reports)} files matched to orders")
+    return JSONResponse({
+        "total": len(reports),
+        "saved": len(to_publish),
+        "failed": len(reports) - len(to_publish),
+        "files": reports
+    })
+
+@router.post('/admin_approve_order/{order_id}')
 def admin_approve_order(order_id: int, request: Request, db: Session = Depends(get_db)):
     user = request.session.get("user")
     if not user or user.get("role") != "admin":
@@ -1664,45 +4405,227 @@ def admin_approve_order(order_id: int, request: Request, db: Session = Depends(g
     
     order = db.query(TestOrder).filter(TestOrder.id == order_id).first()
     if order and order.result_file:
-        order.admin_approved = True
-        order.published = True
-        db.commit()
+        newly_published = order.status != "published"
+        # الإشعار فقط إذا سمح ORDER_TRANSITIONS بالانتقال فعلاً
+        if db.execute(order_transition("approved", "published").where(TestOrder.id == order.id)).rowcount:
+            if newly_published:
+                queue_result_notifications(db, [order.id])
+            db.commit()
+            notifier.wake()
+            audit.record(user, "approve", "order", order.id, pin=order.pin)
     return RedirectResponse('/orders', status_code=303)
 
-@app.post('/approve_result/{order_id}')
+@router.post('/approve_result/{order_id}')
 def approve_result(order_id: int, request: Request, db: Session = Depends(get_db)):
     try:
         user = require_admin(request)
         
         order = db.query(TestOrder).filter(TestOrder.id == order_id).first()
         if order and order.result_file:
-            order.admin_approved = True
-            order.published = True
-            db.commit()
-            logger.info(f"Result for order {order.pin} approved and published by admin")
+            newly_published = order.status != "published"
+            if db.execute(order_transition("approved", "published").where(TestOrder.id == order.id)).rowcount:
+                if newly_published:
+                    queue_result_notifications(db, [order.id])
+                db.commit()
+                notifier.wake()
+                audit.record(user, "approve", "order", order.id, pin=order.pin)
+                logger.info(f"Result for order {order.pin} approved and published by admin")
         
         return RedirectResponse('/orders', status_code=303)
     except HTTPException:
         return RedirectResponse("/login", status_code=303)
 
-@app.post('/republish_result/{order_id}')
+@router.post('/republish_result/{order_id}')
 def republish_result(order_id: int, request: Request, db: Session = Depends(get_db)):
     try:
         user = require_admin(request)
         
         order = db.query(TestOrder).filter(TestOrder.id == order_id).first()
         if order and order.result_file and os.path.exists(order.result_file):
-            order.published = True
-            order.admin_approved = True
+            db.execute(order_transition("approved", "published").where(TestOrder.id == order.id))
             db.commit()
+            audit.record(user, "republish", "order", order.id, pin=order.pin)
             logger.info(f"Result for order {order.pin} republished by admin")
         
         return RedirectResponse('/orders', status_code=303)
     except HTTPException:
         return RedirectResponse("/login", status_code=303)
 
+@router.post('/bulk_orders')
+def bulk_orders_action(
+    request: Request,
+    payload: BulkOrderAction,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
+    """موافقة / نشر / إعادة نشر مجموعة طلبات بأمر UPDATE واحد بدلاً من طلب لكل نتيجة"""
+    user = require_admin(request)
+
+    # فلتر فارغ ({}) أو بحالة غير معروفة يعني كل الطلبات: لازم شرط واحد على الأقل
+    filter_ = payload.filter
+    if not payload.ids and not (filter_ and (order_status_criteria(filter_.status) or filter_.start_date or filter_.end_date)):
+        raise HTTPException(status_code=400, detail="يجب تحديد أرقام الطلبات أو شروط التصفية")
+
+    criteria = [TestOrder.result_file.isnot(None)]
+    if payload.ids:
+        criteria.append(TestOrder.id.in_(payload.ids))
+    if payload.filter:
+        criteria.extend(order_status_criteria(payload.filter.status))
+        if payload.filter.start_date:
+            criteria.append(TestOrder.created_at >= datetime.combine(payload.filter.start_date, datetime.min.time()))
+        if payload.filter.end_date:
+            criteria.append(TestOrder.created_at <= datetime.combine(payload.filter.end_date, datetime.max.time()))
+    if payload.action == "approve":
+        criteria.append(TestOrder.status == "resulted")
+    elif payload.action == "publish":
+        criteria.append(TestOrder.status != "published")
+    else:
+        # إعادة النشر تحتاج أن يكون الملف موجوداً فعلاً على القرص (نفس شرط republish_result)
+        candidates = db.query(TestOrder.id, TestOrder.result_file).filter(*criteria).all()
+        existing_ids = [c.id for c in candidates if os.path.exists(c.result_file)]
+        criteria = [TestOrder.id.in_(existing_ids)]
+
+    try:
+        rows = db.execute(
+            order_transition("approved", "published")
+            .where(*criteria)
+            .returning(TestOrder.id, TestOrder.pin, TestOrder.patient_id, TestOrder.patient_name,
+                       TestOrder.test_name, TestOrder.price, TestOrder.currency, TestOrder.result_file,
+                       TestOrder.visit_id)
+        ).all()
+        if payload.action != "republish":
+            # الإشعار في نفس الـ transaction: لا يضيع إشعار لطلب اعتُمد ولا يُرسل لطلب لم يُعتمد
+            queue_result_notifications(db, [r.id for r in rows])
+        db.commit()
+        notifier.wake()
+    except Exception as e:
+        logger.error(f"Bulk {payload.action} error: {e}")
+        db.rollback()
+        raise HTTPException(status_code=500, detail="حدث خطأ أثناء تحديث الطلبات")
+
+    for r in rows:
+        audit.record(user, payload.action, "order", r.id, pin=r.pin, bulk=True)
+    if rows:
+        phones = dict(db.query(Patient.id, Patient.phone).filter(
+            Patient.id.in_({r.patient_id for r in rows})
+        ).all())
+        visit_pins = dict(db.query(Visit.id, Visit.pin).filter(
+            Visit.id.in_({r.visit_id for r in rows if r.visit_id})
+        ).all())
+        # تحاليل الزيارة تشترك في ملف واحد: يُنشر مرة واحدة بـ PIN الزيارة (مثل bulk_upload_results)
+        by_file = {}
+        for r in sorted(rows, key=lambda r: r.id):
+            by_file.setdefault(r.result_file, []).append(r)
+        settings = get_or_create_settings(db)
+        background_tasks.add_task(publish_results_batch, settings.publish_link, [{
+            "file_path": file_path,
+            "pin": visit_pins.get(lines[0].visit_id, lines[0].pin) if len(lines) > 1 else lines[0].pin,
+            "patient": lines[0].patient_name,
+            "test": ", ".join(r.test_name for r in lines),
+            "phone": phones.get(lines[0].patient_id),
+            "price": sum(r.price for r in lines),
+            "currency": lines[0].currency
+        } for file_path, lines in by_file.items()])
+
+    logger.info(f"Bulk {payload.action}: {len(rows)} orders updated by admin")
+    return JSONResponse({
+        "action": payload.action,
+        "updated": len(rows),
+        "ids": sorted(r.id for r in rows)
+    })
+
+# --- قائمة عمل الفنيين ---
+@router.get('/worklist', response_class=HTMLResponse)
+async def worklist_page(request: Request, status: str = "collected", db: AsyncSession = Depends(get_async_db)):
+    """قائمة عمل لكل حالة (الأقدم أولاً) مع مسح باركود الأنبوب لتسجيل استلام العينة"""
+    try:
+        user = get_current_user(request)
+        if status not in WORKLIST_STATUSES:
+            status = "collected"
+        # كل عدد من الفهرس الجزئي لحالته (بدون قراءة الطلبات المنشورة)
+        counts = {}
+        for name in WORKLIST_STATUSES:
+            counts[name] = (await db.execute(select(func.count()).where(TestOrder.status == name))).scalar()
+        orders = await worklist_orders(db, status)
+        lang = await get_language_async(request, db)
+        return templates.TemplateResponse("worklist.html", {
+            "request": request,
+            "orders": orders,
+            "status": status,
+            "counts": counts,
+            "entered": {o.id: status_entered_at(o) for o in orders},
+            "now": datetime.now(),
+            "user": user,
+            "lang": lang,
+            "dir": "rtl" if lang == "ar" else "ltr",
+            "t": translations_for(lang)
+        })
+    except HTTPException:
+        return RedirectResponse("/login", status_code=303)
+
+@router.get('/worklist/tat')
+def turnaround_metrics(
+    request: Request,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    test_name: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """زمن الإنجاز (بالدقائق) لكل مرحلة للطلبات المسجلة في الفترة (افتراضياً آخر 30 يوماً)"""
+    require_admin(request)
+    end_date = end_date or date.today()
+    start_date = start_date or end_date - timedelta(days=30)
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "test_name": test_name,
+        "minutes": turnaround_times(db, datetime.combine(start_date, datetime.min.time()),
+                                    datetime.combine(end_date, datetime.max.time()), test_name)
+    }
+
+@router.get('/worklist/{status}')
+async def worklist_api(
+    status: str,
+    request: Request,
+    after: Optional[datetime] = None,
+    after_id: int = 0,
+    limit: int = WORKLIST_PAGE_SIZE,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """طلبات حالة واحدة بصفحات (after / after_id من آخر سطر) لأجهزة الفنيين والشاشات"""
+    get_current_user(request)
+    if status not in WORKLIST_STATUSES:
+        raise HTTPException(status_code=404, detail="حالة غير موجودة")
+    now = datetime.now()
+    return [{
+        "id": o.id,
+        "pin": o.pin,
+        "patient_name": o.patient_name,
+        "test_name": o.test_name,
+        "created_at": o.created_at,
+        "status_at": status_entered_at(o),
+        "waiting_minutes": round((now - status_entered_at(o)).total_seconds() / 60, 1)
+    } for o in await worklist_orders(db, status, after, after_id, max(1, min(limit, WORKLIST_PAGE_SIZE)))]
+
+@router.post('/collect')
+async def collect_specimen(request: Request, pin: str = Form(...), db: AsyncSession = Depends(get_async_db)):
+    """استلام العينة بمسح باركود الأنبوب (PIN التحليل) أو الزيارة: الطلبات تنتقل من ordered إلى collected"""
+    user = get_current_user(request)
+    pin = pin.strip()
+    visit_lines = select(TestOrder.id).join(Visit, TestOrder.visit_id == Visit.id).where(Visit.pin == pin)
+    rows = (await db.execute(
+        order_transition("collected")
+        .where(or_(TestOrder.pin == pin, TestOrder.id.in_(visit_lines)))
+        .returning(TestOrder.id, TestOrder.pin)
+        .execution_options(synchronize_session=False)
+    )).all()
+    await db.commit()
+    for r in rows:
+        audit.record(user, "collect", "order", r.id, pin=r.pin)
+    return {"pin": pin, "collected": [r.pin for r in rows]}
+
 # --- Finance ---
-@app.get('/finance', response_class=HTMLResponse)
+@router.get('/finance', response_class=HTMLResponse)
 def finance_report(
     request: Request,
     start_date: Optional[str] = None,
@@ -1719,29 +4642,63 @@ def finance_report(
         if user.get("role") != "admin" and not settings.show_finance_to_users:
             raise HTTPException(status_code=403, detail="ليس لديك صلاحية للوصول للحسابات")
         
-        query = db.query(TestOrder)
-        
+        # نطاق التاريخ كشروط على created_at نفسه (وليس date(created_at)) حتى يُستخدم الفهرس
         if start_date:
             start = datetime.strptime(start_date, '%Y-%m-%d')
-            query = query.filter(TestOrder.created_at >= start)
         else:
-            query = query.filter(func.date(TestOrder.created_at) == date.today())
-        
+            start = datetime.combine(date.today(), datetime.min.time())
+        end = None
         if end_date:
             end = datetime.strptime(end_date, '%Y-%m-%d')
             end = end.replace(hour=23, minute=59, second=59)
-            query = query.filter(TestOrder.created_at <= end)
         
-        orders = query.all()
+        # الأرشيف يُقرأ فقط إذا بدأت الفترة قبل أحدث طلب فيه
+        newest_archived = archive_newest(db)
+        queries = []
+        for model in (TestOrder, ArchivedOrder) if newest_archived and start <= newest_archived else (TestOrder,):
+            query = db.query(model).filter(model.created_at >= start)
+            if end:
+                query = query.filter(model.created_at <= end)
+            queries.append((model, query))
+        
+        orders = sorted((o for _, query in queries for o in query.all()), key=lambda o: (o.created_at, o.id))
         total = sum(o.price for o in orders)
         
+        # الفاتورة هي الزيارة: تحاليل الزيارة الواحدة تُجمع في سطر واحد (الطلبات القديمة فاتورة لكل طلب)
+        invoices = {}
+        for o in orders:
+            invoice = invoices.setdefault(("visit", o.visit_id) if o.visit_id else ("order", o.id), {
+                "created_at": o.created_at, "patient_name": o.patient_name, "currency": o.currency, "tests": [], "total": 0
+            })
+            invoice["tests"].append(o.test_name)
+            invoice["total"] += o.price
+        
         lang = get_language(request, db)
         translations = get_translations(request, db)
         
+        # ملخص حسب التحليل: التجميع على catalog_id (رقم مفهرس) وليس على اسم التحليل المكتوب يدوياً
+        name_column = TestCatalog.name_en if lang == "en" else TestCatalog.name_ar
+        names = dict(db.query(TestCatalog.id, name_column).all())
+        grouped = {}
+        for model, query in queries:
+            for catalog_id, count, amount in query.with_entities(
+                model.catalog_id, func.count(model.id), func.coalesce(func.sum(model.price), 0)
+            ).group_by(model.catalog_id).all():
+                row = grouped.setdefault(catalog_id, [0, 0])
+                row[0] += count
+                row[1] += amount
+        by_test = [{
+            "name": names.get(catalog_id) or translations.get("other_tests", "-"),
+            "count": count,
+            "total": amount
+        } for catalog_id, (count, amount) in sorted(grouped.items(), key=lambda item: item[1][0], reverse=True)]
+        
         return templates.TemplateResponse("finance.html", {
             "request": request,
             "orders": orders,
+            "invoices": list(invoices.values()),
             "total": total,
+            "by_test": by_test,
             "start_date": start_date or date.today().strftime('%Y-%m-%d'),
             "end_date": end_date or "",
             "user": user,
@@ -1756,7 +4713,7 @@ def finance_report(
         raise
 
 # --- Settings & Admin ---
-@app.post('/update_permission')
+@router.post('/update_permission')
 def update_permission(
     request: Request,
     finance_access: Optional[str] = Form(None),
@@ -1769,6 +4726,9 @@ def update_permission(
         if staff:
             staff.can_view_finance = finance_access is not None
             db.commit()
+            audit.record(user, "permission", "user", staff.id, can_view_finance=staff.can_view_finance)
+            # الجلسات المفتوحة للموظف تحصل على الصلاحية الجديدة فوراً دون إعادة تسجيل الدخول
+            session_store.update_user(staff.id, can_view_finance=staff.can_view_finance)
             logger.info(f"Staff finance permission updated: {staff.can_view_finance}")
         
         return RedirectResponse("/", status_code=303)
@@ -1778,7 +4738,7 @@ def update_permission(
         logger.error(f"Update permission error: {e}")
         return RedirectResponse("/", status_code=303)
     
-@app.get('/settings', response_class=HTMLResponse)
+@router.get('/settings', response_class=HTMLResponse)
 def settings_page(request: Request, db: Session = Depends(get_db)):
     try:
         user = require_admin(request)
@@ -1800,7 +4760,7 @@ def settings_page(request: Request, db: Session = Depends(get_db)):
     except HTTPException:
         return RedirectResponse("/login", status_code=303)
 
-@app.post('/update_settings')
+@router.post('/update_settings')
 def update_settings(
     request: Request,
     publish_link: str = Form(...),
@@ -1815,10 +4775,10 @@ def update_settings(
         settings = get_or_create_settings(db)
         
         # حفظ البيانات الأساسية
-        settings.publish_link = publish_link
-        settings.lab_name = lab_name
-        settings.default_language = default_language
-        settings.show_language_to_users = (show_language == "on")
+        changes = audit_changes(
+            settings, publish_link=publish_link, lab_name=lab_name, default_language=default_language,
+            show_language_to_users=(show_language == "on")
+        )
         
         # القيمة القادمة من المتصفح (True إذا كانت مفعلة)
         is_checked = (finance_access == "on")
@@ -1828,7 +4788,7 @@ def update_settings(
         found_field = False
         for field in ['show_finance_to_users', 'can_view_finance', 'finance_access', 'show_finance']:
             if hasattr(settings, field):
-                setattr(settings, field, is_checked)
+                changes.update(audit_changes(settings, **{field: is_checked}))
                 found_field = True
                 break
         
@@ -1837,6 +4797,8 @@ def update_settings(
         
         settings.updated_at = datetime.now()
         db.commit()
+        if changes:
+            audit.record(user, "update", "settings", settings.id, changes=changes)
         
         if "user" in request.session:
             request.session["user"]["language"] = default_language
@@ -1846,8 +4808,161 @@ def update_settings(
         logger.error(f"خطأ الحفظ: {e}")
         return RedirectResponse("/settings", status_code=303)
     
+@router.post('/import_csv')
+async def import_csv(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...)
+):
+    """رفع ملف CSV من النظام القديم وتشغيل الاستيراد في الخلفية"""
+    require_admin(request)
+
+    file_path = os.path.join(IMPORT_DIR, f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{os.path.basename(file.filename)}")
+    await run_in_threadpool(save_result_stream, file.file, file_path, 2 * 1024 * 1024 * 1024)
+    background_tasks.add_task(import_csv_file, file_path)
+
+    logger.info(f"CSV import scheduled for {file_path}")
+    return JSONResponse({"status": "scheduled", "file": os.path.basename(file_path)})
+
+@router.get('/import_status')
+def import_status(request: Request, db: Session = Depends(get_db)):
+    require_admin(request)
+    jobs = db.query(ImportJob).order_by(ImportJob.id.desc()).limit(20).all()
+    return [{
+        "id": j.id,
+        "source": j.source,
+        "status": j.status,
+        "rows_done": j.rows_done,
+        "patients_created": j.patients_created,
+        "orders_created": j.orders_created,
+        "rows_skipped": j.rows_skipped,
+        "pins_remapped": j.pins_remapped,
+        "report": f"/import_report/{j.id}" if j.report_file and os.path.exists(j.report_file) else None,
+        "error": j.error,
+        "updated_at": j.updated_at.strftime('%Y-%m-%d %H:%M:%S') if j.updated_at else None
+    } for j in jobs]
+
+@router.get('/import_report/{job_id}')
+def import_report(job_id: int, request: Request, db: Session = Depends(get_db)):
+    """تقرير المهمة: الصفوف المرفوضة مع السبب وأرقام PIN القديمة التي تم استبدالها"""
+    require_admin(request)
+    job = db.query(ImportJob).filter(ImportJob.id == job_id).first()
+    if not job or not job.report_file or not os.path.exists(job.report_file):
+        raise HTTPException(status_code=404)
+    return FileResponse(job.report_file, media_type="text/csv", filename=os.path.basename(job.report_file))
+
+@router.get('/backups')
+def backups_list(request: Request):
+    require_admin(request)
+    return [{
+        "name": m["name"],
+        "created_at": m["created_at"],
+        "size": os.path.getsize(os.path.join(BACKUP_DIR, m["database"])),
+        "files": len(m.get("files", {})),
+        "seconds": m.get("seconds")
+    } for m in list_backups() if os.path.exists(os.path.join(BACKUP_DIR, m["database"]))]
+
+@router.post('/archive_now')
+def archive_now(request: Request, background_tasks: BackgroundTasks, days: int = ARCHIVE_AFTER_DAYS):
+    user = require_admin(request)
+    if archive_lock.locked():
+        return JSONResponse({"status": "running"}, status_code=409)
+    background_tasks.add_task(archive_old_orders, days)
+    audit.record(user, "archive", "orders", days=days)
+    return JSONResponse({"status": "scheduled", "days": days})
+
+@router.post('/backup_now')
+def backup_now(request: Request, background_tasks: BackgroundTasks):
+    user = require_admin(request)
+    if backup_lock.locked():
+        return JSONResponse({"status": "running"}, status_code=409)
+    background_tasks.add_task(run_backup)
+    audit.record(user, "backup", "database")
+    return JSONResponse({"status": "scheduled"})
+
+@router.get('/audit', response_class=HTMLResponse)
+def audit_page(
+    request: Request,
+    entity: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    username: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    before: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """سجل التدقيق حسب الكيان (مثلاً order و id) والمستخدم والفترة، على صفحات بالمفتاح (before = id)"""
+    try:
+        user = require_admin(request)
+        # ما كُتب للتو ولا يزال في ذاكرة الكاتب يظهر أيضاً
+        audit.flush()
+        
+        query = db.query(AuditEntry)
+        if entity:
+            query = query.filter(AuditEntry.entity == entity)
+            if entity_id:
+                query = query.filter(AuditEntry.entity_id == entity_id)
+        if username:
+            query = query.filter(AuditEntry.username == username)
+        if start_date:
+            query = query.filter(AuditEntry.at >= datetime.strptime(start_date, '%Y-%m-%d'))
+        if end_date:
+            query = query.filter(AuditEntry.at <= datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59))
+        if before:
+            query = query.filter(AuditEntry.id < before)
+        entries = query.order_by(AuditEntry.id.desc()).limit(AUDIT_PAGE_SIZE + 1).all()
+        next_before = None
+        if len(entries) > AUDIT_PAGE_SIZE:
+            entries = entries[:AUDIT_PAGE_SIZE]
+            next_before = entries[-1].id
+        
+        lang = get_language(request, db)
+        translations = get_translations(request, db)
+        
+        return templates.TemplateResponse("audit.html", {
+            "request": request,
+            "entries": entries,
+            "entities": AUDIT_ENTITIES,
+            "filters": {"entity": entity or "", "entity_id": entity_id or "", "username": username or "",
+                        "start_date": start_date or "", "end_date": end_date or ""},
+            "next_before": next_before,
+            "user": user,
+            "lang": lang,
+            "dir": "rtl" if lang == "ar" else "ltr",
+            "t": translations
+        })
+    except HTTPException as he:
+        if he.status_code in (401, 403):
+            return RedirectResponse("/login", status_code=303)
+        raise
+
+@router.get('/audit/verify')
+def audit_verify(request: Request):
+    require_admin(request)
+    audit.flush()
+    return verify_audit_chain()
+
+@router.get('/notifications')
+def notifications_status(request: Request, db: Session = Depends(get_db)):
+    """حالة طابور الإشعارات: العدد لكل مزود وحالة، وآخر الإشعارات التي فشلت نهائياً"""
+    require_admin(request)
+    counts = {}
+    for provider, status, count in db.query(
+        Notification.provider, Notification.status, func.count(Notification.id)
+    ).group_by(Notification.provider, Notification.status).all():
+        counts.setdefault(provider, {})[status] = count
+    failed = db.query(Notification).filter(Notification.status == "failed").order_by(Notification.id.desc()).limit(20).all()
+    return {
+        "provider": NOTIFY_PROVIDER or None,
+        "counts": counts,
+        "failed": [{
+            "id": n.id, "recipient": n.recipient, "order_id": n.order_id,
+            "attempts": n.attempts, "error": n.last_error, "created_at": n.created_at.isoformat()
+        } for n in failed]
+    }
+
 # --- Patient Portal (Public) ---
-@app.get('/update_portal_language')
+@router.get('/update_portal_language')
 def update_portal_language(request: Request, lang: str, redirect: str = "/online_results"):
     """
     تغيير اللغة للواجهة العامة (دون تسجيل دخول)
@@ -1858,7 +4973,7 @@ def update_portal_language(request: Request, lang: str, redirect: str = "/online
     # العودة للصفحة المطلوبة
     return RedirectResponse(redirect, status_code=303)
 
-@app.get('/online_results', response_class=HTMLResponse)
+@router.get('/online_results', response_class=HTMLResponse)
 def patient_portal(request: Request, db: Session = Depends(get_db)):
     settings = get_or_create_settings(db)
     
@@ -1868,7 +4983,7 @@ def patient_portal(request: Request, db: Session = Depends(get_db)):
     # الحصول على الترجمات
     lang = portal_lang
     dir = "rtl" if lang == "ar" else "ltr"
-    translations = TRANSLATIONS.get(lang, TRANSLATIONS["ar"])
+    translations = translations_for(lang)
     
     return templates.TemplateResponse("patient_portal.html", {
         "request": request,
@@ -1878,36 +4993,46 @@ def patient_portal(request: Request, db: Session = Depends(get_db)):
         "t": translations
     })
 
-@app.post('/check_online')
-def check_online(
+@router.post('/check_online')
+async def check_online(
     pin: str = Form(...), 
     extra_info: str = Form(...),  # استقبال القيمة الثانية (هاتف أو اسم) من المستخدم
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
+        pin = pin.strip()
+        # الـ PIN قد يكون لتحليل واحد أو لزيارة كاملة (كل تحاليلها المنشورة تظهر معاً)
+        visit_lines = select(TestOrder.id).join(Visit, TestOrder.visit_id == Visit.id).where(Visit.pin == pin)
+        
+        # البوابة تبحث في الطلبات الحالية فقط: ملفات نتائج الطلبات المؤرشفة حُذفت منذ زمن (RESULT_RETENTION_DAYS)
         # هنا نقوم بعملية استعلام معقدة (Join) تربط جدول الطلبات بجدول المرضى
         # لكي نتمكن من الوصول لرقم الهاتف الموجود في جدول المرضى
-        order = db.query(TestOrder).join(Patient).filter(
-            TestOrder.pin == pin.strip(),            # الشرط الأول: مطابقة الرقم السري
-            TestOrder.published == True,             # الشرط الثاني: أن تكون النتيجة منشورة
-            TestOrder.admin_approved == True,        # الشرط الثالث: أن تكون معتمدة من الإدارة
+        orders = (await db.execute(select(TestOrder).join(Patient).where(
+            or_(TestOrder.pin == pin, TestOrder.id.in_(visit_lines)),  # الشرط الأول: مطابقة الرقم السري
+            TestOrder.status == "published",         # الشرط الثاني: أن تكون النتيجة معتمدة ومنشورة
             
-            # الشرط الرابع (الميزة الجديدة): 
+            # الشرط الثالث (الميزة الجديدة): 
             # يجب أن تطابق القيمة المدخلة (extra_info) إما رقم الهاتف في جدول المرضى
             # أو اسم المريض المسجل في طلب التحليل
             or_(
                 Patient.phone == extra_info.strip(),
                 TestOrder.patient_name.like(f"{extra_info.strip()}%")
             )
-        ).first()
+        ).order_by(TestOrder.id))).scalars().all()
         
         # إذا تحقق كل ما سبق بنجاح
-        if order:
+        if orders:
+            # تحاليل الزيارة التي رُفع لها تقرير واحد تظهر كملف واحد
+            results = {}
+            for o in orders:
+                results.setdefault(o.result_file, []).append(o.test_name)
+            order = orders[0]
             return JSONResponse({
                 "status": "success",
                 "patient": order.patient_name,
-                "test": order.test_name,
+                "test": ", ".join(o.test_name for o in orders),
                 "file": f"/{order.result_file}",
+                "results": [{"test": ", ".join(tests), "file": f"/{path}"} for path, tests in results.items()],
                 "date": order.created_at.strftime('%Y-%m-%d'),
                 "currency": order.currency
             })
@@ -1926,7 +5051,7 @@ def check_online(
             "message": "حدث خطأ تقني أثناء معالجة طلبك"
         })
     
-@app.get('/my_settings', response_class=HTMLResponse)
+@router.get('/my_settings', response_class=HTMLResponse)
 def my_settings_page(request: Request, db: Session = Depends(get_db)):
     user_data = request.session.get("user")
     if not user_data:
@@ -1948,7 +5073,7 @@ def my_settings_page(request: Request, db: Session = Depends(get_db)):
         "t": translations
     })
 
-@app.post('/update_profile')
+@router.post('/update_profile')
 def update_profile(
     request: Request,
     new_username: str = Form(...),
@@ -1966,19 +5091,27 @@ def update_profile(
     if existing_user:
         return RedirectResponse("/my_settings?msg=username_taken", status_code=303)
 
+    old_username = user.username
     user.username = new_username
-    if new_password and len(new_password) >= 6:
+    password_changed = bool(new_password and len(new_password) >= 6)
+    if password_changed:
         user.password = hash_password(new_password)
     
     db.commit()
+    if old_username != new_username or password_changed:
+        audit.record(user_data, "update_profile", "user", user.id,
+                     username=[old_username, new_username], password_changed=password_changed)
     
-    # تحديث بيانات الجلسة بالاسم الجديد
+    # تحديث بيانات الجلسة بالاسم الجديد (وكل الجلسات الأخرى للمستخدم)، وتغيير كلمة المرور يلغي الجلسات الأخرى
     request.session["user"]["username"] = new_username
+    if password_changed:
+        session_store.delete_user(user.id, keep=request.scope.get("session_id"))
+    session_store.update_user(user.id, username=new_username)
     
     return RedirectResponse("/my_settings?msg=success", status_code=303)
 
 # --- تغيير اللغة ---
-@app.post('/update_language')
+@router.post('/update_language')
 def update_language(
     request: Request, 
     lang: str = Form(...), 
@@ -2003,6 +5136,7 @@ def update_language(
                 
                 # تحديث الجلسة فوراً لتعكس اللغة الجديدة
                 request.session["user"]["language"] = lang
+                session_store.update_user(user.id, language=lang)
                 logger.info(f"Language updated to {lang} for user {user.username}")
         
         # العودة للصفحة السابقة
@@ -2015,47 +5149,85 @@ def update_language(
 
 # --- إدارة الطلبات (تعديل وحذف) ---
 
-@app.get("/edit_order/{order_id}")
-async def edit_order_form(request: Request, order_id: int, db: Session = Depends(get_db)):
-    order = db.query(TestOrder).filter(TestOrder.id == order_id).first()
+@router.get("/edit_order/{order_id}")
+async def edit_order_form(request: Request, order_id: int, db: AsyncSession = Depends(get_async_db)):
+    order = await db.get(TestOrder, order_id)
     if not order:
         return RedirectResponse(url="/orders", status_code=303)
-    lang = get_language(request, db)
-    translations = get_translations(request, db)
+    lang = await get_language_async(request, db)
+    translations = translations_for(lang)
     return templates.TemplateResponse("edit_order.html", {
         "request": request, "order": order, "t": translations,
         "lang": lang, "dir": "rtl" if lang == "ar" else "ltr"
     })
 
-@app.post("/edit_order/{order_id}")
+@router.post("/edit_order/{order_id}")
 async def update_order(
     order_id: int, request: Request, # أضفنا request هنا للأمان
     test_name: str = Form(...), price: float = Form(...), 
-    pin: str = Form(...), db: Session = Depends(get_db)
+    pin: str = Form(...), db: AsyncSession = Depends(get_async_db)
 ):
-    require_admin(request) # حماية التعديل
-    order = db.query(TestOrder).filter(TestOrder.id == order_id).first()
+    user = require_admin(request) # حماية التعديل
+    order = await db.get(TestOrder, order_id)
     if order:
-        order.test_name, order.price, order.pin = test_name, price, pin
-        db.commit()
+        changes = audit_changes(order, test_name=test_name, price=price, pin=pin)
+        await db.commit()
+        if changes:
+            audit.record(user, "update", "order", order_id, changes=changes)
     return RedirectResponse(url="/orders", status_code=303)
 
-@app.post('/delete_order/{order_id}')
-def delete_order(order_id: int, request: Request, db: Session = Depends(get_db)):
+@router.post('/delete_order/{order_id}')
+def delete_order(order_id: int, request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     try:
-        require_admin(request)
-        order = db.query(TestOrder).filter(TestOrder.id == order_id).first()
-        if order:
-            # حذف الملف الفيزيائي أولاً
-            if order.result_file and os.path.exists(order.result_file):
-                try: os.remove(order.result_file)
-                except: pass
-            db.delete(order)
-            db.commit()
-            logger.info(f"Order {order_id} deleted with its file")
+        user = require_admin(request)
+        # الملف الفيزيائي يُحذف في الخلفية من طابور الحذف بعد الرد
+        deleted = db.execute(delete(TestOrder).where(TestOrder.id == order_id).returning(
+            TestOrder.pin, TestOrder.patient_name, TestOrder.test_name, TestOrder.price
+        )).first()
+        db.commit()
+        if deleted:
+            background_tasks.add_task(process_file_deletions)
+            audit.record(user, "delete", "order", order_id, pin=deleted.pin, patient=deleted.patient_name,
+                         test=deleted.test_name, price=deleted.price)
+            logger.info(f"Order {order_id} deleted, result file queued for removal")
         return RedirectResponse('/orders', status_code=303)
     except HTTPException:
         return RedirectResponse("/login", status_code=303)
+
+# --- App Factory ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(startup)
+    audit.start()
+    await notifier.start()
+    if ANALYZER_PORT:
+        await analyzer_listener.start()
+    start_scheduler()
+    yield
+    stop_scheduler()
+    await analyzer_listener.stop()
+    await notifier.stop()
+    stop_report_pool()
+    await run_in_threadpool(audit.stop)
+    await async_engine.dispose()
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="Laboratory Management System", lifespan=lifespan)
+    app.add_middleware(ServerSessionMiddleware, store=session_store, https_only=os.getenv("SESSION_HTTPS_ONLY") == "1")
+    app.add_middleware(CompressionMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    # check_dir=False: المجلدات تُنشأ في lifespan قبل أول طلب
+    # الشعار من مجلد البيانات، وباقي الملفات الثابتة من مجلد البرنامج (نفس المجلد عند التشغيل من المصدر)
+    app.mount("/static/images", StaticFiles(directory=LOGO_DIR, check_dir=False), name="images")
+    app.mount("/static", StaticFiles(directory=STATIC_DIR, check_dir=False), name="static")
+    app.mount("/results_files", StaticFiles(directory=UPLOAD_DIR, check_dir=False), name="results_files")
+    # نفس كائنات المسارات (include_router يعيد بناء كل مسار وتحليل معاملاته من جديد ~80ms)
+    app.router.routes.extend(router.routes)
+    return app
+
+# uvicorn lab_app:app
+app = create_app()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
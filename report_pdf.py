@@ -0,0 +1,285 @@
+"""رسم تقرير النتائج وملصقات العينات PDF (يعمل داخل عمليات ProcessPoolExecutor التي يديرها lab_app)
+
+لا يستورد lab_app ولا قاعدة البيانات: كل ما يحتاجه التقرير يصل في content، فعملية الرسم تبدأ بسرعة،
+والخط والأنماط والشعار والباركود وتشكيل النصوص العربية تُجهز مرة واحدة في كل عملية وتبقى للتقارير التالية.
+"""
+import os
+import re
+import sys
+from functools import lru_cache
+
+ARABIC = re.compile(r"[\u0600-\u06FF\u0750-\u077F\uFB50-\uFDFF\uFE70-\uFEFF]")
+PAGE_MARGIN = 36
+FLAG_COLOR = "#dc3545"
+HEADER_COLOR = "#667eea"
+
+# أول خط موجود يدعم الحروف العربية (REPORT_FONT يحدد خطاً آخر)
+FONT_CANDIDATES = [
+    os.getenv("REPORT_FONT", ""),
+    os.path.join(getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__))),
+                 "static", "fonts", "NotoNaskhArabic-Regular.ttf"),
+    "/usr/share/fonts/truetype/noto/NotoNaskhArabic-Regular.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSansArabic-Regular.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "C:/Windows/Fonts/tahoma.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+]
+
+
+@lru_cache(maxsize=1)
+def report_font() -> str:
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    for path in FONT_CANDIDATES:
+        if path and os.path.exists(path):
+            pdfmetrics.registerFont(TTFont("ReportFont", path))
+            return "ReportFont"
+    # بدون خط عربي تظهر الحروف العربية مربعات فارغة
+    return "Helvetica"
+
+
+@lru_cache(maxsize=8192)
+def shape(text) -> str:
+    """تشكيل الحروف العربية وترتيبها من اليمين لليسار (أسماء التحاليل والعناوين تتكرر فتُحسب مرة واحدة)"""
+    text = "" if text is None else str(text)
+    if not ARABIC.search(text):
+        return text
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+
+    return get_display(arabic_reshaper.reshape(text))
+
+
+@lru_cache(maxsize=2)
+def layout(lang: str) -> dict:
+    """أنماط الفقرات والجداول لكل لغة (تُبنى مرة في كل عملية)"""
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.platypus import TableStyle
+
+    font = report_font()
+    rtl = lang == "ar"
+    align = TA_RIGHT if rtl else TA_LEFT
+    width = A4[0] - 2 * PAGE_MARGIN
+    # عمود التحليل يكون يميناً في العربي: ترتيب الأعمدة يُعكس
+    widths = [width * 0.34, width * 0.18, width * 0.16, width * 0.22, width * 0.10]
+    return {
+        "rtl": rtl,
+        "font": font,
+        "page": A4,
+        "widths": widths[::-1] if rtl else widths,
+        "title": ParagraphStyle("title", fontName=font, fontSize=16, leading=22, alignment=TA_CENTER),
+        "heading": ParagraphStyle("heading", fontName=font, fontSize=12, leading=18, alignment=align,
+                                  textColor=colors.HexColor(HEADER_COLOR), spaceBefore=10, spaceAfter=4),
+        "small": ParagraphStyle("small", fontName=font, fontSize=8, leading=11, alignment=TA_CENTER,
+                                textColor=colors.grey),
+        "info": TableStyle([
+            ("FONTNAME", (0, 0), (-1, -1), font),
+            ("FONTSIZE", (0, 0), (-1, -1), 10),
+            ("ALIGN", (0, 0), (-1, -1), "RIGHT" if rtl else "LEFT"),
+            ("BOX", (0, 0), (-1, -1), 0.5, colors.lightgrey),
+            ("BACKGROUND", (0, 0), (-1, -1), colors.HexColor("#f8f9fa")),
+        ]),
+        "results": TableStyle([
+            ("FONTNAME", (0, 0), (-1, -1), font),
+            ("FONTSIZE", (0, 0), (-1, -1), 10),
+            ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#e9ecef")),
+            ("LINEBELOW", (0, 0), (-1, -1), 0.25, colors.lightgrey),
+            ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#fbfbfd")]),
+        ]),
+    }
+
+
+@lru_cache(maxsize=8)
+def logo(path: str, mtime: float):
+    """الشعار مقروء ومضغوط مرة واحدة (mtime في المفتاح: تغيير الشعار يقرأه من جديد)"""
+    from reportlab.lib.utils import ImageReader
+
+    return ImageReader(path)
+
+
+def render_report(content: dict, out_path: str) -> str:
+    """رسم التقرير إلى out_path (كتابة لملف مؤقت ثم استبدال: لا يقرأ أحد ملفاً ناقصاً)"""
+    from reportlab.lib import colors
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
+
+    style = layout(content["lang"])
+    labels = content["labels"]
+    rtl = style["rtl"]
+
+    def row(cells):
+        return cells[::-1] if rtl else cells
+
+    story = [Paragraph(shape(content["lab_name"]), style["title"]), Spacer(1, 8)]
+    patient = content["patient"]
+    # العنوان والقيمة يُشكلان معاً حتى يرتبهما bidi في الاتجاه الصحيح
+    info = [
+        row([shape(f"{labels['patient_name']}: {patient['name']}"), shape(f"{labels['pin']}: {content['pin']}")]),
+        row([shape(f"{labels['age']}: {patient['age'] or '---'}"), shape(f"{labels['date']}: {content['date']}")]),
+    ]
+    info_table = Table(info, colWidths=[sum(style["widths"]) / 2] * 2)
+    info_table.setStyle(style["info"])
+    story += [info_table, Spacer(1, 6)]
+
+    header = row([shape(labels[key]) for key in ("analyte", "result", "units", "reference_range", "result_flag")])
+    for test in content["tests"]:
+        story.append(Paragraph(shape(test["name"]), style["heading"]))
+        rows = [header]
+        flagged = []
+        for i, (analyte, value, units, reference, flag) in enumerate(test["rows"], 1):
+            rows.append(row([shape(analyte), shape(value), shape(units), shape(reference), flag or ""]))
+            if flag:
+                flagged.append(i)
+        table = Table(rows, colWidths=style["widths"], repeatRows=1)
+        table.setStyle(style["results"])
+        if flagged:
+            table.setStyle([("TEXTCOLOR", (0, i), (-1, i), colors.HexColor(FLAG_COLOR)) for i in flagged])
+        story.append(table)
+
+    story += [Spacer(1, 16), Paragraph(shape(labels["report_footer"]), style["small"])]
+
+    def draw_page(canvas, doc):
+        canvas.saveState()
+        if content.get("logo"):
+            width, height = style["page"]
+            x = width - PAGE_MARGIN - 60 if rtl else PAGE_MARGIN
+            canvas.drawImage(logo(*content["logo"]), x, height - PAGE_MARGIN - 40, width=60, height=40,
+                             preserveAspectRatio=True, mask="auto")
+        canvas.setFont(style["font"], 8)
+        canvas.drawCentredString(style["page"][0] / 2, PAGE_MARGIN / 2, f"{doc.page}")
+        canvas.restoreState()
+
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    doc = SimpleDocTemplate(tmp_path, pagesize=style["page"], leftMargin=PAGE_MARGIN, rightMargin=PAGE_MARGIN,
+                            topMargin=PAGE_MARGIN + 40, bottomMargin=PAGE_MARGIN, title=content["pin"],
+                            author=content["lab_name"])
+    doc.build(story, onFirstPage=draw_page, onLaterPages=draw_page)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+@lru_cache(maxsize=4096)
+def barcode(symbology: str, value: str) -> tuple:
+    """ترميز الباركود مرة واحدة لكل قيمة: (عدد الوحدات عرضاً، ارتفاعاً، المستطيلات السوداء بوحدة الـ module)
+
+    خطوط Code128 أو صفوف QR (كل مجموعة مربعات متجاورة مستطيل واحد) تُرسم بعدها كمسار واحد
+    بدلاً من مئات الأشكال في reportlab.graphics.
+    """
+    rects = []
+    if symbology == "qr":
+        from reportlab.graphics.barcode import qrencoder
+
+        qr = qrencoder.QRCode(None, qrencoder.QRErrorCorrectLevel.M)
+        qr.addData(value)
+        qr.make()
+        count = qr.getModuleCount()
+        for row in range(count):
+            col = 0
+            while col < count:
+                start = col
+                while col < count and qr.isDark(row, col):
+                    col += 1
+                if col > start:
+                    rects.append((start, count - row - 1, col - start, 1))
+                col += 1
+        return count, count, tuple(rects)
+
+    from reportlab.graphics.barcode.code128 import Code128
+
+    code = Code128(value, quiet=0)
+    code.validate()
+    code.encode()
+    code.decompose()
+    # حرف كبير = خط وحرف صغير = فراغ، وترتيبه في الأبجدية عرضه بالوحدات
+    x = 0
+    for c in code.decomposed:
+        width = ord(c.lower()) - ord("a") + 1
+        if c.isupper():
+            rects.append((x, 0, width, 1))
+        x += width
+    return x, 1, tuple(rects)
+
+
+def draw_barcode(canvas, symbology: str, value: str, x: float, y: float, width: float, height: float):
+    modules_x, modules_y, rects = barcode(symbology, value)
+    scale_x, scale_y = width / modules_x, height / modules_y
+    path = canvas.beginPath()
+    for rx, ry, rw, rh in rects:
+        path.rect(x + rx * scale_x, y + ry * scale_y, rw * scale_x, rh * scale_y)
+    canvas.drawPath(path, stroke=0, fill=1)
+
+
+def fit(text: str, font: str, size: float, width: float) -> str:
+    """قص النص ليتسع في عرض الملصق (أسماء المرضى والتحاليل الطويلة)"""
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    text = shape(text)
+    while text and stringWidth(text, font, size) > width:
+        text = text[1:] if ARABIC.search(text) else text[:-1]
+    return text
+
+
+def render_labels(content: dict, out_path: str) -> str:
+    """ملصقات العينات: صفحة لكل ملصق بمقاس الملصق نفسه (طابعات الملصقات تطبع كل صفحة على ملصق)
+
+    كل ملصق يُرسم مرة واحدة كـ Form XObject ويُكرر في النسخ (أكثر من أنبوب لنفس التحليل)،
+    فلا يزيد حجم الملف ولا وقت الرسم مع عدد النسخ.
+    """
+    from reportlab.lib.units import mm
+    from reportlab.pdfgen.canvas import Canvas
+
+    width, height = content["size"][0] * mm, content["size"][1] * mm
+    margin = 1.5 * mm
+    font = report_font()
+    qr = content["symbology"] == "qr"
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    canvas = Canvas(tmp_path, pagesize=(width, height), pageCompression=1)
+    canvas.setTitle(content["title"])
+
+    for i, (pin, name, test, day) in enumerate(content["labels"]):
+        form = f"label{i}"
+        canvas.beginForm(form)
+        if qr:
+            # QR يساراً بارتفاع الملصق والنصوص بجانبه
+            side = height - 2 * margin
+            draw_barcode(canvas, "qr", pin, margin, margin, side, side)
+            x, text_width = side + 2 * margin, width - side - 3 * margin
+            lines = [(name, font, 7), (pin, "Helvetica-Bold", 9), (test, font, 6), (day, "Helvetica", 6)]
+            y = height - margin - 7
+            for text, line_font, size in lines:
+                canvas.setFont(line_font, size)
+                canvas.drawString(x, y, fit(text, line_font, size, text_width))
+                y -= size + 2.5
+        else:
+            text_width = width - 2 * margin
+            canvas.setFont(font, 7)
+            name = fit(name, font, 7, text_width)
+            if ARABIC.search(name):
+                canvas.drawRightString(width - margin, height - margin - 6, name)
+            else:
+                canvas.drawString(margin, height - margin - 6, name)
+            bar_height = height * 0.42
+            draw_barcode(canvas, "code128", pin, margin, height - margin - 9 - bar_height, text_width, bar_height)
+            canvas.setFont("Helvetica-Bold", 8)
+            canvas.drawCentredString(width / 2, margin + 7, pin)
+            canvas.setFont(font, 6)
+            canvas.drawCentredString(width / 2, margin, fit(f"{test}  {day}", font, 6, text_width))
+        canvas.endForm()
+        for _ in range(content["copies"]):
+            canvas.doForm(form)
+            canvas.showPage()
+
+    canvas.save()
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def warm_up():
+    """مُهيئ عمليات الرسم: تحميل reportlab وتسجيل الخط قبل أول تقرير"""
+    layout("ar")
+    layout("en")
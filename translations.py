@@ -0,0 +1,953 @@
+"""نصوص الواجهة بالعربية والإنجليزية (تُحمّل عند عرض أول صفحة، انظر translations_for في lab_app)"""
+
+TRANSLATIONS = {
+    "ar": {
+        "dashboard": "لوحة التحكم",
+        "patients": "المرضى",
+        "orders": "الطلبات",
+        "finance": "المالية",
+        "settings": "الإعدادات",
+        "logout": "تسجيل الخروج",
+        "add_order": "إضافة طلب",
+        "search": "بحث",
+        "name": "الاسم",
+        "phone": "الهاتف",
+        "test": "التحليل",
+        "price": "السعر",
+        "actions": "الإجراءات",
+        "pending": "قيد الانتظار",
+        "published": "منشور",
+        "view": "عرض",
+        "edit": "تعديل",
+        "delete": "حذف",
+        "upload_result": "رفع النتيجة",
+        "approve": "موافقة",
+        "welcome": "مرحباً",
+        "today_orders": "طلبات اليوم",
+        "Register New Patient": "إضافة مريض جديد",
+        "pending_results": "نتائج بانتظار النشر",
+        "patient_count": "عدد المرضى",
+        "order_count": "عدد الطلبات",
+        "login": "تسجيل الدخول",
+        "username": "اسم المستخدم",
+        "password": "كلمة المرور",
+        "submit": "إرسال",
+        "back": "رجوع",
+        "save": "حفظ",
+        "cancel": "إلغاء",
+        "error": "خطأ",
+        "success": "تم بنجاح",
+        "loading": "جاري التحميل...",
+        "no_data": "لا توجد بيانات",
+        "all_rights_reserved": "جميع الحقوق محفوظة",
+        "search_patient": "بحث عن مريض...",
+        "add_new_order": "إضافة طلب جديد",
+        "patient_name": "اسم المريض",
+        "patient_phone": "رقم الهاتف",
+        "test_name": "اسم التحليل",
+        "test_price": "سعر التحليل",
+        "currency": "ج.م",
+        "create_order": "إنشاء الطلب",
+        "order_id": "رقم الطلب",
+        "result": "النتيجة",
+        "status": "الحالة",
+        "date": "التاريخ",
+        "options": "خيارات",
+        "download": "تحميل",
+        "approve_result": "الموافقة على النتيجة",
+        "republish": "إعادة النشر",
+        "lock": "قفل",
+        "unlock": "فتح",
+        "total": "الإجمالي",
+        "report": "تقرير مالي",
+        "from_date": "من تاريخ",
+        "to_date": "إلى تاريخ",
+        "generate_report": "إنشاء التقرير",
+        "profile": "الملف الشخصي",
+        "change_password": "تغيير كلمة المرور",
+        "current_password": "كلمة المرور الحالية",
+        "new_password": "كلمة المرور الجديدة",
+        "confirm_password": "تأكيد كلمة المرور",
+        "update": "تحديث",
+        "online_results": "النتائج أونلاين",
+        "enter_pin": "أدخل رقم PIN",
+        "check_result": "التحقق من النتيجة",
+        "result_not_found": "النتيجة غير موجودة أو لم يتم نشرها بعد",
+        "search_error": "حدث خطأ أثناء البحث",
+        "lab_name": "اسم المختبر",
+        "publish_link": "رابط النشر",
+        "default_language": "اللغة الافتراضية",
+        "show_language": "إظهار خيار اللغة للمستخدمين",
+        "update_settings": "تحديث الإعدادات",
+        "admin": "مدير",
+        "employee": "موظف",
+        "view_finance": "عرض المالية",
+        "update_permissions": "تحديث الصلاحيات",
+        "patient_history": "سجل المريض",
+        "age": "العمر",
+        "gender": "الجنس",
+        "address": "العنوان",
+        "notes": "ملاحظات",
+        "last_visit": "آخر زيارة",
+        "edit_patient": "تعديل بيانات المريض",
+        "delete_patient": "حذف المريض",
+        "confirm_delete": "هل أنت متأكد من الحذف؟",
+        "yes": "نعم",
+        "no": "لا",
+        "order_details": "تفاصيل الطلب",
+        "patient_info": "معلومات المريض",
+        "test_info": "معلومات التحليل",
+        "financial_info": "معلومات مالية",
+        "pin": "رقم PIN",
+        "created_at": "تاريخ الإنشاء",
+        "upload_file": "رفع ملف",
+        "choose_file": "اختر ملف",
+        "file_size_limit": "الحد الأقصى 10 ميجابايت",
+        "allowed_formats": "الصيغ المسموحة: PDF, JPG, PNG, DOC, DOCX",
+        "upload": "رفع",
+        "pending_approval": "بانتظار الموافقة",
+        "approved": "تمت الموافقة",
+        "rejected": "مرفوض",
+        "all": "الكل",
+        "filter": "تصفية",
+        "clear_filter": "مسح التصفية",
+        "export": "تصدير",
+        "Cancel and Go Back": "إلغاء والعودة",
+        "Save Data": "حفظ البيانات",
+        "print": "طباعة",
+        "refresh": "تحديث",
+        "home": "الرئيسية",
+        "about": "حول",
+        "contact": "اتصل بنا",
+        "privacy": "الخصوصية",
+        "terms": "الشروط",
+        "help": "المساعدة",
+        "language": "اللغة",
+        "arabic": "العربية",
+        "english": "الإنجليزية",
+        "change_language": "تغيير اللغة",
+        "theme": "المظهر",
+        "dark": "داكن",
+        "light": "فاتح",
+        "system": "النظام",
+        "notifications": "الإشعارات",
+        "mark_all_read": "تحديد الكل كمقروء",
+        "view_all": "عرض الكل",
+        "messages": "الرسائل",
+        "tasks": "المهام",
+        "calendar": "التقويم",
+        "reports": "التقارير",
+        "analytics": "التحليلات",
+        "users": "المستخدمين",
+        "roles": "الأدوار",
+        "permissions": "الصلاحيات",
+        "logs": "السجلات",
+        "backup": "النسخ الاحتياطي",
+        "maintenance": "الصيانة",
+        "version": "الإصدار",
+        "check_updates": "التحقق من التحديثات",
+        "documentation": "التوثيق",
+        "support": "الدعم",
+        "feedback": "التقييم",
+        "logout_confirm": "هل أنت متأكد من تسجيل الخروج؟",
+        "session_expired": "انتهت الجلسة، يرجى تسجيل الدخول مرة أخرى",
+        "server_error": "خطأ في الخادم",
+        "not_found": "غير موجود",
+        "forbidden": "غير مسموح",
+        "unauthorized": "غير مصرح",
+        "bad_request": "طلب خاطئ",
+        "timeout": "انتهت المهلة",
+        "network_error": "خطأ في الشبكة",
+        "try_again": "حاول مرة أخرى",
+        "contact_admin": "اتصل بالمدير",
+        "go_back": "العودة",
+        "continue": "المتابعة",
+        "close": "إغلاق",
+        "minimize": "تصغير",
+        "maximize": "تكبير",
+        "fullscreen": "ملء الشاشة",
+        "exit_fullscreen": "الخروج من ملء الشاشة",
+        "zoom_in": "تكبير",
+        "zoom_out": "تصغير",
+        "reset_zoom": "إعادة تعيين التكبير",
+        "rotate": "تدوير",
+        "crop": "قص",
+        "undo": "تراجع",
+        "redo": "إعادة",
+        "cut": "قص",
+        "copy": "نسخ",
+        "paste": "لصق",
+        "select_all": "تحديد الكل",
+        "find": "بحث",
+        "replace": "استبدال",
+        "save_changes": "حفظ التغييرات",
+        "discard_changes": "تجاهل التغييرات",
+        "preview": "معاينة",
+        "publish": "نشر",
+        "unpublish": "إلغاء النشر",
+        "archive": "أرشفة",
+        "restore": "استعادة",
+        "trash": "سلة المحذوفات",
+        "empty_trash": "تفريغ سلة المحذوفات",
+        "permanent_delete": "حذف نهائي",
+        "move_to": "نقل إلى",
+        "copy_to": "نسخ إلى",
+        "male": "ذكر",
+        "female": "أنثى",
+        "rename": "إعادة تسمية",
+        "duplicate": "نسخ",
+        "share": "مشاركة",
+        "embed": "تضمين",
+        "export_as": "تصدير كـ",
+        "import": "استيراد",
+        "sync": "مزامنة",
+        "validate": "تحقق",
+        "optimize": "تحسين",
+        "compress": "ضغط",
+        "extract": "استخراج",
+        "encrypt": "تشفير",
+        "decrypt": "فك التشفير",
+        "sign": "توقيع",
+        "verify": "تحقق",
+        "scan": "مسح",
+        "clean": "تنظيف",
+        "update_available": "تحديث متاح",
+        "install_update": "تثبيت التحديث",
+        "restart_required": "يتطلب إعادة التشغيل",
+        "changelog": "سجل التغييرات",
+        "license": "الترخيص",
+        "credits": "الاعتمادات",
+        "acknowledgments": "شكر وتقدير",
+        "copyright": "حقوق النشر",
+        "trademark": "العلامة التجارية",
+        "patent": "براءة الاختراع",
+        "disclaimer": "إخلاء المسؤولية",
+        "warranty": "الضمان",
+        "liability": "المسؤولية",
+        "indemnity": "التعويض",
+        "governance": "الحوكمة",
+        "compliance": "الامتثال",
+        "security": "الأمان",
+        "privacy_policy": "سياسة الخصوصية",
+        "terms_of_service": "شروط الخدمة",
+        "acceptable_use": "الاستخدام المقبول",
+        "code_of_conduct": "قواعد السلوك",
+        "ethics": "الأخلاقيات",
+        "values": "القيم",
+        "mission": "المهمة",
+        "vision": "الرؤية",
+        "strategy": "الاستراتيجية",
+        "objectives": "الأهداف",
+        "milestones": "المعالم",
+        "timeline": "الجدول الزمني",
+        "roadmap": "خارطة الطريق",
+        "blog": "المدونة",
+        "news": "الأخبار",
+        "events": "الفعاليات",
+        "webinars": "الندوات عبر الإنترنت",
+        "tutorials": "الدروس",
+        "guides": "الإرشادات",
+        "faq": "الأسئلة الشائعة",
+        "forum": "المنتدى",
+        "community": "المجتمع",
+        "social_media": "وسائل التواصل الاجتماعي",
+        "newsletter": "النشرة الإخبارية",
+        "subscribe": "اشتراك",
+        "unsubscribe": "إلغاء الاشتراك",
+        "preferences": "التفضيلات",
+        "account": "الحساب",
+        "billing": "الفواتير",
+        "payment": "الدفع",
+        "invoice": "الفاتورة",
+        "receipt": "الإيصال",
+        "refund": "استرداد",
+        "tax": "الضريبة",
+        "discount": "الخصم",
+        "coupon": "الكوبون",
+        "voucher": "القسيمة",
+        "credit": "الائتمان",
+        "debit": "الدين",
+        "balance": "الرصيد",
+        "transaction": "المعاملة",
+        "statement": "كشف الحساب",
+        "overview": "نظرة عامة",
+        "details": "تفاصيل",
+        "summary": "ملخص",
+        "statistics": "إحصائيات",
+        "metrics": "المقاييس",
+        "kpi": "مؤشرات الأداء الرئيسية",
+        "alerts": "التنبيهات",
+        "monitoring": "المراقبة",
+        "audit": "التدقيق",
+        "inspection": "التفتيش",
+        "certification": "الشهادة",
+        "accreditation": "الاعتماد",
+        "standard": "المعيار",
+        "protocol": "البروتوكول",
+        "procedure": "الإجراء",
+        "workflow": "سير العمل",
+        "pipeline": "خط الأنابيب",
+        "queue": "قائمة الانتظار",
+        "stack": "المكدس",
+        "heap": "الكومة",
+        "cache": "ذاكرة التخزين المؤقت",
+        "buffer": "المخزن المؤقت",
+        "registry": "السجل",
+        "repository": "المستودع",
+        "archive": "الأرشيف",
+        "recovery": "الاسترداد",
+        "migration": "الهجرة",
+        "upgrade": "الترقية",
+        "downgrade": "التخفيض",
+        "rollback": "التراجع",
+        "patch": "الترقيع",
+        "hotfix": "الإصلاح العاجل",
+        "release": "الإصدار",
+        "build": "البناء",
+        "deploy": "النشر",
+        "host": "المضيف",
+        "domain": "النطاق",
+        "server": "الخادم",
+        "client": "العميل",
+        "api": "واجهة برمجة التطبيقات",
+        "sdk": "مجموعة تطوير البرمجيات",
+        "library": "المكتبة",
+        "framework": "الإطار",
+        "platform": "المنصة",
+        "infrastructure": "البنية التحتية",
+        "cloud": "السحابة",
+        "edge": "الحافة",
+        "iot": "إنترنت الأشياء",
+        "ai": "الذكاء الاصطناعي",
+        "ml": "التعلم الآلي",
+        "dl": "التعلم العميق",
+        "nlp": "معالجة اللغة الطبيعية",
+        "cv": "رؤية الكمبيوتر",
+        "ar": "الواقع المعزز",
+        "vr": "الواقع الافتراضي",
+        "blockchain": "سلاسل الكتل",
+        "crypto": "التشفير",
+        "nft": "الرموز غير القابلة للاستبدال",
+        "metaverse": "الكون الافتراضي",
+        "web3": "الويب 3",
+        "dao": "المنظمة اللامركزية المستقلة",
+        "defi": "التمويل اللامركزي",
+        "gamefi": "ألعاب التمويل",
+        "socialfi": "التمويل الاجتماعي",
+        "learnfi": "تعليم التمويل",
+        "healthfi": "تمويل الصحة",
+        "govfi": "تمويل الحوكمة",
+        "regfi": "تمويل التنظيم",
+        "legaltech": "التكنولوجيا القانونية",
+        "fintech": "التكنولوجيا المالية",
+        "edtech": "تكنولوجيا التعليم",
+        "healthtech": "تكنولوجيا الصحة",
+        "agritech": "تكنولوجيا الزراعة",
+        "cleantech": "التكنولوجيا النظيفة",
+        "greentech": "التكنولوجيا الخضراء",
+        "spacetech": "تكنولوجيا الفضاء",
+        "oceantech": "تكنولوجيا المحيطات",
+        "biotech": "التكنولوجيا الحيوية",
+        "nanotech": "تكنولوجيا النانو",
+        "quantum": "الكم",
+        "fusion": "الاندماج",
+        "fission": "الانشطار",
+        "renewable": "المتجددة",
+        "sustainable": "المستدام",
+        "circular": "الدائرية",
+        "regenerative": "التجديدية",
+        "restorative": "الترميمية",
+        "conservation": "الحفظ",
+        "preservation": "الحفظ",
+        "restoration": "الترميم",
+        "remediation": "الإصلاح",
+        "rehabilitation": "إعادة التأهيل",
+        "reconstruction": "إعادة الإعمار",
+        "redevelopment": "إعادة التطوير",
+        "revitalization": "إحياء",
+        "renaissance": "نهضة",
+        "revolution": "ثورة",
+        "evolution": "تطور",
+        "innovation": "ابتكار",
+        "invention": "اختراع",
+        "discovery": "اكتشاف",
+        "exploration": "استكشاف",
+        "research": "بحث",
+        "development": "تطوير",
+        "engineering": "هندسة",
+        "science": "علم",
+        "technology": "تكنولوجيا",
+        "mathematics": "رياضيات",
+        "physics": "فيزياء",
+        "chemistry": "كيمياء",
+        "biology": "أحياء",
+        "geology": "جيولوجيا",
+        "astronomy": "فلك",
+        "meteorology": "الأرصاد الجوية",
+        "oceanography": "علوم المحيطات",
+        "seismology": "علم الزلازل",
+        "volcanology": "علم البراكين",
+        "paleontology": "علم الأحافير",
+        "archaeology": "علم الآثار",
+        "anthropology": "أنثروبولوجيا",
+        "sociology": "علم الاجتماع",
+        "psychology": "علم النفس",
+        "philosophy": "فلسفة",
+        "theology": "لاهوت",
+        "history": "تاريخ",
+        "geography": "جغرافيا",
+        "economics": "اقتصاد",
+        "politics": "سياسة",
+        "law": "قانون",
+        "medicine": "طب",
+        "nursing": "تمريض",
+        "pharmacy": "صيدلة",
+        "dentistry": "طب الأسنان",
+        "veterinary": "طب بيطري",
+        "agriculture": "زراعة",
+        "forestry": "حراجة",
+        "fisheries": "مصايد الأسماك",
+        "mining": "تعدين",
+        "manufacturing": "تصنيع",
+        "construction": "بناء",
+        "transportation": "نقل",
+        "communication": "اتصال",
+        "energy": "طاقة",
+        "water": "ماء",
+        "waste": "نفايات",
+        "environment": "بيئة",
+        "climate": "مناخ",
+        "weather": "طقس",
+        "air": "هواء",
+        "soil": "تربة",
+        "biodiversity": "تنوع حيوي",
+        "ecosystem": "نظام بيئي",
+        "habitat": "موطن",
+        "species": "نوع",
+        "genus": "جنس",
+        "family": "عائلة",
+        "order": "رتبة",
+        "class": "طائفة",
+        "phylum": "شعبة",
+        "kingdom": "مملكة",
+        "domain": "نطاق",
+        "life": "حياة",
+        "universe": "كون",
+        "galaxy": "مجرة",
+        "star": "نجم",
+        "planet": "كوكب",
+        "moon": "قمر",
+        "asteroid": "كويكب",
+        "comet": "مذنب",
+        "nebula": "سديم",
+        "black_hole": "ثقب أسود",
+        "wormhole": "ثقب دودي",
+        "multiverse": "أكوان متعددة",
+        "dimension": "بعد",
+        "time": "زمن",
+        "space": "فضاء",
+        "matter": "مادة",
+        "energy": "طاقة",
+        "force": "قوة",
+        "field": "حقل",
+        "particle": "جسيم",
+        "wave": "موجة",
+        "quantum": "كم",
+        "relativity": "نسبية",
+        "gravity": "جاذبية",
+        "electromagnetism": "كهرومغناطيسية",
+        "strong_force": "قوة نووية شديدة",
+        "weak_force": "قوة نووية ضعيفة",
+        "standard_model": "النموذج القياسي",
+        "string_theory": "نظرية الأوتار",
+        "m_theory": "نظرية إم",
+        "loop_quantum_gravity": "جاذبية كمية حلقية",
+        "causal_dynamical_triangulation": "تثليث ديناميكي سببي",
+        "asymptotic_safety": "سلامة مقاربية",
+        "holographic_principle": "مبدأ الهولوغرام",
+        "cosmic_censorship": "الرقابة الكونية",
+        "chronology_protection": "حماية التسلسل الزمني",
+        "anthropic_principle": "المبدأ الأنثروبي",
+        "fine_tuning": "ضبط دقيق",
+        "simulation_hypothesis": "فرضية المحاكاة",
+        "panspermia": "تبزر الشامل",
+        "abiogenesis": "نشأة الحياة من غير حياة",
+        "genetic_drift": "انحراف وراثي",
+        "gene_flow": "تدفق الجينات",
+        "mutation": "طفرة",
+        "speciation": "تكوين الأنواع",
+        "extinction": "انقراض",
+        "ecology": "علم البيئة",
+        "resilience": "مرونة",
+        "adaptation": "تكيف",
+        "mitigation": "تخفيف",
+        "reclamation": "استصلاح",
+        "reforestation": "إعادة تشجير",
+        "afforestation": "تشجير",
+        "desertification": "تصحر",
+        "deforestation": "إزالة الغابات",
+        "soil_erosion": "تآكل التربة",
+        "water_scarcity": "ندرة المياه",
+        "air_pollution": "تلوث الهواء",
+        "water_pollution": "تلوث المياه",
+        "soil_pollution": "تلوث التربة",
+        "noise_pollution": "تلوث ضوضائي",
+        "light_pollution": "تلوث ضوئي",
+        "thermal_pollution": "تلوث حراري",
+        "radioactive_pollution": "تلوث إشعاعي",
+        "plastic_pollution": "تلوث بلاستيكي",
+        "microplastic": "لدائن دقيقة",
+        "nanoplastic": "لدائن نانوية",
+        "greenhouse_gas": "غازات دفيئة",
+        "register_new_patient": "تسجيل مريض جديد",
+        "name_placeholder": "أدخل الاسم كاملاً",
+        "optional": "اختياري",
+        "notes_placeholder": "أي ملاحظات إضافية هنا...",
+        "save_data": "حفظ البيانات",
+        "cancel_and_back": "إلغاء والعودة",
+        "carbon_footprint": "بصمة كربونية",
+        "carbon_offset": "تعويض كربوني",
+        "carbon_credit": "رصيد كربوني",
+        "carbon_tax": "ضريبة كربون",
+        "emissions_trading": "تداول الانبعاثات",
+        "cap_and_trade": "الحد والتجارة",
+        "renewable_energy": "طاقة متجددة",
+        "solar_energy": "طاقة شمسية",
+        "wind_energy": "طاقة رياح",
+        "hydroelectric": "طاقة كهرومائية",
+        "geothermal": "طاقة حرارية أرضية",
+        "tidal_energy": "طاقة المد والجزر",
+        "wave_energy": "طاقة الأمواج",
+        "bioenergy": "طاقة حيوية",
+        "hydrogen": "هيدروجين",
+        "nuclear": "نووي",
+        "thorium": "ثوريوم",
+        "uranium": "يورانيوم",
+        "plutonium": "بلوتونيوم",
+        "deuterium": "ديوتيريوم",
+        "tritium": "تريتيوم",
+        "helium": "هيليوم",
+        "lithium": "ليثيوم",
+        "cobalt": "كوبالت",
+        "nickel": "نيكل",
+        "copper": "نحاس",
+        "zinc": "زنك",
+        "silver": "فضة",
+        "gold": "ذهب",
+        "platinum": "بلاتين",
+        "palladium": "بالاديوم",
+        "rhodium": "روديوم",
+        "iridium": "إيريديوم",
+        "osmium": "أوزميوم",
+        "ruthenium": "روثينيوم",
+        "rhenium": "رينيوم",
+        "tungsten": "تنغستن",
+        "molybdenum": "موليبدينوم",
+        "tantalum": "تانتالوم",
+        "niobium": "نيوبيوم",
+        "hafnium": "هافنيوم",
+        "zirconium": "زركونيوم",
+        "yttrium": "إتريوم",
+        "lanthanum": "لانثانوم",
+        "cerium": "سيريوم",
+        "praseodymium": "براسيوديميوم",
+        "neodymium": "نيوديميوم",
+        "promethium": "بروميثيوم",
+        "samarium": "ساماريوم",
+        "europium": "يوروبيوم",
+        "gadolinium": "جادولينيوم",
+        "terbium": "تيربيوم",
+        "dysprosium": "ديسبروسيوم",
+        "holmium": "هولميوم",
+        "erbium": "إربيوم",
+        "thulium": "ثوليوم",
+        "ytterbium": "إتيربيوم",
+        "lutetium": "لوتيتيوم",
+        "scandium": "سكانديوم",
+        "titanium": "تيتانيوم",
+        "vanadium": "فاناديوم",
+        "chromium": "كروم",
+        "manganese": "منغنيز",
+        "iron": "حديد",
+        "gallium": "غاليوم",
+        "germanium": "جرمانيوم",
+        "arsenic": "زرنيخ",
+        "selenium": "سيلينيوم",
+        "bromine": "بروم",
+        "krypton": "كريبتون",
+        "rubidium": "روبيديوم",
+        "strontium": "سترونشيوم",
+        "technetium": "تكنيشيوم",
+        "cadmium": "كادميوم",
+        "indium": "إنديوم",
+        "tin": "قصدير",
+        "antimony": "إثمد",
+        "tellurium": "تيلوريوم",
+        "iodine": "يود",
+        "xenon": "زينون",
+        "cesium": "سيزيوم",
+        "barium": "باريوم",
+        "protactinium": "بروتكتينيوم",
+        "neptunium": "نبتونيوم",
+        "americium": "أمريكيوم",
+        "curium": "كوريوم",
+        "berkelium": "بركليوم",
+        "californium": "كاليفورنيوم",
+        "einsteinium": "أينشتاينيوم",
+        "fermium": "فيرميوم",
+        "mendelevium": "مندليفيوم",
+        "nobelium": "نوبليوم",
+        "lawrencium": "لورنسيوم",
+        "rutherfordium": "رذرفورديوم",
+        "dubnium": "دوبنيوم",
+        "seaborgium": "سيبورغيوم",
+        "bohrium": "بوريوم",
+        "hassium": "هسيوم",
+        "meitnerium": "مايتنريوم",
+        "darmstadtium": "دارمشتاتيوم",
+        "roentgenium": "رونتجينيوم",
+        "copernicium": "كوبرنيسيوم",
+        "nihonium": "نيهونيوم",
+        "flerovium": "فليروفيوم",
+        "moscovium": "موسكوفيوم",
+        "livermorium": "ليفرموريوم",
+        "tennessine": "تينيسين",
+        "oganesson": "أوغانيسون",
+        # مفاتيح جديدة من القوالب
+        "quick_actions": "إجراءات سريعة",
+        "patient_list": "قائمة المرضى",
+        "portal": "البوابة",
+        "staff_perms": "صلاحيات الموظفين",
+        "view_finance": "عرض المالية",
+        "general_settings": "الإعدادات العامة",
+        "permissions_and_language": "صلاحيات وظهور اللغة",
+        "last_update": "آخر تحديث",
+        "orders_list": "قائمة طلبات التحاليل",
+        "pending_approval": "بانتظار الموافقة",
+        "copy": "نسخ",
+        "ready_to_publish": "جاهزة للنشر",
+        "waiting_approval": "بانتظار الاعتماد",
+        "in_lab": "قيد المختبر",
+        "view_file": "عرض الملف",
+        "copied": "تم النسخ بنجاح",
+        "new_order_registration": "تسجيل طلب تحليل جديد",
+        "patient_name_or_phone": "اسم المريض أو الهاتف",
+        "search_patient_placeholder": "ابحث عن مريض موجود أو أضف جديد",
+        "start_typing_to_search": "ابدأ بالكتابة للبحث عن مريض موجود",
+        "phone_help": "رقم الجوال (10-11 رقم)",
+        "test_example": "مثال: CBC - تحليل صورة دم كاملة",
+        "save_order": "حفظ الطلب",
+        "no_results_add_new": "لا توجد نتائج - سيتم إضافة مريض جديد",
+        "cbc_test": "تحليل صورة دم كاملة",
+        "fasting_sugar": "سكر صائم",
+        "postprandial_sugar": "سكر فاطر",
+        "liver_function": "وظائف كبد",
+        "kidney_function": "وظائف كلى",
+        "lipid_profile": "دهون",
+        "vitamin_d": "فيتامين D",
+        "tsh": "غدة درقية TSH",
+        "lab_management_system": "نظام إدارة المختبر",
+        "test_credentials": "معلومات تجريبية",
+        "patient_record": "سجل المرضى",
+        "full_list": "القائمة الكاملة",
+        "patient": "مريض",
+        "not_available": "غير متوفر",
+        "view_history": "عرض السجل",
+        "total_orders": "إجمالي الطلبات",
+        "ready_results": "النتائج الجاهزة",
+        "visit_and_test_history": "سجل الزيارات والتحاليل",
+        "ready": "جاهزة",
+        "in_process": "قيد المعالجة",
+        "lifetime_spend": "إجمالي المدفوعات",
+        "last_test": "آخر تحليل",
+        "older": "الأقدم",
+        "newest": "الأحدث",
+        "no_visits_registered": "لا توجد زيارات مسجلة",
+        "back_to_patients": "الرجوع لقائمة المرضى",
+        "patient_portal": "بوابة المرضى",
+        "result_inquiry": "استعلام عن نتائج التحاليل الطبية",
+        "enter_your_pin": "أدخل رقم الـ PIN الخاص بك",
+        "pin_help": "الرقم السري الموجود في إيصالك",
+        "pin_placeholder": "XXXXXXXX",
+        "search_for_result": "البحث عن النتيجة",
+        "searching": "جاري البحث...",
+        "your_result_ready": "نتيجتك جاهزة!",
+        "test_date": "تاريخ التحليل",
+        "note_text": "يرجى مراجعة طبيبك المختص لفهم النتائج بشكل صحيح",
+        "ensure": "تأكد من",
+        "ensure_list1": "إدخال رقم الـ PIN بشكل صحيح",
+        "ensure_list2": "أن النتيجة قد تم نشرها من قبل المختبر",
+        "sorry": "عذراً",
+        "current_username": "اسم المستخدم الحالي",
+        "new_password_optional": "كلمة سر جديدة (اتركها فارغة إذا لا تريد التغيير)",
+        "update_success": "تم تحديث البيانات بنجاح",
+        "username_taken": "اسم المستخدم هذا مستخدم من قبل",
+        "revenue_review": "مراجعة الإيرادات والحسابات",
+        "filter_by_date": "تصفية حسب التاريخ",
+        "total_revenue": "إجمالي الإيرادات",
+        "invoice_count": "عدد الفواتير",
+        "average_invoice": "متوسط الفاتورة",
+        "transaction_details": "تفاصيل المعاملات",
+        "amount": "المبلغ",
+        "no_transactions": "لا توجد معاملات في هذه الفترة",
+        "enter_pin_label": "الرقم السري للتقرير (PIN)",
+        "enter_phone_or_name": "رقم الهاتف أو اسم المريض",
+        "phone_or_name_placeholder": "أدخل رقم الهاتف المسجل لدينا",
+        "enter_phone_or_name_error": "يرجى إدخال رقم الهاتف أو الاسم للتحقق",
+        "ensure_list1": "التأكد من كتابة الرقم السري (PIN) بشكل صحيح.",
+        "ensure_list2": "التأكد من إدخال رقم الهاتف الذي زودتنا به عند التسجيل.",
+        "print_report": "طباعة التقرير",
+        "bulk_upload": "رفع نتائج مجمعة (ZIP أو عدة ملفات)",
+        "bulk_upload_done": "الملفات المحفوظة",
+        "approve_all_pending": "الموافقة على كل النتائج المنتظرة",
+        "by_test": "حسب التحليل",
+        "other_tests": "تحاليل خارج الكتالوج",
+        "add_test": "إضافة تحليل",
+        "upload_visit_result": "تقرير واحد لكل تحاليل الزيارة",
+        "audit_log": "سجل التدقيق",
+        "audit_action": "الإجراء",
+        "audit_entity": "النوع",
+        "audit_entity_id": "الرقم",
+        "audit_details": "التفاصيل",
+        "audit_verify": "التحقق من السجل",
+        "notify_result_ready": "{lab}: نتيجة {tests} جاهزة. رقم الدخول (PIN): {pin} {url}",
+        "result_trends": "تطور النتائج",
+        "analyte": "التحليل",
+        "last_result": "آخر نتيجة",
+        "reference_range": "المعدل الطبيعي",
+        "abnormal_count": "غير طبيعي",
+        "units": "الوحدة",
+        "result_flag": "ملاحظة",
+        "report_footer": "هذا التقرير صادر إلكترونياً من نظام المختبر",
+        "generate_result_report": "تقرير من نتائج الأجهزة",
+        "print_labels": "طباعة ملصقات العينات",
+        "todays_labels": "ملصقات اليوم",
+        "worklist": "قائمة عمل الفنيين",
+        "status_ordered": "بانتظار سحب العينة",
+        "status_collected": "بانتظار التحليل",
+        "status_resulted": "بانتظار الاعتماد",
+        "status_approved": "معتمد",
+        "status_published": "منشور",
+        "status_expired": "انتهت مدة الاحتفاظ",
+        "scan_tube": "امسح باركود الأنبوب أو اكتب الـ PIN",
+        "collect_specimen": "استلام العينة",
+        "waiting_time": "مدة الانتظار",
+        "collected_ok": "تم استلام",
+        "not_collected": "لا يوجد طلب بانتظار السحب بهذا الرقم",
+    },
+    "en": {
+        # English translations (simplified version with only essential keys)
+        "dashboard": "Dashboard",
+        "patients": "Patients",
+        "orders": "Orders",
+        "finance": "Finance",
+        "settings": "Settings",
+        "logout": "Logout",
+        "add_order": "Add Order",
+        "search": "Search",
+        "name": "Name",
+        "phone": "Phone",
+        "test": "Test",
+        "price": "Price",
+        "actions": "Actions",
+        "pending": "Pending",
+        "published": "Published",
+        "view": "View",
+        "edit": "Edit",
+        "delete": "Delete",
+        "upload_result": "Upload Result",
+        "approve": "Approve",
+        "welcome": "Welcome",
+        "today_orders": "Today's Orders",
+        "pending_results": "Pending Results",
+        "patient_count": "Patient Count",
+        "order_count": "Order Count",
+        "login": "Login",
+        "username": "Username",
+        "password": "Password",
+        "submit": "Submit",
+        "back": "Back",
+        "save": "Save",
+        "cancel": "Cancel",
+        "error": "Error",
+        "success": "Success",
+        "loading": "Loading...",
+        "no_data": "No Data",
+        "all_rights_reserved": "All Rights Reserved",
+        "search_patient": "Search patient...",
+        "patient_name": "Patient Name",
+        "currency": "EGP",
+        "status": "Status",
+        "date": "Date",
+        "download": "Download",
+        "total": "Total",
+        "from_date": "From Date",
+        "to_date": "To Date",
+        "profile": "Profile",
+        "enter_pin": "Enter PIN",
+        "check_result": "Check Result",
+        "result_not_found": "Result not found or not published yet",
+        "search_error": "An error occurred while searching",
+        "lab_name": "Lab Name",
+        "publish_link": "Publish Link",
+        "default_language": "Default Language",
+        "show_language": "Show language option to users",
+        "admin": "Admin",
+        "employee": "Employee",
+        "patient_history": "Patient History",
+        "age": "Age",
+        "gender": "Gender",
+        "male": "male",
+        "female": "female",
+        "address": "Address",
+        "notes": "Notes",
+        "last_visit": "Last Visit",
+        "pin": "PIN",
+        "created_at": "Created At",
+        "upload_file": "Upload File",
+        "all": "All",
+        "filter": "Filter",
+        "home": "Home",
+        "language": "Language",
+        "arabic": "Arabic",
+        "english": "English",
+        "change_language": "Change Language",
+        # مفاتيح جديدة من القوالب
+        "quick_actions": "Quick Actions",
+        "patient_list": "Patient List",
+        "portal": "Portal",
+        "staff_perms": "Staff Permissions",
+        "view_finance": "View Finance",
+        "general_settings": "General Settings",
+        "permissions_and_language": "Permissions and Language",
+        "last_update": "Last Update",
+        "save_changes": "Save Changes",
+        "Save Data": "Save Data",
+        "orders_list": "Orders List",
+        "pending_approval": "Pending Approval",
+        "copy": "Copy",
+        "patient_name": "Patient Name",
+        "test_name": "Test Name",
+        "Register New Patient": "Register New Patient",
+        "Cancel and Go Back": "Cancel and Go Back",
+        "ready_to_publish": "Ready to Publish",
+        "waiting_approval": "Waiting Approval",
+        "in_lab": "In Lab",
+        "view_file": "View File",
+        "approve_result": "Approve Result",
+        "copied": "Copied successfully",
+        "new_order_registration": "New Test Order Registration",
+        "patient_name_or_phone": "Patient Name or Phone",
+        "search_patient_placeholder": "Search for existing patient or add new",
+        "start_typing_to_search": "Start typing to search for an existing patient",
+        "phone_help": "Mobile number (10-11 digits)",
+        "test_example": "Example: CBC - Complete Blood Count",
+        "save_order": "Save Order",
+        "no_results_add_new": "No results - a new patient will be added",
+        "cbc_test": "Complete Blood Count",
+        "fasting_sugar": "Fasting Blood Sugar",
+        "postprandial_sugar": "Postprandial Blood Sugar",
+        "liver_function": "Liver Function Tests",
+        "kidney_function": "Kidney Function Tests",
+        "lipid_profile": "Lipid Profile",
+        "vitamin_d": "Vitamin D",
+        "tsh": "Thyroid TSH",
+        "lab_management_system": "Laboratory Management System",
+        "test_credentials": "Test Credentials",
+        "patient_record": "Patient Record",
+        "full_list": "Full List",
+        "patient": "patient",
+        "not_available": "Not Available",
+        "view_history": "View History",
+        "total_orders": "Total Orders",
+        "ready_results": "Ready Results",
+        "visit_and_test_history": "Visit and Test History",
+        "ready": "Ready",
+        "in_process": "In Process",
+        "lifetime_spend": "Lifetime Spend",
+        "last_test": "Last Test",
+        "older": "Older",
+        "newest": "Newest",
+        "no_visits_registered": "No visits registered",
+        "back_to_patients": "Back to Patients List",
+        "patient_portal": "Patient Portal",
+        "result_inquiry": "Medical Test Results Inquiry",
+        "enter_your_pin": "Enter your PIN number",
+        "pin_help": "The secret number on your receipt",
+        "pin_placeholder": "XXXXXXXX",
+        "search_for_result": "Search for Result",
+        "searching": "Searching...",
+        "enter_pin": "Please enter PIN number",
+        "your_result_ready": "Your result is ready!",
+        "test_date": "Test Date",
+        "note": "Note",
+        "note_text": "Please consult your specialist doctor to understand the results correctly",
+        "ensure": "Make sure",
+        "ensure_list1": "Enter the PIN correctly",
+        "ensure_list2": "The result has been published by the laboratory",
+        "sorry": "Sorry",
+        "current_username": "Current Username",
+        "new_password_optional": "New password (leave blank if you don't want to change)",
+        "update_success": "Data updated successfully",
+        "username_taken": "This username is already taken",
+        "revenue_review": "Revenue and Accounts Review",
+        "filter_by_date": "Filter by Date",
+        "total_revenue": "Total Revenue",
+        "invoice_count": "Invoice Count",
+        "average_invoice": "Average Invoice",
+        "transaction_details": "Transaction Details",
+        "amount": "Amount",
+        "register_new_patient": "Register New Patient",
+        "name_placeholder": "Enter full name",
+        "optional": "Optional",
+        "notes_placeholder": "Any extra notes here...",
+        "save_data": "Save Data",
+        "cancel_and_back": "Cancel and Go Back",
+        "no_transactions": "No transactions in this period",
+        "enter_pin_label": "Report PIN Code",
+        "enter_phone_or_name": "Phone Number or Patient Name",
+        "phone_or_name_placeholder": "Enter your registered phone number",
+        "enter_phone_or_name_error": "Please enter phone number or name to verify",
+        "ensure_list1": "Make sure the PIN code is entered correctly.",
+        "ensure_list2": "Make sure to enter the phone number you provided us.",
+        "print_report": "Print Report",
+        "bulk_upload": "Bulk result upload (ZIP or multiple files)",
+        "bulk_upload_done": "Files saved",
+        "approve_all_pending": "Approve all pending results",
+        "by_test": "By Test",
+        "other_tests": "Tests not in catalog",
+        "add_test": "Add test",
+        "upload_visit_result": "One report for the whole visit",
+        "audit_log": "Audit Log",
+        "audit_action": "Action",
+        "audit_entity": "Entity",
+        "audit_entity_id": "ID",
+        "audit_details": "Details",
+        "audit_verify": "Verify log",
+        "notify_result_ready": "{lab}: your {tests} result is ready. PIN: {pin} {url}",
+        "result_trends": "Result trends",
+        "analyte": "Analyte",
+        "last_result": "Last result",
+        "reference_range": "Reference range",
+        "abnormal_count": "Abnormal",
+        "result": "Result",
+        "units": "Units",
+        "result_flag": "Flag",
+        "report_footer": "This report was generated electronically by the laboratory system",
+        "generate_result_report": "Report from analyzer results",
+        "print_labels": "Print specimen labels",
+        "todays_labels": "Today's labels",
+        "worklist": "Technician worklist",
+        "status_ordered": "Awaiting collection",
+        "status_collected": "Awaiting analysis",
+        "status_resulted": "Awaiting approval",
+        "status_approved": "Approved",
+        "status_published": "Published",
+        "status_expired": "Expired",
+        "scan_tube": "Scan tube barcode or type the PIN",
+        "collect_specimen": "Collect specimen",
+        "waiting_time": "Waiting",
+        "collected_ok": "Collected",
+        "not_collected": "No order awaiting collection with this PIN",
+    }
+}